@@ -1,22 +1,45 @@
-from .deepseek import DeepseekNode, DeepseekAdvancedNode, DeepseekReasonerNode
-from .silicon_deepseek import SiliconDeepseekChat, SiliconDeepseekReasoner
+from .deepseek import DeepseekNode, DeepseekAdvancedNode, DeepseekBatchNode, DeepseekReasonerNode
+from .silicon_deepseek import SiliconDeepseekChat, SiliconDeepseekBatchChat, SiliconDeepseekReasoner
+from .router import DeepseekRouterNode, DeepseekFanoutNode
+from .bulk import DeepseekBulkJobNode
+from .transport import prewarm_from_config
+from .telemetry import register_routes
+
+# 如果配置了 prewarm，在导入时预热连接池
+prewarm_from_config()
+
+# 注册指标接口 /deepaide/metrics 和 /deepaide/metrics.jsonl
+register_routes()
 
 # 在模块级别定义这些映射
 NODE_CLASS_MAPPINGS = {
     "DeepseekNode": DeepseekNode,
     "DeepseekAdvancedNode": DeepseekAdvancedNode,
+    "DeepseekBatchNode": DeepseekBatchNode,
     "DeepseekReasonerNode": DeepseekReasonerNode,
     "SiliconDeepseekChat": SiliconDeepseekChat,
-    "SiliconDeepseekReasoner": SiliconDeepseekReasoner
+    "SiliconDeepseekBatchChat": SiliconDeepseekBatchChat,
+    "SiliconDeepseekReasoner": SiliconDeepseekReasoner,
+    "DeepseekRouterNode": DeepseekRouterNode,
+    "DeepseekFanoutNode": DeepseekFanoutNode,
+    "DeepseekBulkJobNode": DeepseekBulkJobNode
 }
 
 NODE_DISPLAY_NAME_MAPPINGS = {
     "DeepseekNode": "Deepseek Chat",
     "DeepseekAdvancedNode": "Deepseek Chat Advanced",
+    "DeepseekBatchNode": "Deepseek Batch Chat",
     "DeepseekReasonerNode": "Deepseek Reasoner",
     "SiliconDeepseekChat": "Silicon Deepseek Chat",
-    "SiliconDeepseekReasoner": "Silicon Deepseek Reasoner"
+    "SiliconDeepseekBatchChat": "Silicon Deepseek Batch Chat",
+    "SiliconDeepseekReasoner": "Silicon Deepseek Reasoner",
+    "DeepseekRouterNode": "Deepseek Router",
+    "DeepseekFanoutNode": "Deepseek Fan-out Compare",
+    "DeepseekBulkJobNode": "Deepseek Bulk Job"
 }
 
+# 前端扩展（流式输出预览）
+WEB_DIRECTORY = "./web"
+
 # 确保这些变量可以被ComfyUI导入
-__all__ = ['NODE_CLASS_MAPPINGS', 'NODE_DISPLAY_NAME_MAPPINGS'] 
+__all__ = ['NODE_CLASS_MAPPINGS', 'NODE_DISPLAY_NAME_MAPPINGS', 'WEB_DIRECTORY'] 
@@ -0,0 +1,34 @@
+import sys
+import inspect
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+# 异步执行：新版 ComfyUI 会 await 协程形式的节点函数，等待网络时可以继续执行其他节点。
+# 请求本身仍走线程中的同步实现（调度器、key 池、请求合并、会话都基于线程），
+# 这里只是把它放到独立的 IO 线程池中，不占用 ComfyUI 的执行线程
+
+_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="deepaide-io")
+
+
+def async_nodes_supported():
+    """ComfyUI 的 execution.execute 是协程函数时支持异步节点；不在 ComfyUI 中运行时返回 False"""
+    execution = sys.modules.get("execution")
+    return execution is not None and inspect.iscoroutinefunction(getattr(execution, "execute", None))
+
+
+# 节点的 FUNCTION：支持异步节点时用 execute_async，旧版 ComfyUI 仍然调用同步的 execute
+EXECUTE_FUNCTION = "execute_async" if async_nodes_supported() else "execute"
+
+
+async def run_blocking(fn, *args, **kwargs):
+    """在 IO 线程池中执行同步函数并等待结果"""
+    import asyncio
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(fn, *args, **kwargs))
+
+
+class AsyncExecuteMixin:
+    """为节点提供 execute 的异步版本"""
+
+    async def execute_async(self, **kwargs):
+        return await run_blocking(self.execute, **kwargs)
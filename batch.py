@@ -0,0 +1,77 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+from .telemetry import CallTrace, current_trace
+from .interrupt import RequestCancelled
+from .deadline import current_deadline, deadline_scope
+
+
+def parse_prompts(text):
+    """解析批量提示词：支持 JSON 数组或每行一个提示词"""
+    if isinstance(text, (list, tuple)):
+        return [str(p) for p in text if str(p).strip()]
+    stripped = text.strip()
+    if stripped.startswith("["):
+        try:
+            items = json.loads(stripped)
+            if isinstance(items, list):
+                return [item if isinstance(item, str) else json.dumps(item, ensure_ascii=False)
+                        for item in items]
+        except json.JSONDecodeError:
+            pass
+    return [line.strip() for line in stripped.splitlines() if line.strip()]
+
+
+def run_batch(fn, items, concurrency=4):
+    """并发执行 fn(item)，按输入顺序返回 (results, errors)"""
+    results = [""] * len(items)
+    errors = [""] * len(items)
+    if not items:
+        return results, errors
+
+    def _run(index):
+        try:
+            results[index] = fn(items[index])
+        except RequestCancelled:
+            # 被中断时整批停止，而不是记为单条错误
+            raise
+        except Exception as e:
+            errors[index] = f"Error: {str(e)}"
+
+    workers = max(1, min(int(concurrency), len(items)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="deepaide-batch") as pool:
+        list(pool.map(_run, range(len(items))))
+    return results, errors
+
+
+def parallel_choices(fn, count, provider, model):
+    """
+    服务商不支持 n 时，并行执行 count 次 fn(index)，每次返回一个候选。
+    各请求的 token 用量汇总到当前调用的 usage 上，任一请求失败时抛出异常。
+    """
+    traces = [CallTrace(provider, model, record=False) for _ in range(count)]
+    expires = current_deadline()
+
+    def _run(index):
+        with traces[index], deadline_scope(expires=expires):
+            return fn(index)
+
+    try:
+        with ThreadPoolExecutor(max_workers=count, thread_name_prefix="deepaide-candidates") as pool:
+            return list(pool.map(_run, range(count)))
+    finally:
+        parent = current_trace()
+        if parent is not None:
+            parent.merge(traces)
+
+
+def unwrap_list_inputs(kwargs, list_keys=("prompts",)):
+    """INPUT_IS_LIST 节点的参数都是列表，标量参数取第一个值"""
+    unwrapped = {}
+    for key, value in kwargs.items():
+        if key in list_keys:
+            unwrapped[key] = value
+        elif isinstance(value, list):
+            unwrapped[key] = value[0] if value else None
+        else:
+            unwrapped[key] = value
+    return unwrapped
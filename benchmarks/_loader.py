@@ -0,0 +1,19 @@
+import os
+import sys
+import importlib.util
+
+PACKAGE_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_package(name="deepaide"):
+    """像 ComfyUI 一样按路径加载节点包（目录名不是合法的模块名）"""
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.spec_from_file_location(
+        name, os.path.join(PACKAGE_ROOT, "__init__.py"),
+        submodule_search_locations=[PACKAGE_ROOT]
+    )
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
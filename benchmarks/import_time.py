@@ -0,0 +1,66 @@
+"""
+导入耗时基准：在全新的子进程中加载节点包，统计导入耗时、导入了哪些重量级依赖，以及节点实例化的开销。
+
+    python benchmarks/import_time.py --runs 10
+
+--eager 会在加载节点包时同时导入 openai 和 httpx，用来对比 SDK 在启动时就被导入的情况。
+"""
+import os
+import sys
+import json
+import argparse
+import subprocess
+import statistics
+
+HEAVY_MODULES = ("openai", "httpx", "pydantic", "requests", "sqlite3", "h2")
+
+_CHILD = r"""
+import sys, json, time
+sys.path.insert(0, {bench_dir!r})
+from _loader import load_package
+start = time.perf_counter()
+if {eager!r}:
+    import openai, httpx  # noqa: F401
+package = load_package()
+import_time = time.perf_counter() - start
+
+start = time.perf_counter()
+for _ in range({instances}):
+    for node_class in package.NODE_CLASS_MAPPINGS.values():
+        node_class()
+instance_time = (time.perf_counter() - start) / ({instances} * len(package.NODE_CLASS_MAPPINGS))
+
+print(json.dumps({{
+    "import": import_time,
+    "instance": instance_time,
+    "loaded": [m for m in {heavy!r} if m in sys.modules],
+}}))
+"""
+
+
+def run_once(eager, instances):
+    code = _CHILD.format(bench_dir=os.path.dirname(os.path.abspath(__file__)),
+                         eager=eager, instances=instances, heavy=HEAVY_MODULES)
+    output = subprocess.run([sys.executable, "-c", code], check=True,
+                            capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import-time benchmark for the DeepAide nodes")
+    parser.add_argument("--runs", type=int, default=10, help="fresh interpreter runs")
+    parser.add_argument("--instances", type=int, default=200, help="node instances created per class")
+    parser.add_argument("--eager", action="store_true", help="import openai and httpx before the package")
+    args = parser.parse_args()
+
+    results = [run_once(args.eager, args.instances) for _ in range(args.runs)]
+    imports = [r["import"] for r in results]
+    instances = [r["instance"] for r in results]
+    print(f"package import: median {statistics.median(imports) * 1000:.1f} ms, "
+          f"min {min(imports) * 1000:.1f} ms over {args.runs} runs")
+    print(f"node __init__:  median {statistics.median(instances) * 1e6:.1f} us")
+    print(f"heavy modules loaded at import: {', '.join(results[-1]['loaded']) or 'none'}")
+
+
+if __name__ == "__main__":
+    main()
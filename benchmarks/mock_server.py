@@ -0,0 +1,372 @@
+"""
+本地 OpenAI 兼容的 /chat/completions 模拟服务，用于离线基准测试。
+
+    python benchmarks/mock_server.py --port 8765 --latency 0.2 --token-rate 200
+
+支持可配置的首字节延迟、token 生成速度、流式输出、429 注入、reasoning_content 和前缀缓存命中统计，
+以及 OpenAI 兼容的 /files 和 /batches 批处理接口（提交后 batch_delay 秒完成）。
+"""
+import json
+import time
+import random
+import uuid
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+REASONING_MARKERS = ("reasoner", "R1", "Thinking", "GLM")
+
+
+class MockOptions:
+    def __init__(self, latency=0.05, token_rate=0.0, completion_tokens=32, reasoning_tokens=32,
+                 error_rate=0.0, retry_after=0.05, key_concurrency=0, batch_delay=0.2):
+        self.latency = latency                   # 首字节前的等待（秒）
+        self.token_rate = token_rate             # 每秒生成的 token 数，0 表示瞬间生成
+        self.completion_tokens = completion_tokens
+        self.reasoning_tokens = reasoning_tokens
+        self.error_rate = error_rate             # 返回 429 的概率
+        self.retry_after = retry_after
+        self.key_concurrency = key_concurrency   # 每个 API key 的并发上限，超过时返回 429，0 表示不限制
+        self.batch_delay = batch_delay           # 批处理任务从提交到完成的时间（秒）
+
+
+class QuietHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # 客户端断开连接（例如取消请求）不是错误
+        pass
+
+
+class MockStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.throttled = 0
+        self.server_time = 0.0
+        self.prefixes = set()
+        self.in_flight = {}
+        self.files = {}     # file_id -> 内容
+        self.batches = {}   # batch_id -> 批处理任务
+
+    def enter(self, key, limit):
+        """占用 key 的一个并发名额，超过上限时返回 False"""
+        with self.lock:
+            if limit and self.in_flight.get(key, 0) >= limit:
+                return False
+            self.in_flight[key] = self.in_flight.get(key, 0) + 1
+            return True
+
+    def leave(self, key):
+        with self.lock:
+            self.in_flight[key] -= 1
+
+    def prefix_cache_hit(self, messages):
+        """模拟服务商的前缀缓存：按消息边界查找已经见过的最长前缀，返回命中的 token 数"""
+        hit = tokens = 0
+        with self.lock:
+            for index, message in enumerate(messages):
+                tokens += _message_tokens(message)
+                key = json.dumps(messages[:index + 1], sort_keys=True)
+                if key in self.prefixes:
+                    hit = tokens
+                else:
+                    self.prefixes.add(key)
+        return hit
+
+    def record(self, elapsed, throttled=False):
+        with self.lock:
+            self.requests += 1
+            if throttled:
+                self.throttled += 1
+            else:
+                self.server_time += elapsed
+
+    def snapshot(self):
+        with self.lock:
+            served = self.requests - self.throttled
+            return {
+                "requests": self.requests,
+                "throttled": self.throttled,
+                "mean_server_time": self.server_time / served if served else 0.0,
+            }
+
+    def reset(self):
+        with self.lock:
+            self.requests = 0
+            self.throttled = 0
+            self.server_time = 0.0
+
+
+def _message_tokens(message):
+    return len(str(message.get("content", ""))) // 4 + 1
+
+
+def _is_reasoning_model(model):
+    return any(marker in model for marker in REASONING_MARKERS)
+
+
+def _completion(request, options, stats):
+    """返回 (reasoning_tokens, completion_tokens, n, usage)"""
+    model = request.get("model", "mock")
+    reasoning_tokens = options.reasoning_tokens if _is_reasoning_model(model) else 0
+    completion_tokens = min(options.completion_tokens, int(request.get("max_tokens") or 1 << 30))
+    n = int(request.get("n") or 1)
+    messages = request.get("messages", [])
+    prompt_tokens = sum(_message_tokens(m) for m in messages)
+    cache_hit = stats.prefix_cache_hit(messages)
+    usage = {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": (completion_tokens + reasoning_tokens) * n,
+        "total_tokens": prompt_tokens + (completion_tokens + reasoning_tokens) * n,
+        "prompt_cache_hit_tokens": cache_hit,
+        "prompt_cache_miss_tokens": prompt_tokens - cache_hit,
+        "completion_tokens_details": {"reasoning_tokens": reasoning_tokens * n},
+    }
+    return reasoning_tokens, completion_tokens, n, usage
+
+
+def _completion_body(request, reasoning_tokens, completion_tokens, n, usage):
+    message = {"role": "assistant", "content": "tok " * completion_tokens}
+    if reasoning_tokens:
+        message["reasoning_content"] = "think " * reasoning_tokens
+    return {
+        "id": "mock",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": request.get("model", "mock"),
+        "choices": [
+            {"index": i, "message": message, "finish_reason": "stop"} for i in range(n)
+        ],
+        "usage": usage,
+    }
+
+
+def _run_batch(batch, options, stats):
+    """处理批处理任务的每一行，生成输出文件；error_rate 对每一行生效"""
+    lines = []
+    for line in stats.files[batch["input_file_id"]].splitlines():
+        if not line.strip():
+            continue
+        item = json.loads(line)
+        if options.error_rate and random.random() < options.error_rate:
+            response = {"status_code": 429, "body": {"error": {"message": "rate limited (mock)"}}}
+        else:
+            body = item.get("body", {})
+            response = {"status_code": 200, "body": _completion_body(body, *_completion(body, options, stats))}
+        lines.append(json.dumps({"id": f"req-{uuid.uuid4().hex[:8]}", "custom_id": item.get("custom_id"),
+                                 "response": response, "error": None}))
+    output_id = f"file-{uuid.uuid4().hex[:12]}"
+    with stats.lock:
+        stats.files[output_id] = "\n".join(lines) + "\n"
+        batch.update(status="completed", output_file_id=output_id, completed_at=int(time.time()),
+                     request_counts={"total": len(lines), "completed": len(lines), "failed": 0})
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # 头和正文分开写入时，Nagle 算法与延迟 ACK 会额外引入约 40ms 的延迟
+    disable_nagle_algorithm = True
+    options = MockOptions()
+    stats = MockStats()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        path = self.path.rstrip("/")
+        if "/batches/" in path:
+            batch = self.stats.batches.get(path.rsplit("/", 1)[-1])
+            if batch is None:
+                self._send_json(404, {"error": {"message": "batch not found"}})
+            else:
+                self._send_json(200, batch)
+        elif "/files/" in path and path.endswith("/content"):
+            content = self.stats.files.get(path.split("/files/", 1)[1][:-len("/content")])
+            if content is None:
+                self._send_json(404, {"error": {"message": "file not found"}})
+                return
+            data = content.encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/jsonl")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        elif self.path.rstrip("/").endswith("/models"):
+            self._send_json(200, {"object": "list", "data": [{"id": "mock", "object": "model"}]})
+        elif self.path.rstrip("/").endswith("/stats"):
+            self._send_json(200, self.stats.snapshot())
+        else:
+            self._send_json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        start = time.perf_counter()
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length)
+        path = self.path.rstrip("/")
+        if path.endswith("/files"):
+            self._upload_file(body)
+            return
+        request = json.loads(body or b"{}")
+        if path.endswith("/batches"):
+            self._create_batch(request)
+            return
+        if not path.endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": "not found"}})
+            return
+
+        options = self.options
+        if options.error_rate and random.random() < options.error_rate:
+            self.stats.record(0.0, throttled=True)
+            self._send_json(429, {"error": {"message": "rate limited (mock)"}},
+                            {"Retry-After": str(options.retry_after)})
+            return
+
+        # 以 "invalid" 开头的 key 模拟无效账号
+        api_key = self.headers.get("Authorization", "").replace("Bearer ", "")
+        if api_key.startswith("invalid"):
+            self.stats.record(0.0, throttled=True)
+            self._send_json(401, {"error": {"message": "invalid api key (mock)"}})
+            return
+        if not self.stats.enter(api_key, options.key_concurrency):
+            self.stats.record(0.0, throttled=True)
+            self._send_json(429, {"error": {"message": "too many concurrent requests (mock)"}},
+                            {"Retry-After": str(options.retry_after)})
+            return
+        try:
+            self._complete(request, start)
+        finally:
+            self.stats.leave(api_key)
+
+    def _upload_file(self, body):
+        """multipart/form-data 上传，保存 file 字段的内容"""
+        from email.parser import BytesParser
+        from email.policy import HTTP
+        header = f"Content-Type: {self.headers.get('Content-Type')}\r\n\r\n".encode("utf-8")
+        message = BytesParser(policy=HTTP).parsebytes(header + body)
+        for part in message.iter_parts():
+            if part.get_param("name", header="content-disposition") == "file":
+                file_id = f"file-{uuid.uuid4().hex[:12]}"
+                with self.stats.lock:
+                    self.stats.files[file_id] = part.get_payload(decode=True).decode("utf-8")
+                self._send_json(200, {"id": file_id, "object": "file", "purpose": "batch"})
+                return
+        self._send_json(400, {"error": {"message": "missing file field"}})
+
+    def _create_batch(self, request):
+        if request.get("input_file_id") not in self.stats.files:
+            self._send_json(400, {"error": {"message": "input file not found"}})
+            return
+        batch = {
+            "id": f"batch_{uuid.uuid4().hex[:12]}",
+            "object": "batch",
+            "endpoint": request.get("endpoint"),
+            "input_file_id": request["input_file_id"],
+            "completion_window": request.get("completion_window", "24h"),
+            "status": "in_progress",
+            "output_file_id": None,
+            "error_file_id": None,
+            "created_at": int(time.time()),
+        }
+        with self.stats.lock:
+            self.stats.batches[batch["id"]] = batch
+        timer = threading.Timer(self.options.batch_delay, _run_batch, (batch, self.options, self.stats))
+        timer.daemon = True
+        timer.start()
+        self._send_json(200, batch)
+
+    def _complete(self, request, start):
+        options = self.options
+        reasoning_tokens, completion_tokens, n, usage = _completion(request, options, self.stats)
+        time.sleep(options.latency)
+
+        if request.get("stream"):
+            self._stream(request.get("model", "mock"), reasoning_tokens, completion_tokens, usage, n)
+        else:
+            if options.token_rate:
+                time.sleep((reasoning_tokens + completion_tokens) / options.token_rate)
+            self._send_json(200, _completion_body(request, reasoning_tokens, completion_tokens, n, usage))
+        self.stats.record(time.perf_counter() - start)
+
+    def _stream(self, model, reasoning_tokens, completion_tokens, usage, n=1):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        interval = 1.0 / self.options.token_rate if self.options.token_rate else 0.0
+
+        def _write(event):
+            data = b"data: " + (event if isinstance(event, bytes) else json.dumps(event).encode("utf-8")) + b"\n\n"
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            self.wfile.flush()
+
+        def _chunk(delta, finish_reason=None):
+            # n > 1 时每个事件同时带上所有候选的增量
+            return {"id": "mock", "object": "chat.completion.chunk", "model": model,
+                    "choices": [{"index": i, "delta": delta, "finish_reason": finish_reason} for i in range(n)]}
+
+        for _ in range(reasoning_tokens):
+            _write(_chunk({"reasoning_content": "think "}))
+            if interval:
+                time.sleep(interval)
+        for _ in range(completion_tokens):
+            _write(_chunk({"content": "tok "}))
+            if interval:
+                time.sleep(interval)
+        _write(_chunk({}, "stop"))
+        _write({"id": "mock", "object": "chat.completion.chunk", "model": model, "choices": [], "usage": usage})
+        _write(b"[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+
+def start_mock_server(host="127.0.0.1", port=0, options=None):
+    """在后台线程启动模拟服务，返回 (server, base_url)"""
+    handler = type("ConfiguredMockHandler", (MockHandler,), {
+        "options": options or MockOptions(),
+        "stats": MockStats(),
+    })
+    server = QuietHTTPServer((host, port), handler)
+    thread = threading.Thread(target=server.serve_forever, name="mock-server", daemon=True)
+    thread.start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock OpenAI-compatible chat completions server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds before the first byte")
+    parser.add_argument("--token-rate", type=float, default=0.0, help="tokens per second (0 = instant)")
+    parser.add_argument("--completion-tokens", type=int, default=32)
+    parser.add_argument("--reasoning-tokens", type=int, default=32)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="probability of a 429 response")
+    parser.add_argument("--retry-after", type=float, default=0.05)
+    parser.add_argument("--key-concurrency", type=int, default=0, help="concurrent requests allowed per API key")
+    parser.add_argument("--batch-delay", type=float, default=0.2, help="seconds until a submitted batch completes")
+    args = parser.parse_args()
+
+    options = MockOptions(args.latency, args.token_rate, args.completion_tokens,
+                          args.reasoning_tokens, args.error_rate, args.retry_after, args.key_concurrency,
+                          args.batch_delay)
+    server, url = start_mock_server(args.host, args.port, options)
+    print(f"Mock server listening on {url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""
+离线基准测试：启动本地模拟服务，驱动五个节点的 execute，统计客户端开销、吞吐、延迟分位数和内存。
+
+    python benchmarks/run_bench.py --requests 50 --concurrency 1,4,16
+    python benchmarks/run_bench.py --stream --error-rate 0.05 --output bench_output.txt
+    python benchmarks/run_bench.py --keys 4 --key-concurrency 2 --concurrency 16
+
+不需要网络和真实的 API key。
+"""
+import os
+import sys
+import json
+import time
+import resource
+import argparse
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from _loader import load_package  # noqa: E402
+from mock_server import MockOptions, start_mock_server  # noqa: E402
+
+# 每个节点的调用参数，关闭缓存和请求合并并清空历史，保证每次都真正发出请求
+SCENARIOS = {
+    "DeepseekNode": lambda stream: {
+        "prompt": "Describe a cat", "temperature": 0.7, "use_cache": False, "coalesce": False, "stream": stream,
+    },
+    "DeepseekAdvancedNode": lambda stream: {
+        "prompt": "Describe a cat", "temperature": 0.7, "use_cache": False, "coalesce": False, "stream": stream,
+    },
+    "DeepseekReasonerNode": lambda stream: {
+        "prompt": "Why is the sky blue?", "clear_history": True,
+        "use_cache": False, "coalesce": False, "stream": stream,
+    },
+    "SiliconDeepseekChat": lambda stream: {
+        "prompt": "Describe a cat", "model": "deepseek-ai/DeepSeek-V3.2-Exp",
+        "use_cache": False, "coalesce": False, "stream": stream,
+    },
+    "SiliconDeepseekReasoner": lambda stream: {
+        "prompt": "Why is the sky blue?", "model": "deepseek-ai/DeepSeek-R1",
+        "clear_history": True, "use_cache": False, "coalesce": False, "stream": stream,
+    },
+}
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def _fetch_server_stats(client, base_url):
+    return client.get(f"{base_url}/stats").json()
+
+
+def run_scenario(package, node_name, base_url, requests, concurrency, stream, keys=1):
+    node_class = package.NODE_CLASS_MAPPINGS[node_name]
+    kwargs = SCENARIOS[node_name](stream)
+
+    # 多个工作线程共用一个节点实例时，reasoner 的本地会话会串行化请求，所以每个线程各用一个实例
+    def _make_node():
+        node = node_class()
+        node.api_key = "bench" if keys == 1 else [f"bench-{i}" for i in range(keys)]
+        node.base_url = base_url
+        return node
+
+    nodes = [_make_node() for _ in range(concurrency)]
+    latencies = []
+    errors = 0
+
+    def _call(index):
+        node = nodes[index % concurrency]
+        start = time.perf_counter()
+        result = node.execute(**kwargs)
+        elapsed = time.perf_counter() - start
+        failed = any(isinstance(v, str) and ("Error" in v or "错误" in v) for v in result)
+        return elapsed, failed
+
+    # 预热：首次调用会导入 SDK 并建立连接，不计入统计
+    for index in range(concurrency):
+        _call(index)
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for elapsed, failed in pool.map(_call, range(requests)):
+            latencies.append(elapsed)
+            errors += failed
+    wall = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "node": node_name,
+        "concurrency": concurrency,
+        "requests": requests,
+        "errors": errors,
+        "throughput": requests / wall if wall else 0.0,
+        "p50": percentile(latencies, 0.50),
+        "p95": percentile(latencies, 0.95),
+        "p99": percentile(latencies, 0.99),
+        "mean": sum(latencies) / len(latencies) if latencies else 0.0,
+        "peak_traced_kb": peak / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark for the DeepAide nodes")
+    parser.add_argument("--requests", type=int, default=50, help="requests per node and concurrency level")
+    parser.add_argument("--concurrency", default="1,4,16", help="comma separated concurrency levels")
+    parser.add_argument("--nodes", default=",".join(SCENARIOS), help="comma separated node names")
+    parser.add_argument("--stream", action="store_true", help="benchmark the streaming path")
+    parser.add_argument("--latency", type=float, default=0.05, help="mock server latency before the first byte")
+    parser.add_argument("--token-rate", type=float, default=0.0, help="mock tokens per second (0 = instant)")
+    parser.add_argument("--completion-tokens", type=int, default=32)
+    parser.add_argument("--reasoning-tokens", type=int, default=32)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="probability of an injected 429")
+    parser.add_argument("--keys", type=int, default=1, help="number of API keys in the key pool")
+    parser.add_argument("--key-concurrency", type=int, default=0,
+                        help="per-key concurrency enforced by the mock server and configured on the client")
+    parser.add_argument("--output", help="also write results as JSON lines to this file")
+    args = parser.parse_args()
+
+    options = MockOptions(args.latency, args.token_rate, args.completion_tokens,
+                          args.reasoning_tokens, args.error_rate, key_concurrency=args.key_concurrency)
+    server, base_url = start_mock_server(options=options)
+    if args.key_concurrency:
+        # rate_limits 是单个账号的限额，通过环境变量覆盖配置
+        for provider in ("DEEPSEEK", "SILICONFLOW"):
+            os.environ[f"DEEPAIDE_RATE_LIMITS__{provider}__MAX_CONCURRENCY"] = str(args.key_concurrency)
+    package = load_package()
+
+    import httpx
+    stats_client = httpx.Client()
+
+    results = []
+    header = (f"{'node':<26}{'conc':>5}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+              f"{'overhead ms':>13}{'errors':>8}{'peak KB':>10}")
+    print(header)
+    print("-" * len(header))
+    for node_name in args.nodes.split(","):
+        for concurrency in (int(c) for c in args.concurrency.split(",")):
+            server.RequestHandlerClass.stats.reset()
+            result = run_scenario(package, node_name, base_url, args.requests, concurrency, args.stream,
+                                  args.keys)
+            server_stats = _fetch_server_stats(stats_client, base_url)
+            # 客户端开销 = 端到端平均延迟 - 模拟服务端的平均处理时间
+            result["server_time"] = server_stats["mean_server_time"]
+            result["throttled"] = server_stats["throttled"]
+            result["client_overhead"] = max(0.0, result["mean"] - server_stats["mean_server_time"])
+            results.append(result)
+            print(f"{node_name:<26}{concurrency:>5}{result['throughput']:>9.1f}"
+                  f"{result['p50'] * 1000:>9.1f}{result['p95'] * 1000:>9.1f}{result['p99'] * 1000:>9.1f}"
+                  f"{result['client_overhead'] * 1000:>13.2f}{result['errors']:>8}{result['peak_traced_kb']:>10.0f}")
+
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(f"\nmax RSS: {max_rss / 1024:.1f} MB")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            for result in results:
+                f.write(json.dumps(result) + "\n")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,557 @@
+import os
+import csv
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .config import get_credentials
+from .keypool import parse_keys
+from .transport import get_http_client
+from .telemetry import CallTrace, normalize_usage
+from .interrupt import RequestCancelled, POLL_INTERVAL, check_interrupt, interruptible_sleep
+from .aio import AsyncExecuteMixin, EXECUTE_FUNCTION
+from .deepseek import DeepseekAdvancedNode
+from .silicon_deepseek import SiliconDeepseekChat, CHAT_MODELS
+
+# 批量任务：逐行读取 CSV/JSONL 提示词文件，用聊天节点相同的请求逻辑（缓存、合并、限速、key 池）
+# 有界并发地处理，每完成一行就追加写入 JSONL，并记录检查点，任务中断后可以从断点继续
+
+MODES = ("direct", "batch_api")
+
+DEFAULT_MODELS = {
+    "siliconflow": CHAT_MODELS[0],
+    "deepseek": "deepseek-chat",
+}
+
+# 检查点最多每隔这么久写一次（秒）；两次写入之间完成的行在续跑时从输出文件末尾恢复
+CHECKPOINT_INTERVAL = 1.0
+PROGRESS_INTERVAL = 10.0
+
+# 批处理任务的终止状态
+BATCH_FINAL_STATES = ("completed", "failed", "expired", "cancelled")
+
+
+def iter_prompt_file(path, prompt_field="prompt", offset=0, start=0):
+    """
+    逐行读取提示词文件（不把整个文件读进内存），依次返回 (index, row, offset)，offset 为该行在文件中的字节位置。
+    .csv 按表头取 prompt_field 列；.jsonl 每行是 JSON 对象（取 prompt_field）或字符串；
+    其他文件每行一个提示词。空行不计入 index。row 中的 prompt 为提示词，其余字段原样保留（如 id、system_prompt）。
+    传入之前返回的 offset 和对应的 index（start）时从这一行开始读，不再扫描前面的内容。
+    """
+    ext = os.path.splitext(path)[1].lower()
+    with open(path, "rb") as f:
+        position = [0]
+
+        def _lines():
+            while True:
+                line = f.readline()
+                if not line:
+                    return
+                position[0] += len(line)
+                yield line.decode("utf-8")
+
+        lines = _lines()
+        if ext == ".csv":
+            # 表头总是从文件开头读；csv 模块按需逐行读取，position 始终停在已解析的行末
+            fieldnames = next(csv.reader(lines), None)
+            if fieldnames is None:
+                return
+        if offset:
+            f.seek(offset)
+            position[0] = offset
+        if ext == ".csv":
+            items = csv.DictReader(lines, fieldnames=fieldnames)
+        elif ext in (".jsonl", ".ndjson"):
+            items = (json.loads(line) for line in lines if line.strip())
+        else:
+            items = (line.strip() for line in lines if line.strip())
+        index = start
+        while True:
+            row_offset = position[0]
+            try:
+                item = next(items)
+            except StopIteration:
+                return
+            if isinstance(item, dict):
+                row = dict(item)
+                row["prompt"] = item.get(prompt_field) or ""
+            else:
+                row = {"prompt": str(item)}
+            yield index, row, row_offset
+            index += 1
+
+
+class Checkpoint:
+    """
+    任务进度：next 之前的行都已处理（成功或失败），done 为 next 之后已处理的行，
+    failed 为失败的行（续跑时重试），offset 为记录时输出文件的大小，
+    batches 为批处理模式下已提交、尚未取回结果的任务 {batch_id: {"indices": [index, ...], "offset", "start"}}，
+    offset 和 start 为任务第一行在输入文件中的字节位置和 index，取回结果时从这里重新读取提示词。
+    """
+
+    def __init__(self, path, input_path=None):
+        self.path = path
+        self.input = input_path
+        self.next = 0
+        self.done = set()
+        self.failed = set()
+        self.offset = 0
+        self.batches = {}
+
+    @classmethod
+    def load(cls, path, input_path=None):
+        checkpoint = cls(path, input_path)
+        if not os.path.exists(path):
+            return checkpoint
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if input_path and data.get("input") and os.path.abspath(data["input"]) != os.path.abspath(input_path):
+            print(f"Warning: checkpoint {path} was written for {data['input']}")
+        checkpoint.next = data.get("next", 0)
+        checkpoint.done = set(data.get("done", []))
+        checkpoint.failed = set(data.get("failed", []))
+        checkpoint.offset = data.get("offset", 0)
+        checkpoint.batches = {
+            # 旧版检查点只记录了 index 列表，只能从文件开头读取
+            batch_id: batch if isinstance(batch, dict) else {"indices": batch, "offset": 0, "start": 0}
+            for batch_id, batch in data.get("batches", {}).items()
+        }
+        return checkpoint
+
+    def save(self):
+        data = {
+            "input": self.input,
+            "next": self.next,
+            "done": sorted(self.done),
+            "failed": sorted(self.failed),
+            "offset": self.offset,
+            "batches": self.batches,
+        }
+        # 先写临时文件再替换，崩溃时不会留下写了一半的检查点
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.path)
+
+    def settle(self, index):
+        if index < self.next:
+            return
+        self.done.add(index)
+        while self.next in self.done:
+            self.done.remove(self.next)
+            self.next += 1
+
+    def is_pending(self, index):
+        return not (index < self.next or index in self.done) or index in self.failed
+
+
+class RowRunner:
+    """用聊天节点的参数构建和请求逻辑处理单行提示词"""
+
+    def __init__(self, provider="siliconflow", model="", system_prompt="You are a helpful assistant",
+                 temperature=0.7, max_tokens=512, seed=0, use_cache=True):
+        if provider not in DEFAULT_MODELS:
+            raise ValueError(f"Unknown provider: {provider}")
+        self.provider = provider
+        self.model = model or DEFAULT_MODELS[provider]
+        self.system_prompt = system_prompt
+        self.temperature = temperature
+        self.max_tokens = max_tokens
+        self.seed = seed
+        self.use_cache = use_cache
+        self.node = DeepseekAdvancedNode() if provider == "deepseek" else SiliconDeepseekChat()
+
+    def build(self, row):
+        """构建请求参数，行中的 system_prompt 字段优先"""
+        if not row["prompt"]:
+            raise ValueError("Empty prompt")
+        system_prompt = row.get("system_prompt") or self.system_prompt
+        if self.provider == "deepseek":
+            params = self.node.build_params(row["prompt"], system_prompt, self.temperature, self.max_tokens)
+            params["model"] = self.model
+            return params
+        return self.node.build_payload(row["prompt"], self.model, system_prompt, self.temperature, self.max_tokens)
+
+    def run(self, row):
+        trace = CallTrace(self.provider, self.model)
+        with trace:
+            answers, finish_reasons = self.node.generate_choices(self.build(row), seed=self.seed,
+                                                                 use_cache=self.use_cache)
+        return {"answer": answers[0], "finish_reason": finish_reasons[0],
+                "usage": trace.usage, "cached": trace.cached}
+
+
+class BulkJob:
+    """
+    处理一个提示词文件，成功的行写入 output_path（JSONL），失败的行写入同名的 .errors.jsonl，
+    进度保存在 .checkpoint.json。再次运行同一任务时跳过已完成的行，重试失败的行。
+    """
+
+    def __init__(self, input_path, output_path, runner, prompt_field="prompt", concurrency=8,
+                 mode="direct", batch_size=1000, poll_interval=30.0, checkpoint_path=None):
+        if mode not in MODES:
+            raise ValueError(f"Unknown mode: {mode}")
+        self.input_path = input_path
+        self.output_path = output_path
+        self.errors_path = os.path.splitext(output_path)[0] + ".errors.jsonl"
+        self.checkpoint_path = checkpoint_path or output_path + ".checkpoint.json"
+        self.runner = runner
+        self.prompt_field = prompt_field
+        self.concurrency = max(1, int(concurrency))
+        self.mode = mode
+        self.batch_size = max(1, int(batch_size))
+        self.poll_interval = poll_interval
+        self.lock = threading.Lock()
+        self.stats = {"succeeded": 0, "failed": 0, "skipped": 0}
+        self.checkpoint = None
+        self.output = None
+        self.errors = None
+        self.last_save = 0.0
+        self.last_progress = 0.0
+
+    def _open(self):
+        self.checkpoint = Checkpoint.load(self.checkpoint_path, self.input_path)
+        self._recover_output()
+        self.output = open(self.output_path, "ab")
+        self.errors = open(self.errors_path, "a", encoding="utf-8")
+        self.start = self.last_progress = time.monotonic()
+
+    def _recover_output(self):
+        """
+        检查点之后又写入输出文件的行也算已完成；最后一行不完整（写入时崩溃）时截掉。
+        """
+        if not os.path.exists(self.output_path):
+            return
+        size = os.path.getsize(self.output_path)
+        offset = self.checkpoint.offset
+        if size < offset:
+            print(f"Warning: {self.output_path} is shorter than recorded in the checkpoint")
+            self.checkpoint.offset = size
+            return
+        if size == offset:
+            return
+        with open(self.output_path, "rb+") as f:
+            f.seek(offset)
+            tail = f.read()
+            complete = tail[:tail.rfind(b"\n") + 1]
+            for line in complete.splitlines():
+                if line.strip():
+                    index = json.loads(line)["index"]
+                    self.checkpoint.failed.discard(index)
+                    self.checkpoint.settle(index)
+            if len(complete) < len(tail):
+                f.truncate(offset + len(complete))
+        self.checkpoint.offset = offset + len(complete)
+
+    def _close(self):
+        for f in (self.output, self.errors):
+            if f is not None:
+                f.close()
+        if self.checkpoint is not None:
+            self.checkpoint.save()
+
+    def _pending_rows(self):
+        for index, row, offset in iter_prompt_file(self.input_path, self.prompt_field):
+            if self.checkpoint.is_pending(index):
+                yield index, row, offset
+            else:
+                self.stats["skipped"] += 1
+
+    def _record(self, index, row, result=None, error=None):
+        """写入一行结果并更新检查点"""
+        record = {"index": index, "id": row.get("id"), "prompt": row["prompt"]}
+        with self.lock:
+            if error is None:
+                record.update(result)
+                self.output.write((json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8"))
+                self.output.flush()
+                self.checkpoint.offset = self.output.tell()
+                self.checkpoint.failed.discard(index)
+                self.stats["succeeded"] += 1
+            else:
+                record["error"] = error
+                self.errors.write(json.dumps(record, ensure_ascii=False) + "\n")
+                self.errors.flush()
+                self.checkpoint.failed.add(index)
+                self.stats["failed"] += 1
+            self.checkpoint.settle(index)
+            now = time.monotonic()
+            if now - self.last_save >= CHECKPOINT_INTERVAL:
+                self.checkpoint.save()
+                self.last_save = now
+            if now - self.last_progress >= PROGRESS_INTERVAL:
+                self.last_progress = now
+                finished = self.stats["succeeded"] + self.stats["failed"]
+                print(f"[bulk] {finished} rows done ({self.stats['failed']} failed), "
+                      f"{finished / max(now - self.start, 1e-9):.1f} rows/s")
+
+    def run(self):
+        """运行任务，返回统计信息；被 ComfyUI 中断时保存进度后抛出 RequestCancelled"""
+        self._open()
+        try:
+            if self.mode == "batch_api":
+                self._run_batch_api()
+            else:
+                self._run_direct()
+        finally:
+            self._close()
+        return dict(self.stats, output=self.output_path, elapsed=round(time.monotonic() - self.start, 3))
+
+    def _run_direct(self):
+        # 在途的行数有上限，提示词文件边读边提交
+        window = threading.Semaphore(self.concurrency * 2)
+        cancelled = []
+
+        def _process(index, row):
+            try:
+                result = self.runner.run(row)
+            except RequestCancelled:
+                cancelled.append(index)  # 未完成的行保持待处理
+            except Exception as e:
+                self._record(index, row, error=str(e))
+            else:
+                self._record(index, row, result)
+            finally:
+                window.release()
+
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="deepaide-bulk") as pool:
+            for index, row, _ in self._pending_rows():
+                while not window.acquire(timeout=POLL_INTERVAL):
+                    check_interrupt()
+                check_interrupt()
+                pool.submit(_process, index, row)
+        if cancelled:
+            raise RequestCancelled()
+
+    def _batch_api(self, method, path, **kwargs):
+        response = self.client.request(method, f"{self.base_url}{path}",
+                                       headers={"Authorization": f"Bearer {self.api_key}"}, **kwargs)
+        response.raise_for_status()
+        return response
+
+    def _run_batch_api(self):
+        """
+        通过服务商的批处理接口（OpenAI 兼容的 /files + /batches）提交：每 batch_size 行一个任务，
+        提交后立即记入检查点，续跑时继续等待这些任务而不是重新提交。
+        检查点只记录每个任务的 index 和输入文件中的位置，取回结果时再从输入文件读取提示词，
+        内存占用不随输入文件的大小增长。
+        """
+        base_url, api_key = get_credentials(self.runner.provider)
+        keys = parse_keys(api_key)
+        if not keys:
+            raise ValueError(f"API key for {self.runner.provider} is not configured")
+        # 批处理任务属于提交它的账号，只使用第一个 key
+        self.base_url, self.api_key = base_url, keys[0][0]
+        self.client = get_http_client(self.base_url, self.api_key)
+
+        submitted = {index for batch in self.checkpoint.batches.values() for index in batch["indices"]}
+        chunk = []
+        for index, row, offset in self._pending_rows():
+            if index in submitted:
+                continue
+            try:
+                params = self.runner.build(row)
+            except Exception as e:
+                self._record(index, row, error=str(e))
+                continue
+            if not chunk:
+                chunk_start = (offset, index)
+            chunk.append((index, params))
+            if len(chunk) >= self.batch_size:
+                self._submit_batch(chunk, *chunk_start)
+                chunk = []
+        if chunk:
+            self._submit_batch(chunk, *chunk_start)
+
+        while self.checkpoint.batches:
+            for batch_id in list(self.checkpoint.batches):
+                batch = self._batch_api("GET", f"/batches/{batch_id}").json()
+                if batch.get("status") in BATCH_FINAL_STATES:
+                    self._collect_batch(batch)
+            if self.checkpoint.batches:
+                interruptible_sleep(self.poll_interval)
+
+    def _submit_batch(self, chunk, offset, start):
+        lines = [json.dumps({"custom_id": str(index), "method": "POST", "url": "/v1/chat/completions",
+                             "body": dict(params, stream=False)}, ensure_ascii=False)
+                 for index, params in chunk]
+        data = ("\n".join(lines) + "\n").encode("utf-8")
+        upload = self._batch_api("POST", "/files", data={"purpose": "batch"},
+                                 files={"file": ("batch.jsonl", data, "application/jsonl")}).json()
+        batch = self._batch_api("POST", "/batches", json={
+            "input_file_id": upload["id"],
+            "endpoint": "/v1/chat/completions",
+            "completion_window": "24h",
+        }).json()
+        with self.lock:
+            self.checkpoint.batches[batch["id"]] = {"indices": [index for index, _ in chunk],
+                                                    "offset": offset, "start": start}
+            self.checkpoint.save()
+        print(f"[bulk] submitted batch {batch['id']} with {len(chunk)} rows")
+
+    def _read_batch_rows(self, entry):
+        """从任务第一行的位置开始重新读取它的行，读到最后一行为止"""
+        wanted = set(entry["indices"])
+        rows = {}
+        if not wanted:
+            return rows
+        last = max(wanted)
+        for index, row, _ in iter_prompt_file(self.input_path, self.prompt_field, entry["offset"], entry["start"]):
+            if index in wanted:
+                rows[index] = {"id": row.get("id"), "prompt": row["prompt"]}
+            if index >= last:
+                break
+        return rows
+
+    def _collect_batch(self, batch):
+        entry = self.checkpoint.batches[batch["id"]]
+        rows = self._read_batch_rows(entry)
+        results = {}
+        for file_id in (batch.get("output_file_id"), batch.get("error_file_id")):
+            if not file_id:
+                continue
+            content = self._batch_api("GET", f"/files/{file_id}/content").text
+            for line in content.splitlines():
+                if line.strip():
+                    item = json.loads(line)
+                    results[int(item["custom_id"])] = item
+
+        for index in entry["indices"]:
+            # 输入文件在提交后被改动时可能找不到对应的行
+            row = rows.get(index, {"id": None, "prompt": ""})
+            item = results.get(index)
+            response = (item or {}).get("response") or {}
+            if item is None:
+                self._record(index, row, error=f"Batch {batch['id']} {batch.get('status')} without a result")
+            elif item.get("error") or response.get("status_code") != 200:
+                self._record(index, row, error=json.dumps(item.get("error") or response.get("body"),
+                                                          ensure_ascii=False))
+            else:
+                body = response["body"]
+                choice = body["choices"][0]
+                self._record(index, row, {"answer": choice["message"]["content"],
+                                          "finish_reason": choice.get("finish_reason") or "",
+                                          "usage": normalize_usage(body.get("usage")), "cached": False})
+        with self.lock:
+            del self.checkpoint.batches[batch["id"]]
+            self.checkpoint.save()
+        print(f"[bulk] batch {batch['id']} {batch.get('status')}")
+
+
+class DeepseekBulkJobNode(AsyncExecuteMixin):
+    @classmethod
+    def INPUT_TYPES(s):
+        return {
+            "required": {
+                "input_path": ("STRING", {
+                    "default": "",
+                    "tooltip": "提示词文件（.csv / .jsonl，或每行一个提示词的文本文件）"
+                }),
+                "output_path": ("STRING", {
+                    "default": "",
+                    "tooltip": "结果文件（JSONL），同目录下保存检查点和失败记录"
+                }),
+                "provider": (list(DEFAULT_MODELS.keys()), {"default": "siliconflow"}),
+                "system_prompt": ("STRING", {
+                    "multiline": True,
+                    "default": "You are a helpful assistant"
+                }),
+            },
+            "optional": {
+                "model": ("STRING", {
+                    "default": "",
+                    "tooltip": "模型名称（留空使用服务商的默认对话模型）"
+                }),
+                "prompt_field": ("STRING", {
+                    "default": "prompt",
+                    "tooltip": "CSV 列名或 JSONL 字段名"
+                }),
+                "mode": (MODES, {
+                    "default": "direct",
+                    "tooltip": "direct：逐行并发请求；batch_api：通过服务商的批处理接口提交（价格更低，完成时间更长）"
+                }),
+                "concurrency": ("INT", {
+                    "default": 8,
+                    "min": 1,
+                    "max": 64,
+                    "step": 1,
+                    "tooltip": "最大并发请求数"
+                }),
+                "batch_size": ("INT", {
+                    "default": 1000,
+                    "min": 1,
+                    "max": 50000,
+                    "step": 100,
+                    "tooltip": "batch_api 模式下每个批处理任务的行数"
+                }),
+                "temperature": ("FLOAT", {
+                    "default": 0.7,
+                    "min": 0.0,
+                    "max": 2.0,
+                    "step": 0.1,
+                    "tooltip": "创造性（越大越有创意，越小越严谨）"
+                }),
+                "max_tokens": ("INT", {
+                    "default": 512,
+                    "min": 1,
+                    "max": 8192,
+                    "step": 1,
+                    "tooltip": "最大输出长度"
+                }),
+                "use_cache": ("BOOLEAN", {
+                    "default": True,
+                    "tooltip": "相同请求直接返回缓存结果"
+                }),
+            }
+        }
+
+    RETURN_TYPES = ("STRING", "STRING",)
+    RETURN_NAMES = ("output_path", "summary",)
+    FUNCTION = EXECUTE_FUNCTION
+    OUTPUT_NODE = True
+    CATEGORY = "💎DeepAide"
+
+    @classmethod
+    def IS_CHANGED(s, **kwargs):
+        # 每次都运行：已完成的任务再次运行时只会跳过所有行
+        return float("nan")
+
+    def execute(self, input_path, output_path, provider="siliconflow", system_prompt="You are a helpful assistant",
+                model="", prompt_field="prompt", mode="direct", concurrency=8, batch_size=1000,
+                temperature=0.7, max_tokens=512, use_cache=True):
+        try:
+            runner = RowRunner(provider, model, system_prompt, temperature, max_tokens, use_cache=use_cache)
+            job = BulkJob(input_path, output_path, runner, prompt_field, concurrency, mode, batch_size)
+            summary = job.run()
+            return (output_path, json.dumps(summary, ensure_ascii=False),)
+        except RequestCancelled:
+            # 进度已保存在检查点，中断交给 ComfyUI 处理
+            raise
+        except Exception as e:
+            return (f"Error: {str(e)}", "{}",)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a resumable bulk job over a CSV/JSONL prompt file")
+    parser.add_argument("input", help="prompt file (.csv, .jsonl or one prompt per line)")
+    parser.add_argument("output", help="JSONL result file; the checkpoint and errors are written next to it")
+    parser.add_argument("--provider", choices=list(DEFAULT_MODELS), default="siliconflow")
+    parser.add_argument("--model", default="", help="model name (default: the provider's chat model)")
+    parser.add_argument("--system-prompt", default="You are a helpful assistant")
+    parser.add_argument("--prompt-field", default="prompt", help="CSV column or JSONL field holding the prompt")
+    parser.add_argument("--mode", choices=MODES, default="direct")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--batch-size", type=int, default=1000, help="rows per batch in batch_api mode")
+    parser.add_argument("--poll-interval", type=float, default=30.0, help="seconds between batch status checks")
+    parser.add_argument("--temperature", type=float, default=0.7)
+    parser.add_argument("--max-tokens", type=int, default=512)
+    parser.add_argument("--no-cache", action="store_true", help="do not read or write the response cache")
+    args = parser.parse_args(argv)
+
+    runner = RowRunner(args.provider, args.model, args.system_prompt, args.temperature, args.max_tokens,
+                       use_cache=not args.no_cache)
+    job = BulkJob(args.input, args.output, runner, args.prompt_field, args.concurrency, args.mode,
+                  args.batch_size, args.poll_interval)
+    print(json.dumps(job.run(), ensure_ascii=False))
@@ -0,0 +1,165 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from .config import load_config
+
+# 响应缓存：内存 LRU + 可选的 SQLite 磁盘层，按请求内容哈希寻址
+_DEFAULT_DISK_PATH = os.path.join(os.path.dirname(__file__), "cache", "responses.sqlite3")
+
+
+# 不影响生成结果的参数不参与缓存键
+_NON_SEMANTIC_PARAMS = ("stream", "stream_options")
+
+
+def make_cache_key(base_url, params, seed=0):
+    """对 base_url、模型、完整 messages 和采样参数做规范化哈希"""
+    canonical = json.dumps(
+        {
+            "base_url": base_url,
+            "params": {k: v for k, v in params.items() if k not in _NON_SEMANTIC_PARAMS},
+            "seed": seed,
+        },
+        sort_keys=True,
+        ensure_ascii=False,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def pack_choices(answers, finish_reasons):
+    """多候选结果的缓存值；第一项仍是第一个回答，与单个回答的缓存值 (answer,) 兼容"""
+    return (answers[0], list(answers), list(finish_reasons))
+
+
+def unpack_choices(cached):
+    """返回 (answers, finish_reasons)"""
+    if len(cached) >= 3:
+        return list(cached[1]), list(cached[2])
+    return [cached[0]], ["stop"]
+
+
+def is_deterministic(temperature, seed=0):
+    """temperature 为 0 或指定了 seed 时，同样的输入应得到同样的结果"""
+    return temperature == 0 or bool(seed)
+
+
+def cache_is_changed(temperature, seed=0, use_cache=True):
+    """供节点 IS_CHANGED 使用：不确定的采样每次都要重新执行"""
+    if not use_cache or not is_deterministic(temperature, seed):
+        return float("nan")
+    return ""
+
+
+class _DiskTier:
+    def __init__(self, path, ttl):
+        import sqlite3  # 只有开启磁盘缓存时才需要
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL)"
+        )
+        self.conn.commit()
+
+    def get(self, key):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT value, created FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, created = row
+            if self.ttl and time.time() - created > self.ttl:
+                self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.conn.commit()
+                return None
+        return json.loads(value)
+
+    def set(self, key, value):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, created) VALUES (?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), time.time()),
+            )
+            self.conn.commit()
+
+    def clear(self):
+        with self.lock:
+            self.conn.execute("DELETE FROM responses")
+            self.conn.commit()
+
+
+class ResponseCache:
+    def __init__(self, max_entries=256, disk_path=None, ttl=0):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.disk = None
+        if disk_path:
+            try:
+                self.disk = _DiskTier(disk_path, ttl)
+            except Exception as e:
+                print(f"Error opening response cache: {e}")
+
+    def get(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key]
+        if self.disk is not None:
+            value = self.disk.get(key)
+            if value is not None:
+                self._remember(key, value)
+                return value
+        return None
+
+    def set(self, key, value):
+        value = list(value)
+        self._remember(key, value)
+        if self.disk is not None:
+            try:
+                self.disk.set(key, value)
+            except Exception as e:
+                print(f"Error writing response cache: {e}")
+
+    def _remember(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """获取进程级共享的响应缓存"""
+    global _cache
+    if _cache is not None:
+        return _cache
+    with _cache_lock:
+        if _cache is None:
+            config = load_config()
+            disk_path = None
+            if config.get('cache_disk', False):
+                disk_path = config.get('cache_path') or _DEFAULT_DISK_PATH
+            _cache = ResponseCache(
+                max_entries=int(config.get('cache_max_entries', 256)),
+                disk_path=disk_path,
+                ttl=float(config.get('cache_ttl', 86400)),
+            )
+        return _cache
@@ -0,0 +1,149 @@
+import json
+import hashlib
+import threading
+from .deadline import DeadlineExceeded, remaining_time
+from .interrupt import RequestCancelled, POLL_INTERVAL, check_interrupt
+
+# 请求合并（single-flight）：完全相同的请求同时在途时只向上游发送一次，
+# 结果（包括流式输出的增量文本）分发给所有等待者
+
+
+def make_flight_key(base_url, api_key, params):
+    """base_url、api_key 和完整请求参数的哈希；stream 也参与，流式与非流式请求不互相合并"""
+    canonical = json.dumps(
+        {"base_url": base_url, "api_key": api_key, "params": params},
+        sort_keys=True,
+        ensure_ascii=False,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class _Flight:
+    def __init__(self, preview=None):
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.previews = [preview] if preview is not None else []
+        # 已经推送过的增量文本，后加入的等待者先补发这部分
+        self.started = False
+        self.finished = None
+        self.reasoning_parts = []
+        self.content_parts = []
+
+    def attach(self, preview):
+        if preview is None:
+            return
+        with self.lock:
+            self.previews.append(preview)
+            if self.started:
+                preview.start()
+                preview.update("".join(self.reasoning_parts), "".join(self.content_parts))
+            if self.finished is not None:
+                preview.finish(self.finished)
+
+    def detach(self, preview):
+        with self.lock:
+            if preview in self.previews:
+                self.previews.remove(preview)
+
+
+class FanoutPreview:
+    """把主请求的流式输出同时推送到所有合并进来的节点"""
+
+    def __init__(self, flight):
+        self.flight = flight
+
+    def start(self):
+        with self.flight.lock:
+            # 重试时重新开始
+            self.flight.started = True
+            self.flight.finished = None
+            self.flight.reasoning_parts = []
+            self.flight.content_parts = []
+            for preview in self.flight.previews:
+                preview.start()
+
+    def update(self, reasoning, content):
+        with self.flight.lock:
+            if reasoning:
+                self.flight.reasoning_parts.append(reasoning)
+            if content:
+                self.flight.content_parts.append(content)
+            for preview in self.flight.previews:
+                preview.update(reasoning, content)
+
+    def items(self, items):
+        with self.flight.lock:
+            for preview in self.flight.previews:
+                preview.items(items)
+
+    def finish(self, result):
+        with self.flight.lock:
+            self.flight.finished = result
+            for preview in self.flight.previews:
+                preview.finish(result)
+
+
+class SingleFlight:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.flights = {}
+
+    def run(self, key, fn, preview=None):
+        """
+        key 相同的请求在途时等待它的结果，否则执行 fn(preview) 并把结果分发给后来者。
+        fn 收到的 preview 会转发给所有等待者（包括调用者自己）的预览。返回 (result, shared)，
+        shared 为 True 表示结果来自其他请求。
+        主请求被中断或自己的 deadline 用完时，等待者不跟着失败，而是重新发起（成为新的主请求或加入新的在途请求）。
+        """
+        while True:
+            with self.lock:
+                flight = self.flights.get(key)
+                leader = flight is None
+                if leader:
+                    flight = _Flight(preview)
+                    self.flights[key] = flight
+            if leader:
+                break
+            flight.attach(preview)
+            # 等待者有自己的 deadline 和中断（包括并行请求的取消事件），不能无限期地等主请求
+            try:
+                while True:
+                    remaining = remaining_time()
+                    if remaining is not None and remaining <= 0:
+                        raise DeadlineExceeded("Deadline exceeded while waiting for a coalesced request")
+                    if flight.done.wait(POLL_INTERVAL if remaining is None else min(POLL_INTERVAL, remaining)):
+                        break
+                    check_interrupt()
+            except BaseException:
+                # 不再等待的节点不再接收主请求的流式输出
+                flight.detach(preview)
+                raise
+            if isinstance(flight.error, (RequestCancelled, DeadlineExceeded)):
+                # 只有上游的错误才分发给等待者；自己也被中断时直接停止
+                check_interrupt()
+                continue
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, True
+
+        try:
+            flight.result = fn(FanoutPreview(flight))
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+            flight.done.set()
+        return flight.result, False
+
+
+_single_flight = SingleFlight()
+
+
+def get_single_flight():
+    """获取进程级共享的请求合并器"""
+    return _single_flight
@@ -0,0 +1,91 @@
+import os
+import json
+import threading
+
+# 进程级共享的配置读取：config.json 只在修改时间变化时重新解析，
+# 并支持用 DEEPAIDE_ 开头的环境变量覆盖配置项
+CONFIG_PATH = os.path.join(os.path.dirname(__file__), "config.json")
+ENV_PREFIX = "DEEPAIDE_"
+
+# 各服务商的 (api_key 配置项, base_url 配置项, 默认 base_url)
+PROVIDER_KEYS = {
+    "deepseek": ("api_key", "base_url", "https://api.deepseek.com"),
+    "siliconflow": ("silicon_api_key", "silicon_base_url", "https://api.siliconflow.cn/v1"),
+}
+
+_lock = threading.Lock()
+_file_mtime = None
+_file_config = {}
+_cached_mtime = None
+_cached_config = None
+
+
+def _read_file():
+    """按修改时间缓存解析后的 config.json"""
+    global _file_mtime, _file_config
+    try:
+        mtime = os.stat(CONFIG_PATH).st_mtime_ns
+    except OSError:
+        mtime = None
+    if mtime == _file_mtime:
+        return _file_config
+    config = {}
+    if mtime is not None:
+        try:
+            with open(CONFIG_PATH, 'r', encoding='utf-8') as f:
+                config = json.load(f)
+        except Exception as e:
+            print(f"Error loading config: {e}")
+    _file_mtime, _file_config = mtime, config
+    return config
+
+
+def _parse_env_value(value):
+    # 数字、布尔值、JSON 对象按 JSON 解析，其余按字符串处理
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+
+def _env_overrides():
+    return tuple(sorted((k, v) for k, v in os.environ.items() if k.startswith(ENV_PREFIX)))
+
+
+def _apply_overrides(config, overrides):
+    """
+    DEEPAIDE_API_KEY 覆盖 api_key，双下划线表示嵌套配置项，
+    例如 DEEPAIDE_RATE_LIMITS__DEEPSEEK__RPM=60 覆盖 rate_limits.deepseek.rpm
+    """
+    config = json.loads(json.dumps(config))
+    for name, value in overrides:
+        path = name[len(ENV_PREFIX):].lower().split("__")
+        target = config
+        for part in path[:-1]:
+            if not isinstance(target.get(part), dict):
+                target[part] = {}
+            target = target[part]
+        target[path[-1]] = _parse_env_value(value)
+    return config
+
+
+def load_config():
+    """
+    返回当前配置（只读，调用方不要修改返回的字典）。
+    遍历 os.environ 比 stat 慢得多，所以环境变量只在 config.json 重新加载时才重新读取。
+    """
+    global _cached_mtime, _cached_config
+    with _lock:
+        file_config = _read_file()
+        if _file_mtime != _cached_mtime or _cached_config is None:
+            overrides = _env_overrides()
+            _cached_config = _apply_overrides(file_config, overrides) if overrides else file_config
+            _cached_mtime = _file_mtime
+        return _cached_config
+
+
+def get_credentials(provider):
+    """返回服务商的 (base_url, api_key)"""
+    key_name, url_name, default_url = PROVIDER_KEYS[provider]
+    config = load_config()
+    return config.get(url_name) or default_url, config.get(key_name)
@@ -0,0 +1,168 @@
+import time
+import threading
+from contextlib import contextmanager
+from .config import load_config
+from .interrupt import interruptible_sleep
+
+# 截止时间和自适应超时：每次节点调用可以设置总的时间预算（deadline），
+# 连接、首字节、流式空闲超时根据 max_tokens 和各模型实测的生成速度计算，并且都不超过剩余预算
+
+_DEFAULT_TIMEOUTS = {
+    "connect": 10.0,            # 建立连接
+    "first_byte_min": 30.0,     # 首字节超时的下限
+    "idle": 60.0,               # 流式输出两次数据之间的最长间隔（下限）
+    "safety": 3.0,              # 估算耗时的放大倍数
+    "tokens_per_second": 20.0,  # 还没有实测数据时假定的生成速度
+    "first_byte": 10.0,         # 还没有实测数据时假定的首字节延迟
+    "default_max_tokens": 4096, # 请求没有设置 max_tokens 时按这个长度估算
+}
+
+# 剩余预算少于这个值时不再发起新的尝试（秒）
+MIN_ATTEMPT_SECONDS = 1.0
+
+_local = threading.local()
+
+
+class DeadlineExceeded(TimeoutError):
+    """超过了节点的 deadline；reasoning/content 为流式请求超时前已收到的部分输出"""
+
+    def __init__(self, message="Deadline exceeded", reasoning=None, content=""):
+        super().__init__(message)
+        self.reasoning = reasoning
+        self.content = content
+
+
+def current_deadline():
+    """当前线程的截止时间（time.monotonic()），没有设置时返回 None"""
+    return getattr(_local, "expires", None)
+
+
+@contextmanager
+def deadline_scope(seconds=0, expires=None):
+    """
+    在当前线程设置截止时间：seconds > 0 时为从现在起的秒数，expires 直接指定绝对时间
+    （用于把截止时间带到其他线程）。嵌套时取较早的截止时间。
+    """
+    previous = current_deadline()
+    if seconds and seconds > 0:
+        expires = time.monotonic() + seconds
+    if previous is not None and (expires is None or previous < expires):
+        expires = previous
+    _local.expires = expires
+    try:
+        yield expires
+    finally:
+        _local.expires = previous
+
+
+def remaining_time():
+    """剩余预算（秒），没有设置截止时间时返回 None"""
+    expires = current_deadline()
+    return None if expires is None else expires - time.monotonic()
+
+
+def check_deadline():
+    """剩余预算不够一次尝试时抛出 DeadlineExceeded"""
+    remaining = remaining_time()
+    if remaining is not None and remaining < MIN_ATTEMPT_SECONDS:
+        raise DeadlineExceeded()
+
+
+def has_budget(seconds):
+    """等待 seconds 后是否还有时间再尝试一次"""
+    remaining = remaining_time()
+    return remaining is None or seconds + MIN_ATTEMPT_SECONDS <= remaining
+
+
+def sleep_within_deadline(seconds):
+    """等待 seconds 秒（可被 ComfyUI 中断），超出剩余预算时直接抛出 DeadlineExceeded"""
+    if not has_budget(seconds):
+        raise DeadlineExceeded()
+    interruptible_sleep(seconds)
+
+
+class _ModelSpeed:
+    """单个模型的生成速度（token/s）和首字节延迟的指数滑动平均"""
+
+    def __init__(self, alpha=0.2):
+        self.alpha = alpha
+        self.tokens_per_second = None
+        self.first_byte = None
+
+    def _update(self, current, value):
+        return value if current is None else self.alpha * value + (1 - self.alpha) * current
+
+    def observe(self, completion_tokens, first_byte, elapsed):
+        if first_byte is not None:
+            self.first_byte = self._update(self.first_byte, first_byte)
+            generation = elapsed - first_byte
+        else:
+            # 非流式请求只知道总耗时，按总耗时算出的速度偏保守
+            generation = elapsed
+        if completion_tokens and generation > 0:
+            self.tokens_per_second = self._update(self.tokens_per_second, completion_tokens / generation)
+
+
+_speeds = {}
+_lock = threading.Lock()
+
+
+def _model_speed(model):
+    speed = _speeds.get(model)
+    if speed is None:
+        with _lock:
+            speed = _speeds.setdefault(model, _ModelSpeed())
+    return speed
+
+
+def observe_speed(model, usage, elapsed, first_byte=None):
+    """请求成功后记录模型的实测速度；first_byte 为流式请求的首 token 时间"""
+    completion_tokens = (usage or {}).get("completion_tokens")
+    speed = _model_speed(model)
+    with _lock:
+        speed.observe(completion_tokens, first_byte, elapsed)
+
+
+def load_timeouts():
+    options = dict(_DEFAULT_TIMEOUTS)
+    options.update(load_config().get('timeouts') or {})
+    return options
+
+
+def _cap(seconds, remaining):
+    return seconds if remaining is None else max(0.1, min(seconds, remaining))
+
+
+def request_timeouts(model, max_tokens=0, stream=False):
+    """
+    计算一次尝试的 (connect, first_byte, idle) 超时（秒）：
+    - first_byte：流式请求为首字节延迟估计；非流式请求要等整个回答生成完，再加上 max_tokens / 生成速度
+    - idle：流式输出中两次数据之间的最长间隔
+    都乘以 safety 留出余量，并且不超过剩余预算。剩余预算不够一次尝试时抛出 DeadlineExceeded。
+    """
+    check_deadline()
+    options = load_timeouts()
+    speed = _model_speed(model)
+    first_byte = speed.first_byte if speed.first_byte is not None else options["first_byte"]
+    tokens_per_second = speed.tokens_per_second or options["tokens_per_second"]
+    max_tokens = int(max_tokens or options["default_max_tokens"])
+    expected = first_byte if stream else first_byte + max_tokens / tokens_per_second
+    safety = options["safety"]
+    remaining = remaining_time()
+    return (
+        _cap(options["connect"], remaining),
+        _cap(max(options["first_byte_min"], safety * expected), remaining),
+        _cap(max(options["idle"], safety * first_byte), remaining),
+    )
+
+
+def http_timeout(model, max_tokens=0, stream=False):
+    """
+    返回 (httpx.Timeout, idle)。httpx 的 read 超时先设为首字节超时，
+    流式请求收到响应头后再换成 idle（见 streaming.py）。
+    """
+    import httpx
+    connect, first_byte, idle = request_timeouts(model, max_tokens, stream)
+    remaining = remaining_time()
+    # 等待连接池空闲连接的时间也计入预算
+    return httpx.Timeout(first_byte, connect=connect, write=connect, pool=remaining), idle
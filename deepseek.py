@@ -1,23 +1,95 @@
 import os
 import json
-from openai import OpenAI
+import time
+from .config import get_credentials
+from .transport import get_openai_client, get_http_client
+from .cache import (get_response_cache, make_cache_key, is_deterministic, cache_is_changed,
+                    pack_choices, unpack_choices)
+from .batch import parse_prompts, run_batch, unwrap_list_inputs, parallel_choices
+from .streaming import stream_chat_completion, StreamPreview
+from .scheduler import estimate_request_tokens
+from .keypool import run_with_keys
+from .history import fit_history, build_summary_messages
+from .prompt_layout import LAYOUTS, PREFIX_CACHE_LOW_WATER, build_prefix, strip_prefix
+from .session_store import Session, open_session
+from .aio import AsyncExecuteMixin, EXECUTE_FUNCTION
+from .telemetry import CallTrace, current_trace
+from .coalesce import get_single_flight, make_flight_key
+from .interrupt import RequestCancelled, abort_on_interrupt
+from .similarity import lookup_similar, remember_similar
+from .reasoning_guard import guarded_completion
+from .json_mode import (JSON_FORMAT, JSONStreamParser, parser_scope, load_schema, json_system_prompt,
+                        complete_json, item_text)
+from .deadline import deadline_scope, http_timeout, observe_speed
 
-class DeepseekNode:
+def chat_completion(base_url, api_key, params, unique_id=None, max_retries=None, coalesce=True):
+    """
+    经过共享调度器（限速、重试）发送请求，返回第一个候选的 (reasoning, answer)。
+    coalesce 为 True 时，与在途的相同请求合并，共用一次上游调用。
+    """
+    reasoning, answer, _ = chat_completion_choices(base_url, api_key, params, unique_id, max_retries, coalesce)[0]
+    return reasoning, answer
+
+def chat_completion_choices(base_url, api_key, params, unique_id=None, max_retries=None, coalesce=True):
+    """同 chat_completion，返回所有候选的 [(reasoning, answer, finish_reason), ...]"""
+    preview = StreamPreview.create(unique_id) if params.get("stream") else None
+
+    def _send(preview):
+        return run_with_keys(
+            "deepseek", api_key,
+            lambda key: _send_chat_completion(base_url, key, params, preview),
+            estimate_request_tokens(params),
+            max_retries
+        )
+
+    if not coalesce:
+        return _send(preview)
+    result, shared = get_single_flight().run(make_flight_key(base_url, api_key, params), _send, preview)
+    trace = current_trace()
+    if shared and trace is not None:
+        trace.coalesced = True
+    return result
+
+def _send_chat_completion(base_url, api_key, params, preview=None):
+    """发送 chat/completions 请求，返回 [(reasoning, answer, finish_reason), ...]"""
+    # 超时按 max_tokens 和模型的实测速度计算，不超过剩余的 deadline
+    timeout, idle = http_timeout(params["model"], params.get("max_tokens"), params.get("stream"))
+    if params.get("stream"):
+        # 流式请求直接解析 SSE，增量文本推送到前端
+        client = get_http_client(base_url, api_key)
+        headers = {
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json"
+        }
+        result = stream_chat_completion(client, f"{base_url}/chat/completions", headers,
+                                        dict(params, stream_options={"include_usage": True}),
+                                        preview, timeout, idle)
+        observe_speed(params["model"], result.usage, result.elapsed, result.ttft)
+        trace = current_trace()
+        if trace is not None:
+            trace.record_response(result.usage, result.ttft)
+        return result.choices
+    
+    client = get_openai_client(base_url, api_key)
+    start = time.perf_counter()
+    # 等待完整回答期间被中断时断开连接（服务端随之停止生成），占用的并发名额也随之归还
+    with abort_on_interrupt():
+        response = client.chat.completions.create(**params, timeout=timeout)
+    usage = response.usage.model_dump() if response.usage else None
+    observe_speed(params["model"], usage, time.perf_counter() - start)
+    trace = current_trace()
+    if trace is not None:
+        trace.record_response(usage)
+    return [(getattr(choice.message, "reasoning_content", None), choice.message.content, choice.finish_reason)
+            for choice in response.choices]
+
+class DeepseekNode(AsyncExecuteMixin):
     def __init__(self):
-        self.config_path = os.path.join(os.path.dirname(__file__), "config.json")
         self.load_config()
     
     def load_config(self):
         """从配置文件加载API密钥"""
-        try:
-            with open(self.config_path, 'r') as f:
-                config = json.load(f)
-                self.api_key = config.get('api_key')
-                self.base_url = config.get('base_url', 'https://api.deepseek.com')
-        except Exception as e:
-            print(f"Error loading config: {e}")
-            self.api_key = None
-            self.base_url = "https://api.deepseek.com"
+        self.base_url, self.api_key = get_credentials("deepseek")
 
     @classmethod
     def INPUT_TYPES(s):
@@ -37,13 +109,54 @@ class DeepseekNode:
                     "step": 0.1,
                     "tooltip": "创造性，随机性"
                 }),
+                "seed": ("INT", {
+                    "default": 0,
+                    "min": 0,
+                    "max": 0xffffffffffffffff,
+                    "tooltip": "缓存种子（非0时即使temperature大于0也会复用缓存结果）"
+                }),
+                "use_cache": ("BOOLEAN", {
+                    "default": True,
+                    "tooltip": "相同请求直接返回缓存结果"
+                }),
+                "similarity": ("FLOAT", {
+                    "default": 0.0,
+                    "min": 0.0,
+                    "max": 1.0,
+                    "step": 0.01,
+                    "tooltip": "近似缓存的相似度阈值（0表示关闭，建议0.85）：只差空白、标点或个别词语的提示词直接复用缓存的回答，"
+                               "开启后temperature大于0时也会复用"
+                }),
+                "coalesce": ("BOOLEAN", {
+                    "default": True,
+                    "tooltip": "同时发出的相同请求只调用一次API并共享结果（需要多个不同的采样结果时关闭）"
+                }),
+                "deadline": ("FLOAT", {
+                    "default": 0.0,
+                    "min": 0.0,
+                    "max": 3600.0,
+                    "step": 1.0,
+                    "tooltip": "整次调用的时间预算（秒），包括排队和重试；0表示不限制（仍按max_tokens和实测速度自动设置超时）"
+                }),
+                "stream": ("BOOLEAN", {
+                    "default": False,
+                    "tooltip": "流式输出（实时显示生成内容）"
+                }),
+            },
+            "hidden": {
+                "unique_id": "UNIQUE_ID"
             }
         }
     
-    RETURN_TYPES = ("STRING",)
-    FUNCTION = "execute"
+    RETURN_TYPES = ("STRING", "STRING",)
+    RETURN_NAMES = ("answer", "usage",)
+    FUNCTION = EXECUTE_FUNCTION
     CATEGORY = "💎DeepAide"
 
+    @classmethod
+    def IS_CHANGED(s, temperature=0.7, seed=0, use_cache=True, **kwargs):
+        return cache_is_changed(temperature, seed, use_cache)
+
     @classmethod
     def get_icon(cls):
         dir_path = os.path.dirname(os.path.realpath(__file__))
@@ -53,46 +166,62 @@ class DeepseekNode:
                 return f.read()
         return None
 
-    def execute(self, prompt, system_prompt="You are a helpful assistant", temperature=0.7):
+    def execute(self, prompt, system_prompt="You are a helpful assistant", temperature=0.7,
+                seed=0, use_cache=True, similarity=0.0, coalesce=True, deadline=0.0, stream=False,
+                unique_id=None):
         if not self.api_key:
-            return ("Error: Please configure your API key in config.json",)
+            return ("Error: Please configure your API key in config.json", "{}",)
             
+        trace = CallTrace("deepseek", "deepseek-chat")
         try:
-            client = OpenAI(
-                api_key=self.api_key,
-                base_url=self.base_url
-            )
-            
-            response = client.chat.completions.create(
-                model="deepseek-chat",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": prompt},
-                ],
-                temperature=temperature,
-                stream=False
-            )
-            
-            return (response.choices[0].message.content,)
+            with trace, deadline_scope(deadline):
+                params = {
+                    "model": "deepseek-chat",
+                    "messages": [
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": prompt},
+                    ],
+                    "temperature": temperature,
+                    "stream": stream
+                }
+                
+                # 确定性请求先查缓存
+                cache = get_response_cache()
+                cache_key = None
+                cached = None
+                if use_cache and is_deterministic(temperature, seed):
+                    cache_key = make_cache_key(self.base_url, params, seed)
+                    cached = cache.get(cache_key)
+                # 再查近似缓存
+                if cached is None and use_cache and similarity > 0:
+                    similar = lookup_similar(self.base_url, params, seed, similarity)
+                    if similar is not None:
+                        cached, trace.extra["similarity"] = similar[0], round(similar[1], 3)
+                
+                if cached is not None:
+                    trace.cached = True
+                    answer = cached[0]
+                else:
+                    _, answer = chat_completion(self.base_url, self.api_key, params, unique_id,
+                                                coalesce=coalesce)
+                    if cache_key:
+                        cache.set(cache_key, (answer,))
+                    if use_cache and similarity > 0:
+                        remember_similar(self.base_url, params, seed, (answer,))
+            return (answer, trace.to_json(),)
+        except RequestCancelled:
+            # 中断交给 ComfyUI 处理（部分输出已推送到预览）
+            raise
         except Exception as e:
-            return (f"Error: {str(e)}",)
+            return (f"Error: {str(e)}", trace.to_json(),)
 
-class DeepseekAdvancedNode:
+class DeepseekAdvancedNode(AsyncExecuteMixin):
     def __init__(self):
-        self.config_path = os.path.join(os.path.dirname(__file__), "config.json")
         self.load_config()
     
     def load_config(self):
         """从配置文件加载API密钥"""
-        try:
-            with open(self.config_path, 'r') as f:
-                config = json.load(f)
-                self.api_key = config.get('api_key')
-                self.base_url = config.get('base_url', 'https://api.deepseek.com')
-        except Exception as e:
-            print(f"Error loading config: {e}")
-            self.api_key = None
-            self.base_url = "https://api.deepseek.com"
+        self.base_url, self.api_key = get_credentials("deepseek")
 
     @classmethod
     def INPUT_TYPES(s):
@@ -145,13 +274,80 @@ class DeepseekAdvancedNode:
                     "multiline": False,
                     "tooltip": "停止标记（AI看到这个词就停止回答）"
                 }),
+                "few_shot": ("STRING", {
+                    "multiline": True,
+                    "default": "",
+                    "tooltip": "示例对话（JSON数组，如 [{\"user\": \"...\", \"assistant\": \"...\"}]），放在系统提示词之后"
+                }),
+                "json_mode": ("BOOLEAN", {
+                    "default": False,
+                    "tooltip": "JSON模式（response_format 为 json_object，回答解析、校验后输出规范化的 JSON，数组元素从 items 输出）"
+                }),
+                "json_schema": ("STRING", {
+                    "multiline": True,
+                    "default": "",
+                    "tooltip": "JSON模式下回答需要符合的 JSON Schema（可选），不符合时只重新生成出错的部分"
+                }),
+                "items_key": ("STRING", {
+                    "default": "",
+                    "multiline": False,
+                    "tooltip": "从哪个数组字段输出 items（留空时为根数组或第一个数组字段）"
+                }),
+                "json_retries": ("INT", {
+                    "default": 1,
+                    "min": 0,
+                    "max": 3,
+                    "step": 1,
+                    "tooltip": "JSON 无法修复或不符合 schema 时最多重新请求的次数"
+                }),
+                "num_candidates": ("INT", {
+                    "default": 1,
+                    "min": 1,
+                    "max": 8,
+                    "step": 1,
+                    "tooltip": "候选回答数量（DeepSeek 不支持 n 参数，会并行发送多个请求）"
+                }),
+                "seed": ("INT", {
+                    "default": 0,
+                    "min": 0,
+                    "max": 0xffffffffffffffff,
+                    "tooltip": "缓存种子（非0时即使temperature大于0也会复用缓存结果）"
+                }),
+                "use_cache": ("BOOLEAN", {
+                    "default": True,
+                    "tooltip": "相同请求直接返回缓存结果"
+                }),
+                "coalesce": ("BOOLEAN", {
+                    "default": True,
+                    "tooltip": "同时发出的相同请求只调用一次API并共享结果（需要多个不同的采样结果时关闭）"
+                }),
+                "deadline": ("FLOAT", {
+                    "default": 0.0,
+                    "min": 0.0,
+                    "max": 3600.0,
+                    "step": 1.0,
+                    "tooltip": "整次调用的时间预算（秒），包括排队和重试；0表示不限制（仍按max_tokens和实测速度自动设置超时）"
+                }),
+                "stream": ("BOOLEAN", {
+                    "default": False,
+                    "tooltip": "流式输出（实时显示生成内容）"
+                }),
+            },
+            "hidden": {
+                "unique_id": "UNIQUE_ID"
             }
         }
     
-    RETURN_TYPES = ("STRING",)
-    FUNCTION = "execute"
+    RETURN_TYPES = ("STRING", "STRING", "STRING", "STRING", "STRING",)
+    RETURN_NAMES = ("answer", "usage", "candidates", "finish_reasons", "items",)
+    OUTPUT_IS_LIST = (False, False, True, True, True,)
+    FUNCTION = EXECUTE_FUNCTION
     CATEGORY = "💎DeepAide"
 
+    @classmethod
+    def IS_CHANGED(s, temperature=1.0, seed=0, use_cache=True, **kwargs):
+        return cache_is_changed(temperature, seed, use_cache)
+
     @classmethod
     def get_icon(cls):
         dir_path = os.path.dirname(os.path.realpath(__file__))
@@ -161,62 +357,188 @@ class DeepseekAdvancedNode:
                 return f.read()
         return None
 
+    def build_params(self, prompt, system_prompt="You are a helpful assistant", 
+                     temperature=1.0, max_tokens=2048, top_p=1.0,
+                     frequency_penalty=0.0, presence_penalty=0.0, 
+                     stop_sequence="", stream=False, few_shot="", json_mode=False, json_schema=None):
+        """构建请求参数，json_schema 为已解析的 schema"""
+        if json_mode:
+            system_prompt = json_system_prompt(system_prompt, json_schema)
+        params = {
+            "model": "deepseek-chat",
+            "messages": build_prefix(system_prompt, few_shot) + [{"role": "user", "content": prompt}],
+            "temperature": temperature, 
+            "max_tokens": max_tokens,
+            "top_p": top_p,
+            "frequency_penalty": frequency_penalty,
+            "presence_penalty": presence_penalty,
+            "stream": stream,
+            "response_format": JSON_FORMAT if json_mode else {"type": "text"}
+        }
+        
+        # 如果提供了stop_sequence，添加到参数中
+        if stop_sequence:
+            params["stop"] = [stop_sequence]
+        return params
+
+    def generate_choices(self, params, num_candidates=1, seed=0, use_cache=True, unique_id=None, coalesce=True):
+        """发送请求并返回 (answers, finish_reasons)，失败时抛出异常"""
+        # 确定性请求先查缓存，候选数量不同的请求分开缓存
+        cache = get_response_cache()
+        cache_key = None
+        if use_cache and is_deterministic(params["temperature"], seed):
+            key_params = dict(params, n=num_candidates) if num_candidates > 1 else params
+            cache_key = make_cache_key(self.base_url, key_params, seed)
+            cached = cache.get(cache_key)
+            if cached is not None:
+                trace = current_trace()
+                if trace is not None:
+                    trace.cached = True
+                return unpack_choices(cached)
+        
+        if num_candidates > 1:
+            # DeepSeek 不支持 n，并行发送多个相同的请求（不能合并），只预览第一个
+            choices = parallel_choices(
+                lambda index: chat_completion_choices(self.base_url, self.api_key, params,
+                                                      unique_id if index == 0 else None, coalesce=False)[0],
+                num_candidates, "deepseek", params["model"])
+        else:
+            choices = chat_completion_choices(self.base_url, self.api_key, params, unique_id, coalesce=coalesce)
+        answers = [answer for _, answer, _ in choices]
+        finish_reasons = [finish_reason or "" for _, _, finish_reason in choices]
+        if cache_key:
+            cache.set(cache_key, pack_choices(answers, finish_reasons))
+        return answers, finish_reasons
+
+    def generate(self, params, seed=0, use_cache=True, unique_id=None, coalesce=True):
+        """发送请求并返回回答，失败时抛出异常"""
+        answers, _ = self.generate_choices(params, 1, seed, use_cache, unique_id, coalesce)
+        return answers[0]
+
+    def complete_json(self, params, answer, seed=0, use_cache=True, coalesce=True, json_schema=None,
+                      items_key="", json_retries=1, parser=None):
+        """JSON 模式：解析、修复并校验回答，返回 (规范化的 JSON, items)"""
+        value, items = complete_json(lambda p: self.generate(p, seed, use_cache, coalesce=coalesce),
+                                     params, answer, json_schema, items_key, json_retries, parser)
+        return json.dumps(value, ensure_ascii=False), [item_text(item) for item in items]
+
     def execute(self, prompt, system_prompt="You are a helpful assistant", 
                 temperature=1.0, max_tokens=2048, top_p=1.0,
                 frequency_penalty=0.0, presence_penalty=0.0, 
-                stop_sequence=""):
+                stop_sequence="", few_shot="", json_mode=False, json_schema="", items_key="", json_retries=1,
+                num_candidates=1, seed=0, use_cache=True, coalesce=True,
+                deadline=0.0, stream=False, unique_id=None):
         if not self.api_key:
-            return ("Error: Please configure your API key in config.json",)
+            error = "Error: Please configure your API key in config.json"
+            return (error, "{}", [error], ["error"], [error],)
             
+        trace = CallTrace("deepseek", "deepseek-chat")
         try:
-            client = OpenAI(
-                api_key=self.api_key,
-                base_url=self.base_url
-            )
-            
-            # 构建请求参数
-            params = {
-                "model": "deepseek-chat",
-                "messages": [
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": prompt},
-                ],
-                "temperature": temperature, 
-                "max_tokens": max_tokens,
-                "top_p": top_p,
-                "frequency_penalty": frequency_penalty,
-                "presence_penalty": presence_penalty,
-                "stream": False,
-                "response_format": {"type": "text"}
-            }
-            
-            # 如果提供了stop_sequence，添加到参数中
-            if stop_sequence:
-                params["stop"] = [stop_sequence]
-            
-            response = client.chat.completions.create(**params)
-            
-            return (response.choices[0].message.content,)
+            with trace, deadline_scope(deadline):
+                schema = load_schema(json_schema) if json_mode else None
+                params = self.build_params(prompt, system_prompt, temperature, max_tokens, top_p,
+                                           frequency_penalty, presence_penalty, stop_sequence, stream,
+                                           few_shot, json_mode, schema)
+                # JSON 模式下流式输出的回答边生成边解析
+                parser = JSONStreamParser() if json_mode else None
+                with parser_scope(parser):
+                    answers, finish_reasons = self.generate_choices(params, num_candidates, seed, use_cache,
+                                                                    unique_id, coalesce)
+                items = []
+                if json_mode:
+                    answers[0], items = self.complete_json(params, answers[0], seed, use_cache, coalesce,
+                                                           schema, items_key, json_retries, parser)
+            return (answers[0], trace.to_json(), answers, finish_reasons, items,)
+        except RequestCancelled:
+            # 中断交给 ComfyUI 处理（部分输出已推送到预览）
+            raise
         except Exception as e:
-            return (f"Error: {str(e)}",)
+            error = f"Error: {str(e)}"
+            return (error, trace.to_json(), [error], ["error"], [error],)
+
+class DeepseekBatchNode(DeepseekAdvancedNode):
+    @classmethod
+    def INPUT_TYPES(s):
+        inputs = DeepseekAdvancedNode.INPUT_TYPES()
+        inputs["required"] = {
+            "prompts": ("STRING", {
+                "multiline": True,
+                "tooltip": "批量提示词（每行一个，或JSON数组）"
+            }),
+            "system_prompt": inputs["required"]["system_prompt"],
+            "concurrency": ("INT", {
+                "default": 4,
+                "min": 1,
+                "max": 32,
+                "step": 1,
+                "tooltip": "最大并发请求数"
+            }),
+        }
+        # 批量节点每条提示词只生成一个回答，JSON 模式下输出规范化的 JSON
+        for name in ("num_candidates", "items_key"):
+            inputs["optional"].pop(name)
+        return inputs
+    
+    INPUT_IS_LIST = True
+    RETURN_TYPES = ("STRING", "STRING", "STRING",)
+    RETURN_NAMES = ("answers", "errors", "usage",)
+    OUTPUT_IS_LIST = (True, True, True,)
+
+    @classmethod
+    def IS_CHANGED(s, **kwargs):
+        kwargs = unwrap_list_inputs(kwargs)
+        return cache_is_changed(kwargs.get("temperature", 1.0), kwargs.get("seed", 0),
+                                kwargs.get("use_cache", True))
+
+    def execute(self, prompts, **kwargs):
+        kwargs = unwrap_list_inputs(kwargs)
+        if not self.api_key:
+            return (["Error: Please configure your API key in config.json"], ["Error: API key not found"], ["{}"],)
+        
+        items = parse_prompts(prompts[0] if len(prompts) == 1 else prompts)
+        concurrency = kwargs.pop("concurrency", 4)
+        seed = kwargs.pop("seed", 0)
+        use_cache = kwargs.pop("use_cache", True)
+        coalesce = kwargs.pop("coalesce", True)
+        deadline = kwargs.pop("deadline", 0.0)
+        json_retries = kwargs.pop("json_retries", 1)
+        json_schema = kwargs.pop("json_schema", "")
+        try:
+            schema = load_schema(json_schema) if kwargs.get("json_mode") else None
+        except ValueError as e:
+            return ([f"Error: {str(e)}"], [f"Error: {str(e)}"], ["{}"],)
+        # 批量请求不做逐条的实时预览
+        kwargs.pop("unique_id", None)
+        
+        usage = ["{}"] * len(items)
+        
+        def _generate_one(index):
+            trace = CallTrace("deepseek", "deepseek-chat")
+            try:
+                with trace, deadline_scope(expires=expires):
+                    params = self.build_params(items[index], json_schema=schema, **kwargs)
+                    answer = self.generate(params, seed, use_cache, coalesce=coalesce)
+                    if kwargs.get("json_mode"):
+                        answer, _ = self.complete_json(params, answer, seed, use_cache, coalesce, schema,
+                                                       json_retries=json_retries)
+                    return answer
+            finally:
+                usage[index] = trace.to_json()
+        
+        # deadline 是整批的时间预算
+        with deadline_scope(deadline) as expires:
+            answers, errors = run_batch(_generate_one, list(range(len(items))), concurrency)
+        return (answers, errors, usage,)
 
-class DeepseekReasonerNode:
+class DeepseekReasonerNode(AsyncExecuteMixin):
     def __init__(self):
-        self.config_path = os.path.join(os.path.dirname(__file__), "config.json")
         self.load_config()
-        self.message_history = []
+        # 未指定 session_id 时使用节点自己的内存会话
+        self.local_session = Session()
     
     def load_config(self):
         """从配置文件加载API密钥"""
-        try:
-            with open(self.config_path, 'r') as f:
-                config = json.load(f)
-                self.api_key = config.get('api_key')
-                self.base_url = config.get('base_url', 'https://api.deepseek.com')
-        except Exception as e:
-            print(f"Error loading config: {e}")
-            self.api_key = None
-            self.base_url = "https://api.deepseek.com"
+        self.base_url, self.api_key = get_credentials("deepseek")
 
     @classmethod
     def INPUT_TYPES(s):
@@ -268,15 +590,92 @@ class DeepseekReasonerNode:
                     "max": 2.0,
                     "step": 0.1,
                     "tooltip": "话题重复度（越大越容易换新话题）"
+                }),
+                "session_id": ("STRING", {
+                    "default": "",
+                    "multiline": False,
+                    "tooltip": "会话ID（相同ID的节点共享并持久化对话历史，留空则只保存在当前节点）"
+                }),
+                "context_budget": ("INT", {
+                    "default": 0,
+                    "min": 0,
+                    "max": 256000,
+                    "step": 1024,
+                    "tooltip": "历史记录的token预算（0表示按模型上下文窗口自动计算）"
+                }),
+                "history_strategy": (["truncate", "summarize"], {
+                    "default": "truncate",
+                    "tooltip": "超出预算时丢弃最早的对话，或把它们压缩成摘要"
+                }),
+                "few_shot": ("STRING", {
+                    "multiline": True,
+                    "default": "",
+                    "tooltip": "示例对话（JSON数组，如 [{\"user\": \"...\", \"assistant\": \"...\"}]），放在系统提示词之后"
+                }),
+                "prompt_layout": (LAYOUTS, {
+                    "default": "standard",
+                    "tooltip": "prefix_cache：系统提示词和示例对话规范化后作为固定前缀，历史超出预算时一次多压缩一些，"
+                               "尽量命中服务商的上下文缓存"
+                }),
+                "seed": ("INT", {
+                    "default": 0,
+                    "min": 0,
+                    "max": 0xffffffffffffffff,
+                    "tooltip": "缓存种子（非0时即使temperature大于0也会复用缓存结果）"
+                }),
+                "use_cache": ("BOOLEAN", {
+                    "default": True,
+                    "tooltip": "相同请求直接返回缓存结果"
+                }),
+                "coalesce": ("BOOLEAN", {
+                    "default": True,
+                    "tooltip": "同时发出的相同请求只调用一次API并共享结果（需要多个不同的采样结果时关闭）"
+                }),
+                "deadline": ("FLOAT", {
+                    "default": 0.0,
+                    "min": 0.0,
+                    "max": 3600.0,
+                    "step": 1.0,
+                    "tooltip": "整次调用的时间预算（秒），包括排队和重试；0表示不限制（仍按max_tokens和实测速度自动设置超时）"
+                }),
+                "reasoning_budget": ("INT", {
+                    "default": 0,
+                    "min": 0,
+                    "max": 32768,
+                    "step": 256,
+                    "tooltip": "推理token预算（0表示不限制）：思考过程超出预算时结束思考，或改用非思考模型回答；设置后以流式请求"
+                }),
+                "thinking_timeout": ("FLOAT", {
+                    "default": 0.0,
+                    "min": 0.0,
+                    "max": 600.0,
+                    "step": 1.0,
+                    "tooltip": "思考阶段（从发出请求到开始输出回答）的最长耗时（秒），0表示不限制"
+                }),
+                "budget_fallback": ("BOOLEAN", {
+                    "default": True,
+                    "tooltip": "超出推理预算时改用对应的非思考模型重新回答；关闭时返回错误"
+                }),
+                "stream": ("BOOLEAN", {
+                    "default": False,
+                    "tooltip": "流式输出（实时显示生成内容）"
                 })
+            },
+            "hidden": {
+                "unique_id": "UNIQUE_ID"
             }
         }
     
-    RETURN_TYPES = ("STRING", "STRING",)
-    RETURN_NAMES = ("reasoning", "answer",)
-    FUNCTION = "execute"
+    RETURN_TYPES = ("STRING", "STRING", "STRING",)
+    RETURN_NAMES = ("reasoning", "answer", "usage",)
+    FUNCTION = EXECUTE_FUNCTION
     CATEGORY = "💎DeepAide"
 
+    @classmethod
+    def IS_CHANGED(s, **kwargs):
+        # 带历史记录的多轮对话每次都需要重新执行
+        return float("nan")
+
     @classmethod
     def get_icon(cls):
         dir_path = os.path.dirname(os.path.realpath(__file__))
@@ -286,54 +685,93 @@ class DeepseekReasonerNode:
                 return f.read()
         return None
 
+    def summarize(self, messages):
+        """用 deepseek-chat 把较早的对话压缩成摘要"""
+        params = {
+            "model": "deepseek-chat",
+            "messages": build_summary_messages(messages),
+            "temperature": 0.3,
+            "max_tokens": 1024,
+            "stream": False
+        }
+        _, summary = chat_completion(self.base_url, self.api_key, params)
+        return summary
+
     def execute(self, prompt, system_prompt="You are a helpful assistant", 
                 clear_history=False, temperature=0.7, 
                 max_tokens=2048, top_p=1.0,
-                frequency_penalty=0.0, presence_penalty=0.0):
+                frequency_penalty=0.0, presence_penalty=0.0,
+                context_budget=0, history_strategy="truncate", few_shot="", prompt_layout="standard",
+                session_id="", seed=0, use_cache=True, coalesce=True, deadline=0.0, reasoning_budget=0,
+                thinking_timeout=0.0, budget_fallback=True, stream=False, unique_id=None):
         if not self.api_key:
-            return ("Error: Please configure your API key in config.json", "Error: API key not found")
-        
-        if clear_history:
-            self.message_history = []
+            return ("Error: Please configure your API key in config.json", "Error: API key not found", "{}",)
             
+        trace = CallTrace("deepseek", "deepseek-reasoner")
         try:
-            client = OpenAI(
-                api_key=self.api_key,
-                base_url=self.base_url
-            )
-            
-            # 构建请求参数
-            # 如果历史记录为空，添加系统提示词到历史记录中
-            if not self.message_history:
-                self.message_history.append({"role": "system", "content": system_prompt})
-            
-            # 添加当前用户消息
-            self.message_history.append({"role": "user", "content": prompt})
-            
-            params = {
-                "model": "deepseek-reasoner",
-                "messages": self.message_history,
-                "temperature": temperature,
-                "max_tokens": max_tokens,
-                "top_p": top_p,
-                "frequency_penalty": frequency_penalty,
-                "presence_penalty": presence_penalty,
-                "stream": False,
-                "response_format": {"type": "text"}
-            }
-            
-            response = client.chat.completions.create(**params)
-            
-            reasoning = response.choices[0].message.reasoning_content
-            answer = response.choices[0].message.content
-            
-            # 将助手的回答添加到历史记录
-            self.message_history.append({
-                "role": "assistant",
-                "content": answer
-            })
+            with trace, deadline_scope(deadline), open_session(session_id.strip(), self.local_session) as session:
+                if clear_history:
+                    session.clear()
+                
+                user_message = {"role": "user", "content": prompt}
+                summarize = self.summarize if history_strategy == "summarize" else None
+                # 每轮都用同一个前缀（系统提示词和示例对话），会话中只保存对话历史；
+                # 历史超出预算时压缩，并把 max_tokens 限制在剩余上下文之内，
+                # prefix_cache 布局下一次多压缩一些，让之后几轮的前缀保持不变
+                prefix = build_prefix(system_prompt, few_shot, prompt_layout)
+                stored = strip_prefix(session.messages, prefix)
+                low_water = PREFIX_CACHE_LOW_WATER if prompt_layout == "prefix_cache" else 1.0
+                history, max_tokens = fit_history("deepseek-reasoner", prefix, stored + [user_message],
+                                                  max_tokens, context_budget, summarize, low_water)
+                messages = prefix + history
+                committed = history[:-1]
+                
+                params = {
+                    "model": "deepseek-reasoner",
+                    "messages": messages,
+                    "temperature": temperature,
+                    "max_tokens": max_tokens,
+                    "top_p": top_p,
+                    "frequency_penalty": frequency_penalty,
+                    "presence_penalty": presence_penalty,
+                    "stream": stream,
+                    "response_format": {"type": "text"}
+                }
+                
+                # 缓存键包含完整的历史记录，只有整段对话相同才会命中
+                cache = get_response_cache()
+                cache_key = None
+                cached = None
+                if use_cache and is_deterministic(temperature, seed):
+                    cache_key = make_cache_key(self.base_url, params, seed)
+                    cached = cache.get(cache_key)
+                
+                if cached is not None:
+                    trace.cached = True
+                    reasoning, answer = cached
+                elif reasoning_budget or thinking_timeout:
+                    # 推理预算在流式输出中检查；可能被中途截断的请求不与其他调用合并
+                    reasoning, answer, fired = guarded_completion(
+                        lambda p: chat_completion(self.base_url, self.api_key, p, unique_id, coalesce=False),
+                        params, reasoning_budget, thinking_timeout, budget_fallback)
+                    # 改用非思考模型得到的回答不写入缓存
+                    if cache_key and not fired:
+                        cache.set(cache_key, (reasoning, answer))
+                else:
+                    reasoning, answer = chat_completion(self.base_url, self.api_key, params, unique_id,
+                                                        coalesce=coalesce)
+                    if cache_key:
+                        cache.set(cache_key, (reasoning, answer))
+                
+                # 请求成功后才把本轮对话写入会话
+                session.commit(committed, user_message, {
+                    "role": "assistant",
+                    "content": answer
+                })
             
-            return (reasoning, answer,)
+            return (reasoning, answer, trace.to_json(),)
+        except RequestCancelled:
+            # 中断交给 ComfyUI 处理（部分输出已推送到预览）
+            raise
         except Exception as e:
-            return (f"Error: {str(e)}", "Error occurred during API call")
-
+            return (f"Error: {str(e)}", "Error occurred during API call", trace.to_json(),)
@@ -0,0 +1,438 @@
+# 共享网关：多个 ComfyUI 工作进程（可以在不同机器上）通过一个 OpenAI 兼容的代理访问服务商。
+# 连接池、限速和自适应并发、key 池、请求合并和响应缓存都在网关进程中，所有工作进程共用同一份状态，
+# 不会各自探测服务商的限额、重复发送相同的请求。工作进程的 base_url 指向 http://网关地址:8900/<provider>
+import json
+import time
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from .config import PROVIDER_KEYS, load_config, get_credentials
+from .transport import get_http_client
+from .cache import get_response_cache, make_cache_key, is_deterministic
+from .coalesce import get_single_flight, make_flight_key
+from .scheduler import NO_RETRY_HEADER, estimate_request_tokens
+from .keypool import run_with_keys, parse_keys
+from .telemetry import CallTrace, current_trace, get_metrics
+from .deadline import http_timeout, observe_speed
+from .streaming import iter_sse_events
+
+_DEFAULT_OPTIONS = {
+    "host": "127.0.0.1",
+    "port": 8900,
+    "token": "",        # 非空时工作进程必须以 Bearer token 的形式携带它
+    "cache": True,      # 确定性请求（temperature 为 0 或指定了 seed）使用响应缓存
+    "upstreams": {},    # {provider: {"base_url": ..., "api_key": ...}}，缺省时使用顶层配置
+}
+
+
+def load_gateway_options():
+    options = dict(_DEFAULT_OPTIONS)
+    options.update(load_config().get('gateway') or {})
+    return options
+
+
+def upstream_credentials(provider, client_key=None):
+    """
+    网关转发时使用的 (base_url, api_key)。网关没有配置 key 时使用工作进程携带的 key
+    （此时仍共用网关的连接池、限速和缓存）。
+    """
+    upstream = (load_gateway_options()["upstreams"] or {}).get(provider) or {}
+    base_url, api_key = get_credentials(provider)
+    return upstream.get("base_url") or base_url, upstream.get("api_key") or api_key or client_key
+
+
+class RelayError(Exception):
+    """流式响应已经开始转发后出错；不可重试（客户端已经收到了部分数据）"""
+
+
+def _strip_done(text):
+    """去掉上游的 [DONE]，由网关在写入缓存之后再发出"""
+    if "[DONE]" not in text:
+        return text
+    return "".join(line for line in text.splitlines(keepends=True) if line.strip() != "data: [DONE]")
+
+
+def _assemble_completion(text):
+    """把转发完的 SSE 数据拼成等价的非流式响应（写入缓存，与非流式请求共用缓存条目）"""
+    completion = {"object": "chat.completion", "choices": []}
+    parts = {}
+    for event in iter_sse_events([text.encode("utf-8")]):
+        for key in ("id", "created", "model"):
+            if event.get(key) is not None:
+                completion.setdefault(key, event[key])
+        if event.get("usage"):
+            completion["usage"] = event["usage"]
+        for choice in event.get("choices") or []:
+            choice_parts = parts.setdefault(choice.get("index") or 0, [[], [], None])
+            delta = choice.get("delta") or {}
+            if delta.get("reasoning_content"):
+                choice_parts[0].append(delta["reasoning_content"])
+            if delta.get("content"):
+                choice_parts[1].append(delta["content"])
+            if choice.get("finish_reason"):
+                choice_parts[2] = choice["finish_reason"]
+    for index in sorted(parts):
+        reasoning_parts, content_parts, finish_reason = parts[index]
+        message = {"role": "assistant", "content": "".join(content_parts)}
+        if reasoning_parts:
+            message["reasoning_content"] = "".join(reasoning_parts)
+        completion["choices"].append({"index": index, "message": message, "finish_reason": finish_reason})
+    return completion
+
+
+def _completion_events(body):
+    """把非流式响应（缓存命中时）改写成等价的 SSE 数据块"""
+    completion = json.loads(body)
+    base = {k: completion.get(k) for k in ("id", "created", "model")}
+    base["object"] = "chat.completion.chunk"
+    for choice in completion.get("choices") or []:
+        message = choice.get("message") or {}
+        delta = {"role": "assistant", "content": message.get("content") or ""}
+        if message.get("reasoning_content"):
+            delta["reasoning_content"] = message["reasoning_content"]
+        yield dict(base, choices=[{"index": choice.get("index", 0), "delta": delta,
+                                   "finish_reason": choice.get("finish_reason")}])
+    if completion.get("usage"):
+        yield dict(base, choices=[], usage=completion["usage"])
+
+
+class _StreamWriter:
+    """
+    一个工作进程的流式响应，作为请求合并的预览挂到在途的流式请求上（见 coalesce.FanoutPreview）：
+    update 的 content 是上游的完整 SSE 行。写入失败（工作进程断开）时只标记 broken，不影响其他等待者
+    """
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.leader = False
+        self.broken = False
+
+    def _write(self, fn, *args):
+        if self.broken:
+            return
+        try:
+            fn(*args)
+        except OSError:
+            self.broken = True
+
+    def start(self):
+        self._write(self.handler._start_chunked, {"X-DeepAide-Cache": "miss" if self.leader else "coalesced"})
+
+    def update(self, reasoning, content):
+        if content:
+            self._write(self.handler._write_chunk, content.encode("utf-8"))
+
+    def items(self, items):
+        pass
+
+    def finish(self, result):
+        self._write(self.handler._end_chunked)
+
+
+class GatewayHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # 工作进程与网关之间保持长连接
+    server_version = "DeepAideGateway/1.0"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    # ---- 响应 ----
+
+    def _send(self, status, body, content_type="application/json", headers=None):
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, status, message, error_type="gateway_error", headers=None):
+        self._send(status, json.dumps({"error": {"message": message, "type": error_type}}), headers=headers)
+
+    def _relay_error(self, error):
+        """
+        网关的调度器重试用完后，上游的错误响应原样返回给工作进程。带上 NO_RETRY_HEADER，
+        工作进程不再重试（否则每个请求最多发送 网关重试次数 × 工作进程重试次数 次）；Retry-After 一并转发，
+        工作进程的调度器据此收缩并发
+        """
+        response = error.response
+        headers = {NO_RETRY_HEADER: "1"}
+        if response.headers.get("retry-after"):
+            headers["Retry-After"] = response.headers["retry-after"]
+        self._send(response.status_code, response.content,
+                   response.headers.get("content-type", "application/json"), headers)
+
+    def _start_chunked(self, headers=None):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+
+    def _write_chunk(self, data):
+        if data:
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            self.wfile.flush()
+
+    def _end_chunked(self):
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    # ---- 路由 ----
+
+    def _route(self):
+        """/<provider>/<endpoint>，返回 (provider, endpoint)，provider 未知时为 None"""
+        provider, _, endpoint = self.path.split("?", 1)[0].strip("/").partition("/")
+        # 兼容以 /v1 结尾的 base_url
+        if endpoint.startswith("v1/"):
+            endpoint = endpoint[3:]
+        return (provider if provider in PROVIDER_KEYS else None), endpoint
+
+    def _client_key(self):
+        auth = self.headers.get("Authorization") or ""
+        return auth[7:].strip() if auth.startswith("Bearer ") else ""
+
+    def _authorized(self):
+        token = self.server.options["token"]
+        return not token or self._client_key() == token
+
+    def do_GET(self):
+        path = self.path.split("?", 1)[0]
+        if path == "/health":
+            return self._send(200, json.dumps({"status": "ok"}))
+        if path == "/metrics":
+            return self._send(200, get_metrics().prometheus(), "text/plain")
+        if path == "/metrics.jsonl":
+            return self._send(200, get_metrics().jsonl(), "application/x-ndjson")
+
+        provider, endpoint = self._route()
+        if provider is None or endpoint != "models":
+            return self._send_error(404, f"Unknown path: {path}")
+        if not self._authorized():
+            return self._send_error(401, "Invalid gateway token", "authentication_error")
+        # 模型列表（也用于工作进程预热到网关的连接）
+        base_url, api_key = self._upstream(provider)
+        key = parse_keys(api_key)[0][0] if api_key else ""
+        try:
+            response = get_http_client(base_url, key).get(f"{base_url}/models",
+                                                          headers={"Authorization": f"Bearer {key}"},
+                                                          timeout=10.0)
+        except Exception as e:
+            return self._send_error(502, f"Upstream request failed: {e}")
+        self._send(response.status_code, response.content, response.headers.get("content-type", "application/json"))
+
+    def do_POST(self):
+        # 先读完请求体，提前返回错误时长连接上的下一个请求才能正确解析
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        provider, endpoint = self._route()
+        if provider is None or endpoint != "chat/completions":
+            return self._send_error(404, f"Unknown path: {self.path}")
+        if not self._authorized():
+            return self._send_error(401, "Invalid gateway token", "authentication_error")
+        try:
+            payload = json.loads(body)
+        except ValueError as e:
+            return self._send_error(400, f"Invalid JSON body: {e}", "invalid_request_error")
+        base_url, api_key = self._upstream(provider)
+        if not api_key:
+            return self._send_error(401, f"No {provider} API key configured on the gateway",
+                                    "authentication_error")
+
+        import httpx
+        trace = CallTrace(provider, payload.get("model"))
+        try:
+            with trace:
+                if payload.get("stream"):
+                    self._stream(provider, base_url, api_key, payload)
+                else:
+                    self._complete(provider, base_url, api_key, payload)
+        except httpx.HTTPStatusError as e:
+            self._relay_error(e)
+        except RelayError as e:
+            # 已经发出了部分流式数据，只能断开连接
+            self.close_connection = True
+            self.log_error("stream relay failed: %s", e)
+        except Exception as e:
+            # 网络错误同样已经由网关重试过
+            self._send_error(502, f"Upstream request failed: {e}", headers={NO_RETRY_HEADER: "1"})
+
+    def _upstream(self, provider):
+        token = self.server.options["token"]
+        # 配置了网关 token 时工作进程携带的是 token，不是服务商的 key
+        return upstream_credentials(provider, None if token else self._client_key())
+
+    # ---- 转发 ----
+
+    def _cache_key(self, base_url, payload):
+        if not self.server.options["cache"]:
+            return None
+        if not is_deterministic(payload.get("temperature", 1.0), payload.get("seed") or 0):
+            return None
+        # 加上前缀，与节点自己的缓存条目（值的格式不同）区分开
+        return make_cache_key(f"gateway:{base_url}", payload)
+
+    def _complete(self, provider, base_url, api_key, payload):
+        """非流式请求：响应缓存 -> 请求合并 -> 调度器 / key 池 -> 上游"""
+        trace = current_trace()
+        cache = get_response_cache()
+        cache_key = self._cache_key(base_url, payload)
+        if cache_key:
+            cached = cache.get(cache_key)
+            if cached is not None:
+                trace.cached = True
+                return self._send(200, cached[0], headers={"X-DeepAide-Cache": "hit"})
+
+        def _send(preview):
+            return run_with_keys(provider, api_key,
+                                 lambda key: self._forward(base_url, key, payload),
+                                 estimate_request_tokens(payload))
+
+        body, shared = get_single_flight().run(make_flight_key(base_url, api_key, payload), _send)
+        trace.coalesced = shared
+        if cache_key and not shared:
+            cache.set(cache_key, (body,))
+        self._send(200, body, headers={"X-DeepAide-Cache": "coalesced" if shared else "miss"})
+
+    def _forward(self, base_url, api_key, payload):
+        """发送一次非流式请求，返回响应体文本"""
+        client = get_http_client(base_url, api_key)
+        timeout, _ = http_timeout(payload.get("model", ""), payload.get("max_tokens"), False)
+        start = time.perf_counter()
+        response = client.post(f"{base_url}/chat/completions", json=payload,
+                               headers={"Authorization": f"Bearer {api_key}"}, timeout=timeout)
+        response.raise_for_status()
+        usage = response.json().get("usage")
+        observe_speed(payload.get("model", ""), usage, time.perf_counter() - start)
+        current_trace().record_response(usage)
+        return response.text
+
+    def _stream(self, provider, base_url, api_key, payload):
+        """
+        流式请求：响应缓存 -> 请求合并 -> 调度器 / key 池 -> 上游。相同的请求同时在途时只向上游发送一次，
+        数据块同时转发给所有等待的工作进程（后加入的先补发已经转发过的部分）；
+        完成后拼成非流式响应写入缓存，命中缓存（包括非流式请求留下的）时改写成 SSE 返回。
+        """
+        trace = current_trace()
+        cache = get_response_cache()
+        cache_key = self._cache_key(base_url, payload)
+        cached = cache.get(cache_key) if cache_key else None
+        if cached is not None:
+            trace.cached = True
+            self._start_chunked({"X-DeepAide-Cache": "hit"})
+            for event in _completion_events(cached[0]):
+                self._write_chunk(b"data: " + json.dumps(event, ensure_ascii=False).encode("utf-8") + b"\n\n")
+            self._write_chunk(b"data: [DONE]\n\n")
+            self._end_chunked()
+            return
+
+        writer = _StreamWriter(self)
+
+        def _send(fanout):
+            writer.leader = True
+            completion = run_with_keys(provider, api_key,
+                                       lambda key: self._relay(base_url, key, payload, fanout),
+                                       estimate_request_tokens(payload))
+            # 先写缓存再发出 [DONE]，工作进程收到完整回答后的下一个请求一定能命中
+            # 上游中途结束（没有 finish_reason）的回答不缓存
+            if cache_key and completion["choices"] and \
+                    all(choice["finish_reason"] for choice in completion["choices"]):
+                cache.set(cache_key, (json.dumps(completion, ensure_ascii=False),))
+            fanout.update(None, "data: [DONE]\n\n")
+            fanout.finish(completion)
+            return completion
+
+        _, shared = get_single_flight().run(make_flight_key(base_url, api_key, payload), _send, writer)
+        trace.coalesced = shared
+        if writer.broken:
+            self.close_connection = True
+
+    def _relay(self, base_url, api_key, payload, fanout):
+        """发送一次流式请求，逐行转发给所有等待者，返回拼好的非流式响应（由调用方结束等待者的响应）"""
+        client = get_http_client(base_url, api_key)
+        model = payload.get("model", "")
+        timeout, idle = http_timeout(model, payload.get("max_tokens"), True)
+        start = time.perf_counter()
+        events = []
+        with client.stream("POST", f"{base_url}/chat/completions", json=payload,
+                           headers={"Authorization": f"Bearer {api_key}"}, timeout=timeout) as response:
+            # 响应头之前的错误（429、5xx、连接失败）由调度器重试
+            if response.is_error:
+                response.read()
+                response.raise_for_status()
+            response.request.extensions.get("timeout", {})["read"] = idle
+            try:
+                fanout.start()
+                first_byte = None
+                pending = b""
+                for chunk in response.iter_bytes():
+                    if first_byte is None:
+                        first_byte = time.perf_counter() - start
+                    # 只转发完整的行，多字节字符不会被拆开，后加入的等待者补发时也从行首开始
+                    pending += chunk
+                    end = pending.rfind(b"\n") + 1
+                    if not end:
+                        continue
+                    events.append(_strip_done(pending[:end].decode("utf-8")))
+                    pending = pending[end:]
+                    fanout.update(None, events[-1])
+                    if all(writer.broken for writer in fanout.flight.previews):
+                        raise RelayError("all workers disconnected")
+                if pending:
+                    events.append(_strip_done(pending.decode("utf-8")))
+                    fanout.update(None, events[-1])
+            except Exception as e:
+                # 上游中途断开或所有工作进程都关闭了连接（退出 with 时上游连接随之关闭，服务端停止生成）
+                raise RelayError(str(e)) from e
+        completion = _assemble_completion("".join(events))
+        usage = completion.get("usage")
+        observe_speed(model, usage, time.perf_counter() - start, first_byte)
+        current_trace().record_response(usage, first_byte)
+        return completion
+
+
+class GatewayServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, options=None, verbose=False):
+        super().__init__(address, GatewayHandler)
+        self.options = dict(load_gateway_options(), **(options or {}))
+        self.verbose = verbose
+
+
+def start_gateway(host=None, port=None, options=None, verbose=False):
+    """在后台线程中启动网关，返回 (server, base_url)；port 为 0 时随机选择端口"""
+    defaults = load_gateway_options()
+    server = GatewayServer((host or defaults["host"], defaults["port"] if port is None else port),
+                           options, verbose)
+    thread = threading.Thread(target=server.serve_forever, name="deepaide-gateway", daemon=True)
+    thread.start()
+    host, port = server.server_address[:2]
+    return server, f"http://{host}:{port}"
+
+
+def main(argv=None):
+    options = load_gateway_options()
+    parser = argparse.ArgumentParser(description="Shared OpenAI-compatible gateway for DeepAide workers")
+    parser.add_argument("--host", default=options["host"])
+    parser.add_argument("--port", type=int, default=options["port"])
+    parser.add_argument("--verbose", action="store_true", help="log every request")
+    args = parser.parse_args(argv)
+
+    server = GatewayServer((args.host, args.port), verbose=args.verbose)
+    host, port = server.server_address[:2]
+    for provider in PROVIDER_KEYS:
+        base_url, api_key = upstream_credentials(provider)
+        keys = len(parse_keys(api_key))
+        print(f"[gateway] http://{host}:{port}/{provider} -> {base_url} ({keys} key(s))")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,80 @@
+from .tokens import estimate_messages_tokens, context_window, clamp_max_tokens
+
+# 多轮对话历史压缩：超出预算时丢弃最早的轮次，或把它们合并成一段滚动摘要
+
+SUMMARY_PREFIX = "[Summary of the earlier conversation]\n"
+
+SUMMARY_SYSTEM_PROMPT = (
+    "Summarize the following conversation so it can replace the original turns as context. "
+    "Keep facts, decisions, constraints and open questions. Be concise and use the language "
+    "of the conversation."
+)
+
+
+def split_turns(messages):
+    """把不含 system 的历史按 user 开头切分成轮次"""
+    turns = []
+    for message in messages:
+        if message["role"] == "user" or not turns:
+            turns.append([message])
+        else:
+            turns[-1].append(message)
+    return turns
+
+
+def is_summary_turn(turn):
+    return bool(turn) and str(turn[0].get("content", "")).startswith(SUMMARY_PREFIX)
+
+
+def build_summary_messages(messages):
+    """构建生成摘要的请求 messages"""
+    transcript = "\n\n".join(f"{m['role']}: {m.get('content', '')}" for m in messages)
+    return [
+        {"role": "system", "content": SUMMARY_SYSTEM_PROMPT},
+        {"role": "user", "content": transcript},
+    ]
+
+
+def compact_history(history, budget, summarize=None, low_water=1.0):
+    """
+    把不含 system 的历史压缩到 budget 个 token 以内，最后一轮（当前提问）始终保留。
+    提供 summarize(messages) -> str 时，被丢弃的轮次会与旧摘要合并成新的摘要轮次，
+    否则直接丢弃最早的轮次。low_water 小于 1 时一次压缩到 budget * low_water，
+    减少之后每轮都要滑动窗口（从而改变前缀）的次数。
+    """
+    if estimate_messages_tokens(history) <= budget:
+        return history
+    budget = int(budget * low_water)
+
+    turns = split_turns(history)
+    summary = turns.pop(0) if is_summary_turn(turns[0]) else []
+    dropped = []
+    while len(turns) > 1 and estimate_messages_tokens(summary + [m for t in turns for m in t]) > budget:
+        dropped.extend(turns.pop(0))
+
+    if summarize is not None and dropped:
+        text = summarize(summary + dropped)
+        summary = [
+            {"role": "user", "content": SUMMARY_PREFIX + text},
+            {"role": "assistant", "content": "OK"},
+        ]
+        # 摘要本身放不下时再继续丢弃旧轮次
+        while len(turns) > 1 and estimate_messages_tokens(summary + [m for t in turns for m in t]) > budget:
+            turns.pop(0)
+    elif dropped:
+        summary = []
+
+    return summary + [m for t in turns for m in t]
+
+
+def fit_history(model, system_messages, history, max_tokens, context_budget=0, summarize=None,
+                low_water=1.0):
+    """
+    按上下文预算压缩历史并预检 max_tokens，返回 (history, max_tokens)。
+    context_budget 为 0 时使用模型上下文窗口减去 max_tokens。
+    """
+    budget = context_budget or context_window(model) - max_tokens
+    budget -= estimate_messages_tokens(system_messages)
+    history = compact_history(history, budget, summarize, low_water)
+    max_tokens = clamp_max_tokens(model, system_messages + history, max_tokens)
+    return history, max_tokens
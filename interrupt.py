@@ -0,0 +1,176 @@
+import sys
+import time
+import socket
+import threading
+from contextlib import contextmanager
+
+# ComfyUI 中断：用户取消队列时尽快中止正在进行的 API 请求。
+# 只读取 sys.modules 中已加载的 comfy.model_management，不在 ComfyUI 中运行时不做任何检查
+
+# 等待期间检查中断标志的间隔（秒）
+POLL_INTERVAL = 0.1
+
+
+def _model_management():
+    return sys.modules.get("comfy.model_management")
+
+
+# 在 ComfyUI 中继承它的中断异常，节点抛出后本次执行被标记为已中断（输出不会被缓存）
+_mm = _model_management()
+_InterruptBase = getattr(_mm, "InterruptProcessingException", Exception) if _mm is not None else Exception
+
+
+class RequestCancelled(_InterruptBase):
+    """请求被 ComfyUI 中断；reasoning/content 为中断前已经收到的部分流式输出"""
+
+    def __init__(self, reasoning=None, content=""):
+        super().__init__("Request interrupted")
+        self.reasoning = reasoning
+        self.content = content
+
+
+_local = threading.local()
+
+
+@contextmanager
+def cancel_scope(event):
+    """
+    在当前线程挂上一个取消事件：事件被设置后当前线程的请求和 ComfyUI 中断时一样尽快停止
+    （用于并行请求中提前结束多余的那些）
+    """
+    previous = getattr(_local, "cancel", None)
+    _local.cancel = event
+    try:
+        yield event
+    finally:
+        _local.cancel = previous
+
+
+def interrupt_requested():
+    """ComfyUI 的中断标志或当前线程的取消事件是否已设置"""
+    cancel = getattr(_local, "cancel", None)
+    if cancel is not None and cancel.is_set():
+        return True
+    mm = _model_management()
+    return mm is not None and mm.processing_interrupted()
+
+
+def check_interrupt():
+    """已中断时抛出 RequestCancelled"""
+    if interrupt_requested():
+        raise RequestCancelled()
+
+
+def interruptible_sleep(seconds):
+    """分段等待，期间被中断时抛出 RequestCancelled"""
+    deadline = time.monotonic() + seconds
+    while True:
+        check_interrupt()
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        time.sleep(min(remaining, POLL_INTERVAL))
+
+
+class _Watch:
+    """一次请求的中断监视：记录当前线程正在读写的连接，中断时把它断开"""
+
+    def __init__(self, cancel):
+        self.cancel = cancel
+        self.lock = threading.Lock()
+        self.stream = None
+        self.aborted = False
+
+    def attach(self, stream):
+        with self.lock:
+            self.stream = stream
+            aborted = self.aborted
+        if aborted:
+            _shutdown(stream)
+
+    def abort(self):
+        with self.lock:
+            if self.aborted:
+                return
+            self.aborted = True
+            stream = self.stream
+        if stream is not None:
+            _shutdown(stream)
+
+
+def _shutdown(stream):
+    """
+    shutdown 而不是 close：另一个线程阻塞在 recv 上时只有 shutdown 能让它立即返回。
+    HTTP/2 连接上还有其他请求在复用，不断开（这时只在收到数据后检查中断）
+    """
+    ssl_object = stream.get_extra_info("ssl_object")
+    if ssl_object is not None and ssl_object.selected_alpn_protocol() == "h2":
+        return
+    sock = stream.get_extra_info("socket")
+    if sock is None:
+        return
+    try:
+        # 绕过 SSLSocket.shutdown，读取线程还在使用它的 SSL 对象
+        socket.socket.shutdown(sock, socket.SHUT_RDWR)
+    except OSError:
+        pass
+
+
+_watches = set()
+_watch_lock = threading.Lock()
+_watcher = None
+
+
+def _watch_loop():
+    global _watcher
+    while True:
+        time.sleep(POLL_INTERVAL)
+        with _watch_lock:
+            if not _watches:
+                _watcher = None
+                return
+            watches = list(_watches)
+        mm = _model_management()
+        interrupted = mm is not None and mm.processing_interrupted()
+        for watch in watches:
+            if interrupted or (watch.cancel is not None and watch.cancel.is_set()):
+                watch.abort()
+
+
+def watch_connection(stream):
+    """连接在读写前调用（见 transport.py），登记为当前线程的请求正在使用的连接"""
+    watch = getattr(_local, "watch", None)
+    if watch is not None:
+        watch.attach(stream)
+
+
+@contextmanager
+def abort_on_interrupt():
+    """
+    在请求期间由一个共享的后台线程每隔 POLL_INTERVAL 检查中断（ComfyUI 的中断标志和当前线程的取消事件），
+    中断时断开请求正在使用的连接：等待响应头和流式输出的空闲间隔中也能立即停止，服务端随之停止生成。
+    因中断而断开导致的错误转为 RequestCancelled。
+    """
+    global _watcher
+    watch = _Watch(getattr(_local, "cancel", None))
+    # 不在 ComfyUI 中运行也没有取消事件时不会被中断，不用监视
+    watched = watch.cancel is not None or _model_management() is not None
+    previous = getattr(_local, "watch", None)
+    _local.watch = watch
+    if watched:
+        with _watch_lock:
+            _watches.add(watch)
+            if _watcher is None:
+                _watcher = threading.Thread(target=_watch_loop, name="deepaide-interrupt", daemon=True)
+                _watcher.start()
+    try:
+        yield watch
+    except Exception:
+        if watch.aborted:
+            raise RequestCancelled()
+        raise
+    finally:
+        _local.watch = previous
+        if watched:
+            with _watch_lock:
+                _watches.discard(watch)
@@ -0,0 +1,414 @@
+import re
+import json
+import time
+import threading
+from contextlib import contextmanager
+from .telemetry import current_trace
+
+# JSON 模式：请求 response_format 为 json_object，schema 写进系统提示词（json_object 不接受 schema），回答在本地校验。
+# 流式输出时增量解析，数组元素一结束就解析出来推送到前端；整体无法解析时先在本地修复（代码块、多余的逗号、
+# 被截断的结尾），仍然失败才重新请求。只有个别数组元素不符合 schema 时，只请求重新生成这些元素再拼回去
+
+JSON_FORMAT = {"type": "json_object"}
+
+# 字符串内只需要关心引号和反斜杠
+_STRING_SPECIAL = re.compile(r'["\\]')
+_ROOT_START = re.compile(r'[{\[]')
+_TRAILING_COMMA = re.compile(r',\s*([}\]])')
+_WHITESPACE = " \t\r\n"
+
+_TYPES = {
+    "object": dict,
+    "array": list,
+    "string": str,
+    "number": (int, float),
+    "integer": int,
+    "boolean": bool,
+    "null": type(None),
+}
+
+_local = threading.local()
+
+
+def current_parser():
+    return getattr(_local, "parser", None)
+
+
+@contextmanager
+def parser_scope(parser):
+    """在当前线程的流式请求中把回答喂给 parser"""
+    previous = current_parser()
+    _local.parser = parser
+    try:
+        yield parser
+    finally:
+        _local.parser = previous
+
+
+def load_schema(text):
+    """解析节点输入的 JSON Schema，为空时返回 None"""
+    if not text or not text.strip():
+        return None
+    try:
+        schema = json.loads(text)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Invalid JSON schema: {e}")
+    if not isinstance(schema, dict):
+        raise ValueError("JSON schema must be an object")
+    return schema
+
+
+def json_system_prompt(system_prompt, schema=None):
+    """在系统提示词后追加输出格式的要求（DeepSeek 要求提示词中出现 json 一词）"""
+    instructions = "Reply in json: a single valid JSON object and nothing else."
+    if schema:
+        instructions += " It must match this JSON schema:\n" + json.dumps(schema, ensure_ascii=False, indent=2)
+    return f"{system_prompt}\n\n{instructions}" if system_prompt else instructions
+
+
+class JSONStreamParser:
+    """
+    增量解析流式输出的 JSON。只扫描结构字符（括号、逗号和字符串边界），
+    数组元素一结束就解析出来：根为数组时是它的元素，根为对象时是各个数组字段的元素。
+    根之前的说明文字和代码块标记会被跳过。
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """重新开始解析（流式请求重试时）"""
+        self.chunks = []
+        self.length = 0
+        self.stack = []            # 未闭合的 '{' / '['
+        self.in_string = False
+        self.escape = False        # 上一块以反斜杠结尾
+        self.root_start = None
+        self.root_end = None
+        # 截断时可以安全截到的位置和此时未闭合的括号，用于补全被截断的结尾
+        self.safe_end = 0
+        self.safe_stack = ()
+        self.key = None            # 根对象中最近一个字段名
+        self.items = []            # 已解析的元素 [(字段名, 值)]，字段名为 None 表示根数组
+        self.errors = []           # 无法解析的元素 [(字段名, 序号, 原文)]
+        self.counts = {}
+        self.started = time.perf_counter()
+        self.first_item_ms = None
+        self._key_parts = None     # 正在读取的根对象字段名
+        self._element = None       # 正在读取的数组元素
+        self._array_key = None
+
+    def _at_item_level(self):
+        return self.stack == ["["] or self.stack == ["{", "["]
+
+    def feed(self, chunk):
+        """追加一段输出，返回这段输出中结束的元素 [(字段名, 值)]"""
+        completed = []
+        offset = self.length
+        self.chunks.append(chunk)
+        self.length += len(chunk)
+        if self.root_end is not None:
+            return completed
+        piece_start = 0
+        i, n = 0, len(chunk)
+        if self.escape:
+            self.escape = False
+            i = 1
+        while i < n:
+            if self.in_string:
+                match = _STRING_SPECIAL.search(chunk, i)
+                if match is None:
+                    break
+                i = match.start()
+                if chunk[i] == "\\":
+                    if i + 1 >= n:
+                        self.escape = True
+                    i += 2
+                    continue
+                self.in_string = False
+                if self._key_parts is not None:
+                    self._key_parts.append(chunk[piece_start:i])
+                    self.key = json.loads('"' + "".join(self._key_parts) + '"')
+                    self._key_parts = None
+                i += 1
+                continue
+
+            if not self.stack:
+                match = _ROOT_START.search(chunk, i)
+                if match is None:
+                    break
+                i = match.start()
+                self.root_start = offset + i
+
+            c = chunk[i]
+            if c in _WHITESPACE:
+                i += 1
+                continue
+            item_level = self._at_item_level()
+            if c == "," or (c == "]" and item_level):
+                if item_level and self._element is not None:
+                    self._finish_element(chunk[piece_start:i], completed)
+                if c == ",":
+                    self._mark_safe(offset + i)
+                    i += 1
+                    continue
+            elif item_level and self._element is None:
+                self._element = []
+                piece_start = i
+
+            if c == '"':
+                self.in_string = True
+                if self.stack == ["{"]:
+                    self._key_parts = []
+                    piece_start = i + 1
+            elif c in "{[":
+                self.stack.append(c)
+                if c == "[" and self.stack == ["{", "["]:
+                    self._array_key = self.key
+                self._mark_safe(offset + i + 1)
+            elif c in "}]":
+                if self.stack:
+                    self.stack.pop()
+                self._mark_safe(offset + i + 1)
+                if not self.stack:
+                    self.root_end = offset + i + 1
+                    break
+            i += 1
+
+        if self._element is not None:
+            self._element.append(chunk[piece_start:])
+        elif self._key_parts is not None:
+            self._key_parts.append(chunk[piece_start:])
+        return completed
+
+    def _mark_safe(self, end):
+        # 未结束的数组元素整个丢弃，不截到元素内部
+        if self._element is None:
+            self.safe_end, self.safe_stack = end, tuple(self.stack)
+
+    def _finish_element(self, tail, completed):
+        self._element.append(tail)
+        raw = "".join(self._element).strip()
+        self._element = None
+        key = None if self.stack == ["["] else self._array_key
+        index = self.counts.get(key, 0)
+        self.counts[key] = index + 1
+        try:
+            value = json.loads(raw)
+        except json.JSONDecodeError:
+            self.errors.append((key, index, raw))
+            return
+        if self.first_item_ms is None:
+            self.first_item_ms = round((time.perf_counter() - self.started) * 1000, 1)
+        self.items.append((key, value))
+        completed.append((key, value))
+
+    def text(self):
+        return "".join(self.chunks)
+
+    def document(self):
+        """根的原文；没有结束时截到最后一个完整的值并补全括号。还没有开始时返回 None"""
+        if self.root_start is None:
+            return None
+        text = self.text()
+        if self.root_end is not None:
+            return text[self.root_start:self.root_end]
+        closing = "".join("]" if c == "[" else "}" for c in reversed(self.safe_stack))
+        return text[self.root_start:self.safe_end] + closing
+
+
+def parse_json(text):
+    """
+    解析模型输出的 JSON，返回 (value, repaired)。
+    直接解析失败时去掉前后的说明文字和代码块标记、删除多余的逗号、补全被截断的结尾，仍然失败时抛出 ValueError。
+    """
+    try:
+        return json.loads(text), False
+    except json.JSONDecodeError as e:
+        error = e
+    parser = JSONStreamParser()
+    parser.feed(text)
+    document = parser.document()
+    if document is not None:
+        for candidate in (document, _TRAILING_COMMA.sub(r"\1", document)):
+            try:
+                return json.loads(candidate), True
+            except json.JSONDecodeError:
+                pass
+    raise ValueError(f"Invalid JSON output: {error}")
+
+
+def validate(value, schema, path=()):
+    """
+    按 JSON Schema 的常用子集（type / enum / properties / required / additionalProperties /
+    items / minItems / maxItems）校验，返回错误列表 [(路径, 说明)]
+    """
+    errors = []
+    expected = schema.get("type")
+    if expected is not None:
+        names = expected if isinstance(expected, list) else [expected]
+        matched = False
+        for name in names:
+            python_type = _TYPES.get(name)
+            # bool 是 int 的子类，不能当作数字
+            if python_type is not None and isinstance(value, python_type) and \
+                    not (isinstance(value, bool) and name in ("number", "integer")):
+                matched = True
+                break
+        if not matched:
+            return [(path, f"expected {' or '.join(names)}, got {type(value).__name__}")]
+    if "enum" in schema and value not in schema["enum"]:
+        errors.append((path, f"must be one of {json.dumps(schema['enum'], ensure_ascii=False)}"))
+    if isinstance(value, dict):
+        properties = schema.get("properties") or {}
+        for name in schema.get("required") or []:
+            if name not in value:
+                errors.append((path, f"missing required property '{name}'"))
+        for name, item in value.items():
+            if name in properties:
+                errors.extend(validate(item, properties[name], path + (name,)))
+            elif schema.get("additionalProperties") is False:
+                errors.append((path, f"unexpected property '{name}'"))
+    elif isinstance(value, list):
+        if "minItems" in schema and len(value) < schema["minItems"]:
+            errors.append((path, f"expected at least {schema['minItems']} items"))
+        if "maxItems" in schema and len(value) > schema["maxItems"]:
+            errors.append((path, f"expected at most {schema['maxItems']} items"))
+        if isinstance(schema.get("items"), dict):
+            for index, item in enumerate(value):
+                errors.extend(validate(item, schema["items"], path + (index,)))
+    return errors
+
+
+def format_path(path):
+    text = "$"
+    for part in path:
+        text += f"[{part}]" if isinstance(part, int) else f".{part}"
+    return text
+
+
+def find_items(value, items_key=""):
+    """返回 (字段名, 数组)：根为数组时是根本身，否则是 items_key 指定的字段或根对象的第一个数组字段"""
+    if isinstance(value, list):
+        return None, value
+    if isinstance(value, dict):
+        if items_key:
+            items = value.get(items_key)
+            return (items_key, items) if isinstance(items, list) else (None, None)
+        for key, items in value.items():
+            if isinstance(items, list):
+                return key, items
+    return None, None
+
+
+def item_text(item):
+    """数组元素转成节点输出的字符串：字符串原样输出，其他值输出 JSON"""
+    return item if isinstance(item, str) else json.dumps(item, ensure_ascii=False)
+
+
+def _item_schema(schema, key):
+    if schema is None:
+        return None
+    if key is not None:
+        schema = (schema.get("properties") or {}).get(key) or {}
+    items = schema.get("items")
+    return items if isinstance(items, dict) else None
+
+
+def _followup(params, messages):
+    followup = dict(params, messages=params["messages"] + messages)
+    if "n" in followup:
+        followup["n"] = 1
+    return followup
+
+
+def complete_json(send, params, text, schema=None, items_key="", retries=1, parser=None, strict=True):
+    """
+    解析并校验 JSON 模式的回答，返回 (value, items)。send(params) -> answer 发送一次请求，最多重新请求 retries 次：
+    整体无法解析或根对象不符合 schema 时重新请求整个回答，只有个别数组元素不符合时只重新生成这些元素。
+    重新请求沿用原来的 messages（前缀缓存仍然命中），修复和重新请求的情况记录在 trace.extra["json"]。
+    strict 为 True 时，重试用完后仍不符合 schema 会抛出 ValueError 并列出剩下的错误；否则原样返回。
+    """
+    report = {"repaired": False, "rerequests": 0}
+    if parser is not None and parser.first_item_ms is not None:
+        report["first_item_ms"] = parser.first_item_ms
+    trace = current_trace()
+    if trace is not None:
+        trace.extra["json"] = report
+
+    while True:
+        try:
+            value, repaired = parse_json(text)
+            report["repaired"] = report["repaired"] or repaired
+            break
+        except ValueError as e:
+            if report["rerequests"] >= retries:
+                raise
+            report["rerequests"] += 1
+            text = send(_followup(params, [
+                {"role": "assistant", "content": text},
+                {"role": "user", "content": f"That reply is not valid JSON ({e}). "
+                                            "Reply with the complete corrected JSON only."},
+            ]))
+
+    errors = validate(value, schema) if schema else []
+    while errors and report["rerequests"] < retries:
+        report["rerequests"] += 1
+        key, items = find_items(value, items_key)
+        prefix = () if key is None else (key,)
+        failed = {}
+        document_errors = []
+        for path, message in errors:
+            if items is not None and len(path) > len(prefix) and path[:len(prefix)] == prefix \
+                    and isinstance(path[len(prefix)], int):
+                failed.setdefault(path[len(prefix)], []).append(f"{format_path(path)}: {message}")
+            else:
+                document_errors.append(f"{format_path(path)}: {message}")
+
+        if document_errors or not failed:
+            answer = send(_followup(params, [
+                {"role": "assistant", "content": json.dumps(value, ensure_ascii=False)},
+                {"role": "user", "content": "That JSON does not match the schema:\n" + "\n".join(
+                    f"- {error}" for error in document_errors + sum(failed.values(), [])) +
+                    "\nReply with the complete corrected JSON only."},
+            ]))
+            try:
+                value = parse_json(answer)[0]
+            except ValueError:
+                break
+        else:
+            # 只重新生成不符合要求的元素
+            indices = sorted(failed)
+            item_schema = _item_schema(schema, key)
+            listing = "\n".join(f"- {json.dumps(items[index], ensure_ascii=False)}\n  " +
+                                "; ".join(failed[index]) for index in indices)
+            request = (f"These {len(indices)} items of the array {format_path(prefix)} are invalid:\n{listing}\n")
+            if item_schema:
+                request += f"Each item must match this JSON schema:\n{json.dumps(item_schema, ensure_ascii=False)}\n"
+            request += (f"Reply in json: an object {{\"items\": [...]}} with corrected versions of only "
+                        f"these {len(indices)} items, in the same order.")
+            # 先放上一次的回答，模型才知道这些元素出自哪里，也能对照其他合格的元素修改
+            answer = send(_followup(params, [
+                {"role": "assistant", "content": json.dumps(value, ensure_ascii=False)},
+                {"role": "user", "content": request},
+            ]))
+            try:
+                _, fixed = find_items(parse_json(answer)[0], "items")
+            except ValueError:
+                fixed = None
+            if fixed is None or len(fixed) != len(indices):
+                break
+            for index, item in zip(indices, fixed):
+                items[index] = item
+            report["fixed_items"] = report.get("fixed_items", 0) + len(indices)
+        errors = validate(value, schema)
+
+    if errors:
+        report["errors"] = [f"{format_path(path)}: {message}" for path, message in errors[:10]]
+        if strict:
+            more = f"\n- ... and {len(errors) - 10} more" if len(errors) > 10 else ""
+            raise ValueError(f"JSON does not match the schema after {report['rerequests']} re-request(s):\n" +
+                             "\n".join(f"- {error}" for error in report["errors"]) + more)
+    _, items = find_items(value, items_key)
+    report["items"] = len(items) if items is not None else 0
+    return value, items or []
@@ -0,0 +1,152 @@
+import time
+import threading
+from .scheduler import get_scheduler, retry_info, upstream_retried
+from .telemetry import current_trace
+from .deadline import has_budget, sleep_within_deadline
+
+# API key 池：同一服务商配置多个 key 时把请求分散到各个账号，
+# 每个 key 有自己的限速和并发（见 scheduler），返回 401/402/429 的 key 暂时移出轮换
+
+# 各状态码的默认冷却时间（秒），429 优先使用 Retry-After
+SUSPEND_SECONDS = {
+    401: 600.0,  # key 无效或被禁用
+    402: 600.0,  # 余额不足
+    429: 10.0,
+}
+
+
+def parse_keys(api_key):
+    """
+    把配置中的 key 统一成 [(key, limits), ...]。
+    每一项可以是字符串，也可以是 {"key": "...", "rpm": ..., "tpm": ..., "max_concurrency": ...}。
+    """
+    if not api_key:
+        return []
+    if isinstance(api_key, str):
+        return [(api_key, {})]
+    keys = []
+    for entry in api_key:
+        if isinstance(entry, dict):
+            if entry.get("key"):
+                keys.append((entry["key"], {k: v for k, v in entry.items() if k != "key"}))
+        elif entry:
+            keys.append((str(entry), {}))
+    return keys
+
+
+def mask_key(key):
+    return f"{key[:3]}...{key[-4:]}" if len(key) > 10 else "***"
+
+
+class KeyPool:
+    def __init__(self, provider, keys):
+        self.provider = provider
+        self.keys = keys
+        self.lock = threading.Lock()
+        self.suspended = {}   # key -> 恢复时间
+        self.cursor = 0
+
+    def _scheduler(self, key, limits):
+        return get_scheduler(self.provider, key, limits)
+
+    def pick(self):
+        """
+        选出空闲并发最多的可用 key，并列时轮流使用；
+        所有 key 都在冷却时返回 (None, 最早恢复的等待时间)。
+        """
+        with self.lock:
+            now = time.monotonic()
+            best = None
+            best_free = None
+            count = len(self.keys)
+            for offset in range(count):
+                index = (self.cursor + offset) % count
+                key, limits = self.keys[index]
+                if self.suspended.get(key, 0) > now:
+                    continue
+                limiter = self._scheduler(key, limits).limiter
+                free = limiter.limit - limiter.in_flight
+                if best_free is None or free > best_free:
+                    best, best_free = index, free
+            if best is None:
+                return None, min(self.suspended.values()) - now
+            self.cursor = (best + 1) % count
+            return self.keys[best], 0.0
+
+    def suspend(self, key, status, retry_after=None):
+        seconds = retry_after if status == 429 and retry_after is not None else SUSPEND_SECONDS[status]
+        with self.lock:
+            self.suspended[key] = time.monotonic() + seconds
+        print(f"[{self.provider}] API key {mask_key(key)} returned {status}, "
+              f"removed from rotation for {seconds:.0f}s")
+
+    def run(self, fn, estimated_tokens=0, max_retries=None):
+        """
+        用选中的 key 执行 fn(key)。key 返回 401/402/429 时暂停它并立即换下一个 key 重试
+        （不计入重试次数），其他可重试的错误按退避等待后重试。
+        """
+        if max_retries is None:
+            max_retries = self._scheduler(*self.keys[0]).limits["max_retries"]
+        attempt = 0
+        switches = 0
+        last_error = None
+        while True:
+            entry, wait = self.pick()
+            if entry is None:
+                # 所有 key 都在冷却，等待时间太长时直接报错
+                backoff_max = self._scheduler(*self.keys[0]).limits["backoff_max"]
+                if wait > backoff_max or attempt >= max_retries or not has_budget(wait):
+                    if last_error is not None:
+                        raise last_error
+                    raise RuntimeError(f"All {self.provider} API keys are temporarily unavailable")
+                sleep_within_deadline(wait)
+                attempt += 1
+                continue
+
+            key, limits = entry
+            scheduler = self._scheduler(key, limits)
+            trace = current_trace()
+            if trace is not None:
+                trace.extra["api_key"] = mask_key(key)
+            try:
+                return scheduler.run(lambda: fn(key), estimated_tokens, max_retries=0)
+            except Exception as e:
+                last_error = e
+                retryable, status, retry_after = retry_info(e)
+                if status in SUSPEND_SECONDS and len(self.keys) > 1 and not upstream_retried(e):
+                    self.suspend(key, status, retry_after)
+                    if switches < len(self.keys):
+                        # 换一个 key 立即重试
+                        switches += 1
+                        continue
+                delay = retry_after if retry_after is not None else scheduler.backoff(attempt)
+                if not retryable or attempt >= max_retries or not has_budget(delay):
+                    raise
+            print(f"[{self.provider}] request failed ({status or 'network error'}), "
+                  f"retrying in {delay:.1f}s ({attempt + 1}/{max_retries})")
+            sleep_within_deadline(delay)
+            attempt += 1
+
+
+_pools = {}
+_lock = threading.Lock()
+
+
+def run_with_keys(provider, api_key, fn, estimated_tokens=0, max_retries=None):
+    """
+    api_key 为单个字符串时走服务商共享的调度器，配置了多个 key 时由 key 池分发。
+    fn(key) 发送一次请求。
+    """
+    keys = parse_keys(api_key)
+    if len(keys) == 1 and not keys[0][1]:
+        key = keys[0][0]
+        return get_scheduler(provider).run(lambda: fn(key), estimated_tokens, max_retries)
+    pool_key = (provider, tuple(key for key, _ in keys))
+    pool = _pools.get(pool_key)
+    if pool is None:
+        with _lock:
+            pool = _pools.get(pool_key)
+            if pool is None:
+                pool = KeyPool(provider, keys)
+                _pools[pool_key] = pool
+    return pool.run(fn, estimated_tokens, max_retries)
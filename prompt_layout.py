@@ -0,0 +1,74 @@
+import json
+from functools import lru_cache
+
+# 面向前缀缓存的提示词布局：系统提示词和示例对话组成逐字节稳定的固定前缀，
+# 每次请求、每轮对话都放在 messages 的最前面，便于命中服务商的上下文缓存
+
+LAYOUTS = ("standard", "prefix_cache")
+
+# prefix_cache 布局下历史超出预算时一次压缩到预算的这个比例，
+# 之后几轮只在末尾追加，前缀保持不变
+PREFIX_CACHE_LOW_WATER = 0.75
+
+
+def canonical_text(text):
+    """统一换行符并去掉行尾和首尾空白，避免不可见的差异破坏前缀"""
+    lines = str(text or "").replace("\r\n", "\n").replace("\r", "\n").split("\n")
+    return "\n".join(line.rstrip() for line in lines).strip()
+
+
+def parse_few_shot(text):
+    """
+    解析示例对话：JSON 数组，元素为 {"user": ..., "assistant": ...} 或 [user, assistant]。
+    返回交替的 user/assistant 消息列表。
+    """
+    if not text or not text.strip():
+        return []
+    try:
+        examples = json.loads(text)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"few_shot must be a JSON array: {e}")
+    if not isinstance(examples, list):
+        raise ValueError("few_shot must be a JSON array")
+    messages = []
+    for example in examples:
+        if isinstance(example, dict):
+            user, assistant = example.get("user"), example.get("assistant")
+        elif isinstance(example, (list, tuple)) and len(example) == 2:
+            user, assistant = example
+        else:
+            raise ValueError(f"Invalid few_shot example: {example!r}")
+        messages.append({"role": "user", "content": str(user)})
+        messages.append({"role": "assistant", "content": str(assistant)})
+    return messages
+
+
+@lru_cache(maxsize=64)
+def _build_prefix(system_prompt, few_shot, layout):
+    examples = parse_few_shot(few_shot)
+    if layout == "prefix_cache":
+        system_prompt = canonical_text(system_prompt)
+        examples = [dict(m, content=canonical_text(m["content"])) for m in examples]
+    return tuple([{"role": "system", "content": system_prompt}] + examples)
+
+
+def build_prefix(system_prompt, few_shot="", layout="standard"):
+    """返回固定前缀 messages（系统提示词 + 示例对话），调用方不要修改返回的消息"""
+    return list(_build_prefix(system_prompt, few_shot or "", layout))
+
+
+def strip_prefix(messages, prefix=()):
+    """
+    去掉旧版本保存在会话开头的 system 消息，只留下对话历史；
+    传入本轮的前缀时，紧跟其后、与前缀中的示例对话相同的消息也一并去掉（standard 布局曾把它们存进会话）
+    """
+    index = 0
+    while index < len(messages) and messages[index]["role"] == "system":
+        index += 1
+    examples = [m for m in prefix if m["role"] != "system"]
+    if index and examples and len(messages) - index >= len(examples) and all(
+            stored["role"] == example["role"] and
+            canonical_text(stored["content"]) == canonical_text(example["content"])
+            for stored, example in zip(messages[index:], examples)):
+        index += len(examples)
+    return messages[index:]
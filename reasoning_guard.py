@@ -0,0 +1,127 @@
+import threading
+from contextlib import contextmanager
+from .config import load_config
+from .telemetry import current_trace
+
+# 推理预算：思考模型的 reasoning_content 过长时决定了整次调用的延迟。流式输出时统计推理 token 数和思考阶段的耗时，
+# 超出预算就断开连接（服务端随之停止生成），改用对应的非思考模型重新回答。
+# SiliconFlow 的思考模型还会收到 thinking_budget 参数，由服务端直接结束思考阶段
+
+# 思考模型 -> 超出预算时改用的非思考模型（可在 config.json 的 reasoning_fallbacks 中覆盖）
+FALLBACK_MODELS = {
+    "deepseek-reasoner": "deepseek-chat",
+    "deepseek-ai/DeepSeek-R1": "deepseek-ai/DeepSeek-V3.2-Exp",
+    "moonshotai/Kimi-K2-Thinking": "moonshotai/Kimi-K2-Instruct-0905",
+    "zai-org/GLM-4.6": "deepseek-ai/DeepSeek-V3.2-Exp",
+    "Qwen/Qwen3-VL-235B-A22B-Thinking": "Qwen/Qwen3-VL-235B-A22B-Instruct",
+}
+
+# 非思考模型接受的最大 max_tokens：Reasoner 节点允许的 max_tokens 更大，改用这些模型时要截到上限，
+# 否则正好在预算触发时收到 400。SiliconFlow 的模型与聊天节点的上限一致
+FALLBACK_MAX_TOKENS = {
+    "deepseek-chat": 8192,
+    "deepseek-ai/DeepSeek-V3.2-Exp": 4096,
+    "moonshotai/Kimi-K2-Instruct-0905": 4096,
+    "Qwen/Qwen3-VL-235B-A22B-Instruct": 4096,
+}
+
+# SiliconFlow 的 thinking_budget 取值范围
+THINKING_BUDGET_RANGE = (128, 32768)
+
+# 服务端按 thinking_budget 结束思考时，本地的 token 估算有误差，留出余量再由客户端截断
+SERVER_BUDGET_SLACK = 1.25
+
+_local = threading.local()
+
+
+class ReasoningBudgetExceeded(Exception):
+    """思考阶段超出了推理预算；reasoning/content 为断开前已收到的部分输出"""
+
+    def __init__(self, reasoning=None, content=""):
+        super().__init__("Reasoning budget exceeded")
+        self.reasoning = reasoning
+        self.content = content
+
+
+class ReasoningGuard:
+    """max_tokens 为推理 token 上限，max_seconds 为思考阶段（从发出请求到开始输出回答）的耗时上限，0 表示不限制"""
+
+    def __init__(self, max_tokens=0, max_seconds=0.0):
+        self.max_tokens = max_tokens
+        self.max_seconds = max_seconds
+        self.reason = None  # 触发时为 "tokens" 或 "time"
+        self.tokens = 0
+        self.elapsed = 0.0
+
+    def check(self, tokens, elapsed):
+        """流式输出每收到一个数据块调用一次，超出预算时返回 True"""
+        self.tokens, self.elapsed = tokens, elapsed
+        if self.max_tokens and tokens > self.max_tokens:
+            self.reason = "tokens"
+        elif self.max_seconds and elapsed > self.max_seconds:
+            self.reason = "time"
+        return self.reason is not None
+
+    def report(self):
+        report = {"fired": self.reason is not None, "reasoning_tokens": int(self.tokens),
+                  "thinking_seconds": round(self.elapsed, 2)}
+        if self.reason is not None:
+            report["reason"] = self.reason
+        return report
+
+
+def current_guard():
+    return getattr(_local, "guard", None)
+
+
+@contextmanager
+def guard_scope(guard):
+    previous = current_guard()
+    _local.guard = guard
+    try:
+        yield guard
+    finally:
+        _local.guard = previous
+
+
+def fallback_model(model):
+    fallbacks = dict(FALLBACK_MODELS)
+    fallbacks.update(load_config().get('reasoning_fallbacks') or {})
+    return fallbacks.get(model)
+
+
+def apply_thinking_budget(payload, max_tokens):
+    """SiliconFlow 请求：由服务端在 thinking_budget 个 token 后结束思考阶段"""
+    low, high = THINKING_BUDGET_RANGE
+    payload["thinking_budget"] = max(low, min(high, int(max_tokens)))
+
+
+def guarded_completion(send, params, max_tokens=0, max_seconds=0.0, fallback=True):
+    """
+    在推理预算下执行 send(params) -> (reasoning, answer)。预算只能在流式输出时检查，params 会被改成流式请求。
+    超出预算时 fallback 为 True 则用对应的非思考模型重新请求，返回 (部分推理过程, 新的回答, fired)；
+    否则抛出 ReasoningBudgetExceeded。是否触发、原因和触发时的推理量记录在 trace.extra["reasoning_guard"]。
+    """
+    guard = ReasoningGuard(max_tokens, max_seconds)
+    if "thinking_budget" in params and max_tokens:
+        guard.max_tokens = int(max_tokens * SERVER_BUDGET_SLACK)
+    trace = current_trace()
+    report = trace.extra.setdefault("reasoning_guard", {}) if trace is not None else {}
+    try:
+        with guard_scope(guard):
+            reasoning, answer = send(dict(params, stream=True))
+        return reasoning, answer, False
+    except ReasoningBudgetExceeded as e:
+        model = fallback_model(params["model"]) if fallback else None
+        if model is None:
+            raise
+        report["fallback_model"] = model
+        print(f"Reasoning budget exceeded ({guard.reason}) for {params['model']} after "
+              f"{guard.elapsed:.1f}s / ~{guard.tokens:.0f} tokens, answering with {model}")
+        retry = {k: v for k, v in params.items() if k != "thinking_budget"}
+        if model in FALLBACK_MAX_TOKENS and retry.get("max_tokens"):
+            retry["max_tokens"] = min(int(retry["max_tokens"]), FALLBACK_MAX_TOKENS[model])
+        _, answer = send(dict(retry, model=model))
+        return e.reasoning or "", answer, True
+    finally:
+        report.update(guard.report())
@@ -0,0 +1,521 @@
+import json
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from . import deepseek
+from . import silicon_deepseek
+from .config import load_config, get_credentials
+from .cache import get_response_cache, make_cache_key, is_deterministic, cache_is_changed
+from .aio import AsyncExecuteMixin, EXECUTE_FUNCTION
+from .telemetry import CallTrace
+from .interrupt import RequestCancelled, POLL_INTERVAL, cancel_scope, check_interrupt
+from .deadline import DeadlineExceeded, current_deadline, deadline_scope
+
+# 多服务商路由：逻辑模型映射到按优先级排列的端点，带熔断、延迟统计和对冲请求；
+# 以及同时向多个端点发送同一个提示词的并行对比
+
+DEFAULT_ROUTES = {
+    "deepseek-v3": [
+        {"provider": "deepseek", "model": "deepseek-chat"},
+        {"provider": "siliconflow", "model": "deepseek-ai/DeepSeek-V3.2-Exp"},
+    ],
+    "deepseek-r1": [
+        {"provider": "deepseek", "model": "deepseek-reasoner"},
+        {"provider": "siliconflow", "model": "deepseek-ai/DeepSeek-R1"},
+    ],
+}
+
+# 各服务商的请求函数
+PROVIDERS = {
+    "deepseek": deepseek.chat_completion,
+    "siliconflow": silicon_deepseek.chat_completion,
+}
+
+
+def load_routes():
+    """从配置文件加载路由表，未配置时使用默认路由"""
+    return load_config().get('routes') or DEFAULT_ROUTES
+
+
+class EndpointStats:
+    """单个端点的熔断器和延迟统计"""
+
+    def __init__(self, failure_threshold=3, cooldown=30.0, alpha=0.2, window=100):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.alpha = alpha
+        self.lock = threading.Lock()
+        self.latencies = deque(maxlen=window)
+        self.ewma = None
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def admit(self):
+        """
+        熔断打开时拒绝请求；冷却后放行一个探测请求（半开状态）。
+        返回 (是否放行, 是否为探测请求)，探测请求结束时必须调用 record_success / record_failure / release_probe
+        """
+        with self.lock:
+            if self.opened_at is None:
+                return True, False
+            if time.monotonic() - self.opened_at >= self.cooldown and not self.probing:
+                self.probing = True
+                return True, True
+            return False, False
+
+    def release_probe(self):
+        """探测请求被取消（中断、deadline 用完）时不算成功也不算失败，放行下一个探测请求"""
+        with self.lock:
+            self.probing = False
+
+    def record_success(self, latency):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+            self.latencies.append(latency)
+            self.ewma = latency if self.ewma is None else self.alpha * latency + (1 - self.alpha) * self.ewma
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.probing = False
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+    def p95(self):
+        with self.lock:
+            if not self.latencies:
+                return None
+            ordered = sorted(self.latencies)
+            return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        return "half-open" if self.probing else "open"
+
+
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def get_endpoint_stats(endpoint):
+    key = (endpoint["provider"], endpoint["model"])
+    with _stats_lock:
+        stats = _stats.get(key)
+        if stats is None:
+            stats = EndpointStats()
+            _stats[key] = stats
+        return stats
+
+
+def endpoint_credentials(endpoint):
+    """返回端点的 (base_url, api_key)，没有配置 key 时抛出 ValueError（在熔断器放行之前检查）"""
+    base_url, api_key = get_credentials(endpoint["provider"])
+    if not api_key:
+        raise ValueError(f"API key for {endpoint['provider']} is not configured")
+    return base_url, api_key
+
+
+def _call_endpoint(endpoint, params, coalesce=True, expires=None, max_retries=0, probe=False,
+                   credentials=None):
+    send = PROVIDERS[endpoint["provider"]]
+    base_url, api_key = credentials or endpoint_credentials(endpoint)
+    stats = get_endpoint_stats(endpoint)
+    trace = CallTrace(endpoint["provider"], endpoint["model"])
+    start = time.monotonic()
+    try:
+        with trace, deadline_scope(expires=expires):
+            # 路由自己负责故障转移，默认不在单个端点上重试
+            reasoning, answer = send(base_url, api_key, dict(params, model=endpoint["model"]),
+                                     max_retries=max_retries, coalesce=coalesce)
+    except (RequestCancelled, DeadlineExceeded):
+        # 用户中断和节点的 deadline 用完不算端点故障，但要交还探测名额，否则熔断器会一直打开
+        if probe:
+            stats.release_probe()
+        raise
+    except Exception:
+        stats.record_failure()
+        raise
+    stats.record_success(time.monotonic() - start)
+    return reasoning, answer, trace.to_json()
+
+
+_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="deepaide-router")
+
+
+def _cancellable_call(endpoint, params, coalesce, expires, max_retries, cancel, probe, credentials):
+    # 在工作线程中挂上取消事件，调用方拿到需要的结果后其余请求尽快停止
+    with cancel_scope(cancel):
+        return _call_endpoint(endpoint, params, coalesce, expires, max_retries, probe, credentials)
+
+
+def route_chat_completion(logical_model, params, hedge=True, hedge_delay=0.0, coalesce=True):
+    """
+    按路由表依次尝试端点，返回 (reasoning, answer, endpoint, usage)。
+    hedge 为 True 时，主请求超过 hedge_delay（0 表示用主端点的 p95 延迟）仍未返回，
+    就向下一个端点发送对冲请求，采用先返回的结果。
+    """
+    routes = load_routes()
+    if logical_model not in routes:
+        raise ValueError(f"Unknown logical model: {logical_model}")
+    candidates = routes[logical_model]
+    # 各端点的请求在线程池中执行，截止时间要显式带过去
+    expires = current_deadline()
+    # 拿到结果后取消其余的请求（对冲输掉的一方断开连接，服务端停止生成和计费）
+    cancel = threading.Event()
+    errors = []
+    pending = {}
+    next_index = 0
+
+    def _launch():
+        """启动下一个熔断器放行的端点，没有可用端点时返回 False"""
+        nonlocal next_index
+        while next_index < len(candidates):
+            endpoint = candidates[next_index]
+            next_index += 1
+            try:
+                credentials = endpoint_credentials(endpoint)
+            except ValueError as e:
+                errors.append(f"{endpoint['provider']}:{endpoint['model']}: {str(e)}")
+                continue
+            allowed, probe = get_endpoint_stats(endpoint).admit()
+            if allowed:
+                pending[_executor.submit(_cancellable_call, endpoint, params, coalesce, expires, 0, cancel,
+                                         probe, credentials)] = endpoint
+                return True
+            errors.append(f"{endpoint['provider']}:{endpoint['model']}: circuit open")
+        return False
+
+    _launch()
+    try:
+        while pending:
+            timeout = None
+            if hedge and next_index < len(candidates) and len(pending) == 1:
+                primary = next(iter(pending.values()))
+                timeout = hedge_delay or get_endpoint_stats(primary).p95()
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                # 超过对冲延迟仍未返回，向下一个端点发出对冲请求
+                if not _launch():
+                    hedge = False
+                continue
+            for future in done:
+                endpoint = pending.pop(future)
+                try:
+                    reasoning, answer, usage = future.result()
+                    return reasoning, answer, f"{endpoint['provider']}:{endpoint['model']}", usage
+                except RequestCancelled:
+                    raise
+                except Exception as e:
+                    errors.append(f"{endpoint['provider']}:{endpoint['model']}: {str(e)}")
+            # 所有进行中的请求都失败了，转移到下一个端点
+            if not pending and next_index < len(candidates):
+                _launch()
+    finally:
+        cancel.set()
+
+    raise RuntimeError("All endpoints failed: " + "; ".join(errors))
+
+
+def endpoint_name(endpoint):
+    return f"{endpoint['provider']}:{endpoint['model']}"
+
+
+def parse_endpoints(text):
+    """每行一个 provider:model（# 开头的行忽略），返回端点列表"""
+    endpoints = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        provider, sep, model = line.partition(":")
+        if not sep or provider.strip() not in PROVIDERS or not model.strip():
+            raise ValueError(f"Invalid endpoint (expected provider:model): {line}")
+        endpoints.append({"provider": provider.strip(), "model": model.strip()})
+    return endpoints
+
+
+def fanout_chat_completion(endpoints, params, first_n=0, coalesce=True):
+    """
+    同时向所有端点发送同一个请求，返回与 endpoints 顺序对应的结果列表，每项为
+    {"endpoint", "status", "rank", "latency", "reasoning", "answer", "usage", "error"}，
+    status 为 ok / error / cancelled，rank 为成功返回的先后顺序。
+    first_n > 0 时前 first_n 个成功的结果到齐后立即返回，其余请求被取消（流式请求断开连接，服务端停止生成）。
+    """
+    expires = current_deadline()
+    cancel = threading.Event()
+    start = time.monotonic()
+    results = [{"endpoint": endpoint_name(endpoint), "status": "cancelled"} for endpoint in endpoints]
+    futures = {}
+    for index, endpoint in enumerate(endpoints):
+        try:
+            credentials = endpoint_credentials(endpoint)
+        except ValueError as e:
+            results[index].update(status="error", error=str(e))
+            continue
+        allowed, probe = get_endpoint_stats(endpoint).admit()
+        if not allowed:
+            results[index].update(status="error", error="circuit open")
+            continue
+        futures[_executor.submit(_cancellable_call, endpoint, params, coalesce, expires, None, cancel,
+                                 probe, credentials)] = index
+
+    finished = 0
+    pending = set(futures)
+    try:
+        while pending and not (first_n and finished >= first_n):
+            done, pending = wait(pending, timeout=POLL_INTERVAL, return_when=FIRST_COMPLETED)
+            check_interrupt()
+            for future in done:
+                result = results[futures[future]]
+                result["latency"] = round(time.monotonic() - start, 3)
+                try:
+                    reasoning, answer, usage = future.result()
+                except RequestCancelled:
+                    if not cancel.is_set():
+                        raise
+                except Exception as e:
+                    result.update(status="error", error=str(e))
+                else:
+                    finished += 1
+                    trace = json.loads(usage)
+                    result.update(status="ok", rank=finished, reasoning=reasoning or "", answer=answer,
+                                  first_token=trace["timings"].get("first_token"), usage=trace["usage"])
+    finally:
+        # 已经凑够 first_n 个结果，或者节点被中断
+        cancel.set()
+    return results
+
+
+class DeepseekRouterNode(AsyncExecuteMixin):
+    @classmethod
+    def INPUT_TYPES(s):
+        return {
+            "required": {
+                "prompt": ("STRING", {"multiline": True}),
+                "model": (list(load_routes().keys()), {
+                    "tooltip": "逻辑模型（按路由表依次尝试各服务商）"
+                }),
+                "system_prompt": ("STRING", {
+                    "multiline": True,
+                    "default": "You are a helpful assistant"
+                }),
+            },
+            "optional": {
+                "temperature": ("FLOAT", {
+                    "default": 0.7,
+                    "min": 0.0,
+                    "max": 2.0,
+                    "step": 0.1,
+                    "tooltip": "创造性（越大越有创意，越小越严谨）"
+                }),
+                "max_tokens": ("INT", {
+                    "default": 2048,
+                    "min": 1,
+                    "max": 8192,
+                    "step": 1,
+                    "tooltip": "最大输出长度"
+                }),
+                "top_p": ("FLOAT", {
+                    "default": 1.0,
+                    "min": 0.0,
+                    "max": 1.0,
+                    "step": 0.1,
+                    "tooltip": "采样范围（影响回答的多样性）"
+                }),
+                "hedge": ("BOOLEAN", {
+                    "default": True,
+                    "tooltip": "主端点较慢时向备用端点发送对冲请求，采用先返回的结果"
+                }),
+                "hedge_delay": ("FLOAT", {
+                    "default": 0.0,
+                    "min": 0.0,
+                    "max": 600.0,
+                    "step": 0.5,
+                    "tooltip": "对冲请求的等待时间（秒），0表示使用主端点的p95延迟"
+                }),
+                "seed": ("INT", {
+                    "default": 0,
+                    "min": 0,
+                    "max": 0xffffffffffffffff,
+                    "tooltip": "缓存种子（非0时即使temperature大于0也会复用缓存结果）"
+                }),
+                "use_cache": ("BOOLEAN", {
+                    "default": True,
+                    "tooltip": "相同请求直接返回缓存结果"
+                }),
+                "coalesce": ("BOOLEAN", {
+                    "default": True,
+                    "tooltip": "同时发出的相同请求只调用一次API并共享结果（需要多个不同的采样结果时关闭）"
+                }),
+                "deadline": ("FLOAT", {
+                    "default": 0.0,
+                    "min": 0.0,
+                    "max": 3600.0,
+                    "step": 1.0,
+                    "tooltip": "整次调用的时间预算（秒），包括排队和重试；0表示不限制（仍按max_tokens和实测速度自动设置超时）"
+                }),
+            }
+        }
+
+    RETURN_TYPES = ("STRING", "STRING", "STRING", "STRING",)
+    RETURN_NAMES = ("reasoning", "answer", "endpoint", "usage",)
+    FUNCTION = EXECUTE_FUNCTION
+    CATEGORY = "💎DeepAide"
+
+    @classmethod
+    def IS_CHANGED(s, temperature=0.7, seed=0, use_cache=True, **kwargs):
+        return cache_is_changed(temperature, seed, use_cache)
+
+    def execute(self, prompt, model, system_prompt="You are a helpful assistant",
+                temperature=0.7, max_tokens=2048, top_p=1.0, hedge=True, hedge_delay=0.0,
+                seed=0, use_cache=True, coalesce=True, deadline=0.0):
+        params = {
+            "model": model,
+            "messages": [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": prompt},
+            ],
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "top_p": top_p,
+            "stream": False
+        }
+
+        # 缓存按逻辑模型区分，任一端点的结果都可复用
+        cache = get_response_cache()
+        cache_key = None
+        if use_cache and is_deterministic(temperature, seed):
+            cache_key = make_cache_key("router", params, seed)
+            cached = cache.get(cache_key)
+            if cached is not None:
+                reasoning, answer, endpoint = cached
+                return (reasoning, answer, endpoint, json.dumps({"cached": True}),)
+
+        try:
+            with deadline_scope(deadline):
+                reasoning, answer, endpoint, usage = route_chat_completion(model, params, hedge, hedge_delay,
+                                                                           coalesce)
+            if cache_key:
+                cache.set(cache_key, (reasoning or "", answer, endpoint))
+            return (reasoning or "", answer, endpoint, usage,)
+        except RequestCancelled:
+            raise
+        except Exception as e:
+            return (f"Error: {str(e)}", "Error occurred during API call", "", "{}",)
+
+
+DEFAULT_FANOUT_ENDPOINTS = """deepseek:deepseek-chat
+siliconflow:deepseek-ai/DeepSeek-V3.2-Exp
+siliconflow:moonshotai/Kimi-K2-Instruct-0905
+siliconflow:Qwen/Qwen3-VL-235B-A22B-Instruct"""
+
+
+class DeepseekFanoutNode(AsyncExecuteMixin):
+    @classmethod
+    def INPUT_TYPES(s):
+        return {
+            "required": {
+                "prompt": ("STRING", {"multiline": True}),
+                "endpoints": ("STRING", {
+                    "multiline": True,
+                    "default": DEFAULT_FANOUT_ENDPOINTS,
+                    "tooltip": "要对比的模型，每行一个 服务商:模型（deepseek 或 siliconflow）"
+                }),
+                "system_prompt": ("STRING", {
+                    "multiline": True,
+                    "default": "You are a helpful assistant"
+                }),
+            },
+            "optional": {
+                "temperature": ("FLOAT", {
+                    "default": 0.7,
+                    "min": 0.0,
+                    "max": 2.0,
+                    "step": 0.1,
+                    "tooltip": "创造性（越大越有创意，越小越严谨）"
+                }),
+                "max_tokens": ("INT", {
+                    "default": 2048,
+                    "min": 1,
+                    "max": 8192,
+                    "step": 1,
+                    "tooltip": "最大输出长度"
+                }),
+                "top_p": ("FLOAT", {
+                    "default": 1.0,
+                    "min": 0.0,
+                    "max": 1.0,
+                    "step": 0.1,
+                    "tooltip": "采样范围（影响回答的多样性）"
+                }),
+                "first_n": ("INT", {
+                    "default": 0,
+                    "min": 0,
+                    "max": 16,
+                    "step": 1,
+                    "tooltip": "最先完成的N个模型返回后立即结束，取消其余请求；0表示等待所有模型"
+                }),
+                "coalesce": ("BOOLEAN", {
+                    "default": True,
+                    "tooltip": "同时发出的相同请求只调用一次API并共享结果（需要多个不同的采样结果时关闭）"
+                }),
+                "deadline": ("FLOAT", {
+                    "default": 0.0,
+                    "min": 0.0,
+                    "max": 3600.0,
+                    "step": 1.0,
+                    "tooltip": "整次调用的时间预算（秒），包括排队和重试；0表示不限制（仍按max_tokens和实测速度自动设置超时）"
+                }),
+            }
+        }
+
+    RETURN_TYPES = ("STRING", "STRING", "STRING", "STRING",)
+    RETURN_NAMES = ("answers", "reasoning", "endpoints", "report",)
+    OUTPUT_IS_LIST = (True, True, True, False,)
+    FUNCTION = EXECUTE_FUNCTION
+    CATEGORY = "💎DeepAide"
+
+    @classmethod
+    def IS_CHANGED(s, temperature=0.7, **kwargs):
+        return cache_is_changed(temperature)
+
+    def execute(self, prompt, endpoints, system_prompt="You are a helpful assistant",
+                temperature=0.7, max_tokens=2048, top_p=1.0, first_n=0, coalesce=True, deadline=0.0):
+        params = {
+            "model": "",
+            "messages": [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": prompt},
+            ],
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "top_p": top_p,
+            # 流式请求可以在 first_n 个结果到齐后中途断开
+            "stream": True
+        }
+        start = time.monotonic()
+        try:
+            targets = parse_endpoints(endpoints)
+            if not targets:
+                raise ValueError("No endpoints configured")
+            with deadline_scope(deadline):
+                # 被取消的请求会让合并进来的其他调用一起失败，first_n 模式下不合并
+                results = fanout_chat_completion(targets, params, first_n, coalesce and not first_n)
+        except RequestCancelled:
+            raise
+        except Exception as e:
+            error = f"Error: {str(e)}"
+            return ([error], [""], [""], json.dumps({"error": str(e)}),)
+
+        # 列表输出只包含成功的结果，按完成的先后排列（第一个最快）
+        finished = sorted((r for r in results if r["status"] == "ok"), key=lambda r: r["rank"])
+        report = {"elapsed": round(time.monotonic() - start, 3), "results": results}
+        return ([r["answer"] for r in finished], [r["reasoning"] for r in finished],
+                [r["endpoint"] for r in finished], json.dumps(report, ensure_ascii=False),)
@@ -0,0 +1,216 @@
+import time
+import random
+import threading
+from contextlib import contextmanager
+from .config import load_config
+from .tokens import estimate_messages_tokens
+from .interrupt import POLL_INTERVAL, check_interrupt
+from .deadline import check_deadline, has_budget, sleep_within_deadline
+
+# 每个服务商共享的请求调度器：令牌桶限速、重试退避、AIMD 自适应并发
+
+_DEFAULT_LIMITS = {
+    "rpm": 0,               # 每分钟请求数，0 表示不限制
+    "tpm": 0,               # 每分钟 token 数，0 表示不限制
+    "max_concurrency": 8,   # 并发上限
+    "min_concurrency": 1,
+    "max_retries": 3,
+    "backoff_base": 1.0,
+    "backoff_max": 30.0,
+    "latency_target": 0,    # 单次请求延迟目标（秒），超过时收缩并发，0 表示只看 429
+}
+
+# 共享网关重试用完后返回的错误响应带上这个头，避免工作进程再重试一轮（重试次数相乘）
+NO_RETRY_HEADER = "X-DeepAide-No-Retry"
+
+
+class TokenBucket:
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, amount=1):
+        """阻塞直到桶里有足够的令牌；容量为 0 时不限速"""
+        if self.capacity <= 0:
+            return
+        amount = min(float(amount), self.capacity)
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                wait = (amount - self.tokens) / self.rate
+            sleep_within_deadline(wait)
+
+    def drain(self):
+        """收到 429 时清空令牌，避免继续冲击服务端"""
+        if self.capacity <= 0:
+            return
+        with self.lock:
+            self.tokens = 0.0
+            self.updated = time.monotonic()
+
+
+class AdaptiveLimiter:
+    """AIMD 并发控制：成功时加性增长，限流或延迟过高时乘性收缩"""
+
+    def __init__(self, max_concurrency, min_concurrency=1, latency_target=0):
+        self.max_limit = max(1, int(max_concurrency))
+        self.min_limit = max(1, min(int(min_concurrency), self.max_limit))
+        self.limit = float(self.max_limit)
+        self.latency_target = latency_target
+        self.in_flight = 0
+        self.cond = threading.Condition()
+
+    @contextmanager
+    def slot(self):
+        with self.cond:
+            while self.in_flight >= int(self.limit):
+                # 定期醒来检查 ComfyUI 的中断标志
+                self.cond.wait(POLL_INTERVAL)
+                check_interrupt()
+                check_deadline()
+            self.in_flight += 1
+        try:
+            yield
+        finally:
+            with self.cond:
+                self.in_flight -= 1
+                self.cond.notify_all()
+
+    def on_success(self, latency):
+        with self.cond:
+            if self.latency_target and latency > self.latency_target:
+                self.limit = max(self.min_limit, self.limit * 0.9)
+            else:
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            self.cond.notify_all()
+
+    def on_throttle(self):
+        with self.cond:
+            self.limit = max(self.min_limit, self.limit * 0.5)
+
+
+def _parse_retry_after(value):
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    # HTTP 日期格式很少见，用到时才导入 email.utils
+    from email.utils import parsedate_to_datetime
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def upstream_retried(exc):
+    """共享网关已经用完自己的重试次数（响应带有 NO_RETRY_HEADER），工作进程不再重试，也不换 key"""
+    headers = getattr(getattr(exc, "response", None), "headers", None)
+    return headers is not None and headers.get(NO_RETRY_HEADER) is not None
+
+
+def retry_info(exc):
+    """判断异常是否可重试，返回 (retryable, status_code, retry_after)"""
+    response = getattr(exc, "response", None)
+    status = getattr(exc, "status_code", None) or getattr(response, "status_code", None)
+    if status is not None:
+        retry_after = None
+        headers = getattr(response, "headers", None)
+        if headers is not None:
+            retry_after = _parse_retry_after(headers.get("retry-after"))
+        retryable = (status in (408, 409, 429) or status >= 500) and not upstream_retried(exc)
+        return retryable, status, retry_after
+    # 连接失败、超时等网络错误
+    names = {cls.__name__ for cls in type(exc).__mro__}
+    if names & {"TransportError", "APIConnectionError", "APITimeoutError"}:
+        return True, None, None
+    return False, None, None
+
+
+def estimate_request_tokens(payload):
+    """估算一次请求消耗的 token（输入 + max_tokens），用于 tpm 限速"""
+    return estimate_messages_tokens(payload.get("messages", [])) + int(payload.get("max_tokens") or 0)
+
+
+class ProviderScheduler:
+    def __init__(self, name, limits):
+        self.name = name
+        self.limits = limits
+        self.request_bucket = TokenBucket(limits["rpm"])
+        self.token_bucket = TokenBucket(limits["tpm"])
+        self.limiter = AdaptiveLimiter(limits["max_concurrency"], limits["min_concurrency"],
+                                       limits["latency_target"])
+
+    def backoff(self, attempt):
+        """带抖动的指数退避（full jitter）"""
+        ceiling = min(self.limits["backoff_max"], self.limits["backoff_base"] * (2 ** attempt))
+        return random.uniform(0, ceiling)
+
+    def run(self, fn, estimated_tokens=0, max_retries=None):
+        """在限速和并发控制下执行 fn()，遇到 429/5xx/网络错误时重试"""
+        if max_retries is None:
+            max_retries = self.limits["max_retries"]
+        attempt = 0
+        while True:
+            self.request_bucket.acquire(1)
+            self.token_bucket.acquire(estimated_tokens)
+            with self.limiter.slot():
+                check_interrupt()
+                check_deadline()
+                start = time.monotonic()
+                try:
+                    result = fn()
+                except Exception as e:
+                    retryable, status, retry_after = retry_info(e)
+                    if status == 429:
+                        self.limiter.on_throttle()
+                        self.request_bucket.drain()
+                    delay = retry_after if retry_after is not None else self.backoff(attempt)
+                    # 剩余的 deadline 不够再试一次时直接报错
+                    if not retryable or attempt >= max_retries or not has_budget(delay):
+                        raise
+                else:
+                    self.limiter.on_success(time.monotonic() - start)
+                    return result
+            print(f"[{self.name}] request failed ({status or 'network error'}), "
+                  f"retrying in {delay:.1f}s ({attempt + 1}/{max_retries})")
+            sleep_within_deadline(delay)
+            attempt += 1
+
+
+_schedulers = {}
+_lock = threading.Lock()
+
+
+def _load_limits(provider, overrides=None):
+    config = load_config()
+    limits = dict(_DEFAULT_LIMITS)
+    limits.update((config.get('rate_limits') or {}).get(provider, {}))
+    limits.update(overrides or {})
+    return limits
+
+
+def get_scheduler(provider, api_key=None, overrides=None):
+    """
+    获取服务商对应的共享调度器。配置了多个 key 时每个 key 各有一个调度器（api_key 非空），
+    rate_limits 是单个账号的限额，overrides 为该 key 单独配置的限额。
+    """
+    key = (provider, api_key)
+    scheduler = _schedulers.get(key)
+    if scheduler is not None:
+        return scheduler
+    with _lock:
+        scheduler = _schedulers.get(key)
+        if scheduler is None:
+            scheduler = ProviderScheduler(provider, _load_limits(provider, overrides))
+            _schedulers[key] = scheduler
+        return scheduler
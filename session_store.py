@@ -0,0 +1,150 @@
+import os
+import re
+import json
+import hashlib
+import threading
+from contextlib import contextmanager
+from collections import OrderedDict
+from .config import load_config
+
+# 多轮对话的会话存储：每个会话一个追加写的 JSONL 日志，内存中保留最近使用的会话
+_DEFAULT_SESSION_DIR = os.path.join(os.path.dirname(__file__), "sessions")
+
+
+def _encode(message):
+    return json.dumps(message, ensure_ascii=False, separators=(",", ":"))
+
+
+class Session:
+    """
+    一个会话的消息列表。messages 保存解码后的消息，encoded 保存对应的 JSON 行；
+    每轮对话只追加新消息的记录，不重写整个日志。path 为 None 时只保存在内存中。
+    """
+
+    def __init__(self, session_id=None, path=None):
+        self.session_id = session_id
+        self.path = path
+        self.lock = threading.RLock()
+        self.refs = 0
+        self.messages = []
+        self.encoded = []
+        if path and os.path.exists(path):
+            self._load()
+
+    def _load(self):
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.rstrip("\n")
+                if not line:
+                    continue
+                try:
+                    message = json.loads(line)
+                except json.JSONDecodeError:
+                    # 进程崩溃时可能留下写了一半的最后一行
+                    print(f"Skipping corrupt record in session log {self.path}")
+                    continue
+                self.messages.append(message)
+                self.encoded.append(line)
+
+    def append(self, *messages):
+        """追加消息，磁盘上每条消息只写一行"""
+        lines = [_encode(m) for m in messages]
+        if self.path:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write("".join(line + "\n" for line in lines))
+        self.messages.extend(messages)
+        self.encoded.extend(lines)
+
+    def replace(self, messages):
+        """整体替换消息（清空历史或压缩历史时使用），原子地重写日志"""
+        lines = [_encode(m) for m in messages]
+        if self.path:
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write("".join(line + "\n" for line in lines))
+            os.replace(tmp_path, self.path)
+        self.messages = list(messages)
+        self.encoded = lines
+
+    def commit(self, prefix, *messages):
+        """
+        写入一轮对话：prefix 为本轮实际发送的历史（可能经过压缩）。
+        prefix 与已保存的历史一致时只追加新消息，否则重写日志。
+        """
+        if prefix == self.messages:
+            self.append(*messages)
+        else:
+            self.replace(list(prefix) + list(messages))
+
+    def clear(self):
+        self.replace([])
+
+
+class SessionStore:
+    def __init__(self, directory, max_hot_sessions=64):
+        self.directory = directory
+        self.max_hot_sessions = max_hot_sessions
+        self.lock = threading.Lock()
+        self.sessions = OrderedDict()
+
+    def _path(self, session_id):
+        safe = re.sub(r"[^A-Za-z0-9_.-]", "_", session_id)[:64]
+        digest = hashlib.sha1(session_id.encode("utf-8")).hexdigest()[:10]
+        return os.path.join(self.directory, f"{safe}-{digest}.jsonl")
+
+    @contextmanager
+    def open(self, session_id):
+        """获取会话并持有它的锁，同一会话的并发请求会依次执行"""
+        with self.lock:
+            session = self.sessions.get(session_id)
+            if session is None:
+                os.makedirs(self.directory, exist_ok=True)
+                session = Session(session_id, self._path(session_id))
+                self.sessions[session_id] = session
+            self.sessions.move_to_end(session_id)
+            session.refs += 1
+            self._evict()
+        try:
+            with session.lock:
+                yield session
+        finally:
+            with self.lock:
+                session.refs -= 1
+
+    def _evict(self):
+        # 只淘汰没有被使用的会话，避免同一会话在内存中出现两份
+        for session_id in list(self.sessions):
+            if len(self.sessions) <= self.max_hot_sessions:
+                break
+            if self.sessions[session_id].refs == 0:
+                del self.sessions[session_id]
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_session_store():
+    """获取进程级共享的会话存储"""
+    global _store
+    if _store is not None:
+        return _store
+    with _store_lock:
+        if _store is None:
+            config = load_config()
+            _store = SessionStore(
+                config.get('session_dir') or _DEFAULT_SESSION_DIR,
+                int(config.get('session_cache_size', 64)),
+            )
+        return _store
+
+
+@contextmanager
+def open_session(session_id, local_session):
+    """有 session_id 时使用共享的持久化会话，否则使用节点自己的内存会话"""
+    if session_id:
+        with get_session_store().open(session_id) as session:
+            yield session
+    else:
+        with local_session.lock:
+            yield local_session
@@ -1,30 +1,133 @@
 import os
+import re
 import json
-import requests
+import time
+from .config import get_credentials
+from .transport import get_http_client
+from .cache import (get_response_cache, make_cache_key, is_deterministic, cache_is_changed,
+                    pack_choices, unpack_choices)
+from .batch import parse_prompts, run_batch, unwrap_list_inputs, parallel_choices
+from .streaming import stream_chat_completion, StreamPreview
+from .scheduler import estimate_request_tokens
+from .keypool import run_with_keys
+from .history import fit_history, build_summary_messages
+from .prompt_layout import LAYOUTS, PREFIX_CACHE_LOW_WATER, build_prefix
+from .session_store import Session, open_session
+from .aio import AsyncExecuteMixin, EXECUTE_FUNCTION
+from .telemetry import CallTrace, current_trace
+from .coalesce import get_single_flight, make_flight_key
+from .interrupt import RequestCancelled, abort_on_interrupt
+from .deadline import deadline_scope, http_timeout, observe_speed
+from .similarity import lookup_similar, remember_similar
+from .reasoning_guard import guarded_completion, apply_thinking_budget
+from .vision import FORMATS, supports_images, encode_images, image_content
+from .json_mode import (JSON_FORMAT, JSONStreamParser, parser_scope, load_schema, json_system_prompt,
+                        complete_json, item_text)
 
-class SiliconDeepseekChat:
+# SiliconFlow 对话节点可选的模型，第一个为默认模型
+CHAT_MODELS = ["deepseek-ai/DeepSeek-V3.2-Exp", "moonshotai/Kimi-K2-Instruct-0905", "Qwen/Qwen3-VL-235B-A22B-Instruct"]
+
+# 拒绝 n 参数或只返回一个候选的模型，之后的多候选请求直接并行发送
+_NO_N_MODELS = set()
+
+def _rejects_n(error):
+    """上游以 400/422 拒绝请求，且错误信息提到了 n 参数"""
+    response = getattr(error, "response", None)
+    if response is None or response.status_code not in (400, 422):
+        return False
+    try:
+        text = response.text
+    except Exception:
+        return False
+    return re.search(r"\bn\b", text) is not None
+
+def chat_completion(base_url, api_key, payload, unique_id=None, max_retries=None, coalesce=True):
+    """
+    经过共享调度器（限速、重试）发送请求，返回第一个候选的 (reasoning, answer)。
+    coalesce 为 True 时，与在途的相同请求合并，共用一次上游调用。
+    """
+    reasoning, answer, _ = chat_completion_choices(base_url, api_key, payload, unique_id, max_retries, coalesce)[0]
+    return reasoning, answer
+
+def chat_completion_choices(base_url, api_key, payload, unique_id=None, max_retries=None, coalesce=True):
+    """同 chat_completion，返回所有候选的 [(reasoning, answer, finish_reason), ...]"""
+    preview = StreamPreview.create(unique_id) if payload.get("stream") else None
+
+    def _send(preview):
+        return run_with_keys(
+            "siliconflow", api_key,
+            lambda key: _send_chat_completion(base_url, key, payload, preview),
+            estimate_request_tokens(payload),
+            max_retries
+        )
+
+    if not coalesce:
+        return _send(preview)
+    result, shared = get_single_flight().run(make_flight_key(base_url, api_key, payload), _send, preview)
+    trace = current_trace()
+    if shared and trace is not None:
+        trace.coalesced = True
+    return result
+
+def _send_chat_completion(base_url, api_key, payload, preview=None):
+    """发送 chat/completions 请求，返回 [(reasoning, answer, finish_reason), ...]；reasoning 可能为 None"""
+    url = f"{base_url}/chat/completions"
+    headers = {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json"
+    }
+    client = get_http_client(base_url, api_key)
+    # 超时按 max_tokens 和模型的实测速度计算，不超过剩余的 deadline
+    timeout, idle = http_timeout(payload["model"], payload.get("max_tokens"), payload.get("stream"))
+    
+    if payload.get("stream"):
+        # 流式请求逐块解析 SSE，增量文本推送到前端
+        # SiliconFlow 在流式响应的数据块中直接附带 usage
+        result = stream_chat_completion(client, url, headers, payload, preview, timeout, idle)
+        observe_speed(payload["model"], result.usage, result.elapsed, result.ttft)
+        trace = current_trace()
+        if trace is not None:
+            trace.record_response(result.usage, result.ttft)
+        return result.choices
+    
+    start = time.perf_counter()
+    # 等待完整回答期间被中断时断开连接（服务端随之停止生成）
+    with abort_on_interrupt():
+        response = client.post(url, json=payload, headers=headers, timeout=timeout)
+    response.raise_for_status()  # 检查HTTP错误
+    
+    result = response.json()
+    observe_speed(payload["model"], result.get("usage"), time.perf_counter() - start)
+    trace = current_trace()
+    if trace is not None:
+        trace.record_response(result.get("usage"))
+    return [(choice["message"].get("reasoning_content"), choice["message"]["content"], choice.get("finish_reason"))
+            for choice in result["choices"]]
+
+def user_content(model, prompt, image=None, image_format="jpeg", image_max_side=1024, image_quality=85):
+    """本轮的用户消息；接入图片时图片和文字一起作为多模态内容发送"""
+    if image is None:
+        return {"role": "user", "content": prompt}
+    if not supports_images(model):
+        raise ValueError(f"模型 {model} 不支持图片输入")
+    urls = encode_images(image, image_format, image_max_side, image_quality)
+    return {"role": "user", "content": image_content(prompt, urls)}
+
+
+class SiliconDeepseekChat(AsyncExecuteMixin):
     def __init__(self):
-        self.config_path = os.path.join(os.path.dirname(__file__), "config.json")
         self.load_config()
     
     def load_config(self):
         """从配置文件加载API密钥"""
-        try:
-            with open(self.config_path, 'r') as f:
-                config = json.load(f)
-                self.api_key = config.get('silicon_api_key')
-                self.base_url = config.get('silicon_base_url', 'https://api.siliconflow.cn/v1')
-        except Exception as e:
-            print(f"Error loading config: {e}")
-            self.api_key = None
-            self.base_url = "https://api.siliconflow.cn/v1"
+        self.base_url, self.api_key = get_credentials("siliconflow")
 
     @classmethod
     def INPUT_TYPES(s):
         return {
             "required": {
                 "prompt": ("STRING", {"multiline": True}),
-                "model": (["deepseek-ai/DeepSeek-V3.2-Exp", "moonshotai/Kimi-K2-Instruct-0905", "Qwen/Qwen3-VL-235B-A22B-Instruct"], {"default": "deepseek-ai/DeepSeek-V3.2-Exp"}),
+                "model": (CHAT_MODELS, {"default": CHAT_MODELS[0]}),
                 "system_prompt": ("STRING", {
                     "multiline": True,
                     "default": "You are a helpful assistant"
@@ -71,13 +174,109 @@ class SiliconDeepseekChat:
                     "multiline": False,
                     "tooltip": "停止标记（AI看到这个词就停止回答）"
                 }),
+                "few_shot": ("STRING", {
+                    "multiline": True,
+                    "default": "",
+                    "tooltip": "示例对话（JSON数组，如 [{\"user\": \"...\", \"assistant\": \"...\"}]），放在系统提示词之后"
+                }),
+                "json_mode": ("BOOLEAN", {
+                    "default": False,
+                    "tooltip": "JSON模式（response_format 为 json_object，回答解析、校验后输出规范化的 JSON，数组元素从 items 输出）"
+                }),
+                "json_schema": ("STRING", {
+                    "multiline": True,
+                    "default": "",
+                    "tooltip": "JSON模式下回答需要符合的 JSON Schema（可选），不符合时只重新生成出错的部分"
+                }),
+                "items_key": ("STRING", {
+                    "default": "",
+                    "multiline": False,
+                    "tooltip": "从哪个数组字段输出 items（留空时为根数组或第一个数组字段）"
+                }),
+                "json_retries": ("INT", {
+                    "default": 1,
+                    "min": 0,
+                    "max": 3,
+                    "step": 1,
+                    "tooltip": "JSON 无法修复或不符合 schema 时最多重新请求的次数"
+                }),
+                "image": ("IMAGE", {
+                    "tooltip": "输入图片（仅 Qwen3-VL 模型，批次中的每一帧作为一张图片）"
+                }),
+                "image_format": (FORMATS, {
+                    "default": "jpeg",
+                    "tooltip": "上传图片的编码格式（webp 体积更小，编码更慢）"
+                }),
+                "image_max_side": ("INT", {
+                    "default": 1024,
+                    "min": 64,
+                    "max": 4096,
+                    "step": 64,
+                    "tooltip": "图片长边的最大像素，超出时等比缩小"
+                }),
+                "image_quality": ("INT", {
+                    "default": 85,
+                    "min": 1,
+                    "max": 100,
+                    "step": 1,
+                    "tooltip": "图片编码质量"
+                }),
+                "num_candidates": ("INT", {
+                    "default": 1,
+                    "min": 1,
+                    "max": 8,
+                    "step": 1,
+                    "tooltip": "候选回答数量（通过 n 参数在一次请求中生成，模型不支持 n 时并行请求）"
+                }),
+                "seed": ("INT", {
+                    "default": 0,
+                    "min": 0,
+                    "max": 0xffffffffffffffff,
+                    "tooltip": "缓存种子（非0时即使temperature大于0也会复用缓存结果）"
+                }),
+                "use_cache": ("BOOLEAN", {
+                    "default": True,
+                    "tooltip": "相同请求直接返回缓存结果"
+                }),
+                "similarity": ("FLOAT", {
+                    "default": 0.0,
+                    "min": 0.0,
+                    "max": 1.0,
+                    "step": 0.01,
+                    "tooltip": "近似缓存的相似度阈值（0表示关闭，建议0.85）：只差空白、标点或个别词语的提示词直接复用缓存的回答，"
+                               "开启后temperature大于0时也会复用"
+                }),
+                "coalesce": ("BOOLEAN", {
+                    "default": True,
+                    "tooltip": "同时发出的相同请求只调用一次API并共享结果（需要多个不同的采样结果时关闭）"
+                }),
+                "deadline": ("FLOAT", {
+                    "default": 0.0,
+                    "min": 0.0,
+                    "max": 3600.0,
+                    "step": 1.0,
+                    "tooltip": "整次调用的时间预算（秒），包括排队和重试；0表示不限制（仍按max_tokens和实测速度自动设置超时）"
+                }),
+                "stream": ("BOOLEAN", {
+                    "default": False,
+                    "tooltip": "流式输出（实时显示生成内容）"
+                }),
+            },
+            "hidden": {
+                "unique_id": "UNIQUE_ID"
             }
         }
     
-    RETURN_TYPES = ("STRING",)
-    FUNCTION = "execute"
+    RETURN_TYPES = ("STRING", "STRING", "STRING", "STRING", "STRING",)
+    RETURN_NAMES = ("answer", "usage", "candidates", "finish_reasons", "items",)
+    OUTPUT_IS_LIST = (False, False, True, True, True,)
+    FUNCTION = EXECUTE_FUNCTION
     CATEGORY = "💎DeepAide"
 
+    @classmethod
+    def IS_CHANGED(s, temperature=0.7, seed=0, use_cache=True, **kwargs):
+        return cache_is_changed(temperature, seed, use_cache)
+
     @classmethod
     def get_icon(cls):
         dir_path = os.path.dirname(os.path.realpath(__file__))
@@ -87,70 +286,234 @@ class SiliconDeepseekChat:
                 return f.read()
         return None
 
+    def build_payload(self, prompt, model, system_prompt="You are a helpful assistant", 
+                      temperature=0.7, max_tokens=512, top_p=0.7,
+                      top_k=50, frequency_penalty=0.5, stop_sequence="", stream=False, few_shot="",
+                      num_candidates=1, image=None, image_format="jpeg", image_max_side=1024, image_quality=85,
+                      json_mode=False, json_schema=None):
+        """构建请求参数，json_schema 为已解析的 schema"""
+        if json_mode:
+            system_prompt = json_system_prompt(system_prompt, json_schema)
+        payload = {
+            "model": model,
+            "messages": build_prefix(system_prompt, few_shot) + [
+                user_content(model, prompt, image, image_format, image_max_side, image_quality)],
+            "stream": stream,
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+            "top_p": top_p,
+            "top_k": top_k,
+            "frequency_penalty": frequency_penalty,
+            "n": num_candidates,
+            "response_format": JSON_FORMAT if json_mode else {"type": "text"}
+        }
+        
+        # 如果提供了stop_sequence，添加到参数中
+        if stop_sequence:
+            payload["stop"] = [stop_sequence]
+        return payload
+
+    def generate_choices(self, payload, seed=0, use_cache=True, unique_id=None, coalesce=True, similarity=0.0):
+        """发送请求并返回 (answers, finish_reasons)，失败时抛出异常"""
+        # 确定性请求先查缓存（payload 中包含 n，候选数量不同的请求分开缓存），再查近似缓存
+        cache = get_response_cache()
+        cache_key = None
+        trace = current_trace()
+        if use_cache and is_deterministic(payload["temperature"], seed):
+            cache_key = make_cache_key(self.base_url, payload, seed)
+            cached = cache.get(cache_key)
+            if cached is not None:
+                if trace is not None:
+                    trace.cached = True
+                return unpack_choices(cached)
+        if use_cache and similarity > 0:
+            similar = lookup_similar(self.base_url, payload, seed, similarity)
+            if similar is not None:
+                if trace is not None:
+                    trace.cached = True
+                    trace.extra["similarity"] = round(similar[1], 3)
+                return unpack_choices(similar[0])
+        
+        choices = self._request_choices(payload, unique_id, coalesce)
+        answers = [answer for _, answer, _ in choices]
+        finish_reasons = [finish_reason or "" for _, _, finish_reason in choices]
+        if cache_key:
+            cache.set(cache_key, pack_choices(answers, finish_reasons))
+        if use_cache and similarity > 0:
+            remember_similar(self.base_url, payload, seed, pack_choices(answers, finish_reasons))
+        return answers, finish_reasons
+
+    def _request_choices(self, payload, unique_id=None, coalesce=True):
+        """
+        通过 n 参数一次生成多个候选；模型拒绝 n 或返回的候选不足时，
+        与 DeepSeek 节点一样并行发送 n=1 的请求补齐
+        """
+        count = payload.get("n") or 1
+        choices = []
+        if count == 1 or payload["model"] not in _NO_N_MODELS:
+            try:
+                choices = chat_completion_choices(self.base_url, self.api_key, payload, unique_id, coalesce=coalesce)
+            except Exception as e:
+                if count == 1 or not _rejects_n(e):
+                    raise
+                print(f"警告: {payload['model']} 不支持 n 参数，改为并行发送 {count} 个请求")
+                _NO_N_MODELS.add(payload["model"])
+            if len(choices) >= count:
+                return choices
+            if choices:
+                print(f"警告: {payload['model']} 只返回了 {len(choices)}/{count} 个候选，并行请求补齐")
+                _NO_N_MODELS.add(payload["model"])
+        trace = current_trace()
+        if trace is not None:
+            trace.extra["n_fallback"] = True
+        single = dict(payload, n=1)
+        # 补齐的请求相同，不能合并；已有候选时不再预览
+        preview_id = None if choices else unique_id
+        return choices + parallel_choices(
+            lambda index: chat_completion_choices(self.base_url, self.api_key, single,
+                                                  preview_id if index == 0 else None, coalesce=False)[0],
+            count - len(choices), "siliconflow", payload["model"])
+
+    def generate(self, payload, seed=0, use_cache=True, unique_id=None, coalesce=True, similarity=0.0):
+        """发送请求并返回回答，失败时抛出异常"""
+        answers, _ = self.generate_choices(payload, seed, use_cache, unique_id, coalesce, similarity)
+        return answers[0]
+
+    def complete_json(self, payload, answer, seed=0, use_cache=True, coalesce=True, json_schema=None,
+                      items_key="", json_retries=1, parser=None):
+        """JSON 模式：解析、修复并校验回答，返回 (规范化的 JSON, items)"""
+        value, items = complete_json(lambda p: self.generate(p, seed, use_cache, coalesce=coalesce),
+                                     payload, answer, json_schema, items_key, json_retries, parser)
+        return json.dumps(value, ensure_ascii=False), [item_text(item) for item in items]
+
     def execute(self, prompt, model, system_prompt="You are a helpful assistant", 
                 temperature=0.7, max_tokens=512, top_p=0.7,
-                top_k=50, frequency_penalty=0.5, stop_sequence=""):
+                top_k=50, frequency_penalty=0.5, stop_sequence="", few_shot="",
+                json_mode=False, json_schema="", items_key="", json_retries=1, image=None,
+                image_format="jpeg", image_max_side=1024, image_quality=85, num_candidates=1,
+                seed=0, use_cache=True, similarity=0.0, coalesce=True, deadline=0.0, stream=False,
+                unique_id=None):
         if not self.api_key:
-            return ("错误: 请在config.json中配置silicon_api_key",)
+            error = "错误: 请在config.json中配置silicon_api_key"
+            return (error, "{}", [error], ["error"], [error],)
             
+        # httpx 在首次执行时才导入，避免拖慢 ComfyUI 启动
+        from httpx import HTTPError
+        trace = CallTrace("siliconflow", model)
         try:
-            url = f"{self.base_url}/chat/completions"
+            with trace, deadline_scope(deadline):
+                schema = load_schema(json_schema) if json_mode else None
+                payload = self.build_payload(prompt, model, system_prompt, temperature, max_tokens,
+                                             top_p, top_k, frequency_penalty, stop_sequence, stream,
+                                             few_shot, num_candidates, image, image_format,
+                                             image_max_side, image_quality, json_mode, schema)
+                # JSON 模式下流式输出的回答边生成边解析
+                parser = JSONStreamParser() if json_mode else None
+                with parser_scope(parser):
+                    answers, finish_reasons = self.generate_choices(payload, seed, use_cache, unique_id, coalesce,
+                                                                    similarity)
+                items = []
+                if json_mode:
+                    answers[0], items = self.complete_json(payload, answers[0], seed, use_cache, coalesce,
+                                                           schema, items_key, json_retries, parser)
+            return (answers[0], trace.to_json(), answers, finish_reasons, items,)
             
-            payload = {
-                "model": model,
-                "messages": [
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": prompt}
-                ],
-                "stream": False,
-                "max_tokens": max_tokens,
-                "temperature": temperature,
-                "top_p": top_p,
-                "top_k": top_k,
-                "frequency_penalty": frequency_penalty,
-                "n": 1,
-                "response_format": {"type": "text"}
-            }
-            
-            # 如果提供了stop_sequence，添加到参数中
-            if stop_sequence:
-                payload["stop"] = [stop_sequence]
-            
-            headers = {
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json"
-            }
-            
-            response = requests.post(url, json=payload, headers=headers)
-            response.raise_for_status()  # 检查HTTP错误
-            
-            result = response.json()
-            return (result["choices"][0]["message"]["content"],)
-            
-        except requests.exceptions.RequestException as e:
-            return (f"API请求错误: {str(e)}",)
+        except RequestCancelled:
+            # 中断交给 ComfyUI 处理（部分输出已推送到预览）
+            raise
+        except HTTPError as e:
+            error = f"API请求错误: {str(e)}"
         except KeyError as e:
-            return (f"响应格式错误: {str(e)}",)
+            error = f"响应格式错误: {str(e)}"
         except Exception as e:
-            return (f"未知错误: {str(e)}",)
+            error = f"未知错误: {str(e)}"
+        return (error, trace.to_json(), [error], ["error"], [error],)
+
+class SiliconDeepseekBatchChat(SiliconDeepseekChat):
+    @classmethod
+    def INPUT_TYPES(s):
+        inputs = SiliconDeepseekChat.INPUT_TYPES()
+        inputs["required"] = {
+            "prompts": ("STRING", {
+                "multiline": True,
+                "tooltip": "批量提示词（每行一个，或JSON数组）"
+            }),
+            "model": inputs["required"]["model"],
+            "system_prompt": inputs["required"]["system_prompt"],
+            "concurrency": ("INT", {
+                "default": 4,
+                "min": 1,
+                "max": 32,
+                "step": 1,
+                "tooltip": "最大并发请求数"
+            }),
+        }
+        # 批量节点每条提示词只生成一个回答，也不接受图片；JSON 模式下输出规范化的 JSON
+        for name in ("num_candidates", "image", "image_format", "image_max_side", "image_quality", "items_key"):
+            inputs["optional"].pop(name)
+        return inputs
+    
+    INPUT_IS_LIST = True
+    RETURN_TYPES = ("STRING", "STRING", "STRING",)
+    RETURN_NAMES = ("answers", "errors", "usage",)
+    OUTPUT_IS_LIST = (True, True, True,)
 
-class SiliconDeepseekReasoner:
+    @classmethod
+    def IS_CHANGED(s, **kwargs):
+        kwargs = unwrap_list_inputs(kwargs)
+        return cache_is_changed(kwargs.get("temperature", 0.7), kwargs.get("seed", 0),
+                                kwargs.get("use_cache", True))
+
+    def execute(self, prompts, **kwargs):
+        kwargs = unwrap_list_inputs(kwargs)
+        if not self.api_key:
+            return (["错误: 请在config.json中配置silicon_api_key"], ["错误: API密钥未配置"], ["{}"],)
+        
+        items = parse_prompts(prompts[0] if len(prompts) == 1 else prompts)
+        concurrency = kwargs.pop("concurrency", 4)
+        seed = kwargs.pop("seed", 0)
+        use_cache = kwargs.pop("use_cache", True)
+        similarity = kwargs.pop("similarity", 0.0)
+        coalesce = kwargs.pop("coalesce", True)
+        deadline = kwargs.pop("deadline", 0.0)
+        json_retries = kwargs.pop("json_retries", 1)
+        json_schema = kwargs.pop("json_schema", "")
+        try:
+            schema = load_schema(json_schema) if kwargs.get("json_mode") else None
+        except ValueError as e:
+            return ([f"错误: {str(e)}"], [f"错误: {str(e)}"], ["{}"],)
+        # 批量请求不做逐条的实时预览
+        kwargs.pop("unique_id", None)
+        
+        usage = ["{}"] * len(items)
+        
+        def _generate_one(index):
+            trace = CallTrace("siliconflow", kwargs.get("model"))
+            try:
+                with trace, deadline_scope(expires=expires):
+                    payload = self.build_payload(items[index], json_schema=schema, **kwargs)
+                    answer = self.generate(payload, seed, use_cache, coalesce=coalesce, similarity=similarity)
+                    if kwargs.get("json_mode"):
+                        answer, _ = self.complete_json(payload, answer, seed, use_cache, coalesce, schema,
+                                                       json_retries=json_retries)
+                    return answer
+            finally:
+                usage[index] = trace.to_json()
+        
+        # deadline 是整批的时间预算
+        with deadline_scope(deadline) as expires:
+            answers, errors = run_batch(_generate_one, list(range(len(items))), concurrency)
+        return (answers, errors, usage,)
+
+class SiliconDeepseekReasoner(AsyncExecuteMixin):
     def __init__(self):
-        self.config_path = os.path.join(os.path.dirname(__file__), "config.json")
         self.load_config()
-        self.message_history = []
+        # 未指定 session_id 时使用节点自己的内存会话
+        self.local_session = Session()
     
     def load_config(self):
         """从配置文件加载API密钥"""
-        try:
-            with open(self.config_path, 'r') as f:
-                config = json.load(f)
-                self.api_key = config.get('silicon_api_key')
-                self.base_url = config.get('silicon_base_url', 'https://api.siliconflow.cn/v1')
-        except Exception as e:
-            print(f"Error loading config: {e}")
-            self.api_key = None
-            self.base_url = "https://api.siliconflow.cn/v1"
+        self.base_url, self.api_key = get_credentials("siliconflow")
 
     @classmethod
     def INPUT_TYPES(s):
@@ -202,15 +565,113 @@ class SiliconDeepseekReasoner:
                     "max": 2.0,
                     "step": 0.1,
                     "tooltip": "用词重复度（越大越不爱重复用词）"
+                }),
+                "session_id": ("STRING", {
+                    "default": "",
+                    "multiline": False,
+                    "tooltip": "会话ID（相同ID的节点共享并持久化对话历史，留空则只保存在当前节点）"
+                }),
+                "context_budget": ("INT", {
+                    "default": 0,
+                    "min": 0,
+                    "max": 256000,
+                    "step": 1024,
+                    "tooltip": "历史记录的token预算（0表示按模型上下文窗口自动计算）"
+                }),
+                "history_strategy": (["truncate", "summarize"], {
+                    "default": "truncate",
+                    "tooltip": "超出预算时丢弃最早的对话，或把它们压缩成摘要"
+                }),
+                "few_shot": ("STRING", {
+                    "multiline": True,
+                    "default": "",
+                    "tooltip": "示例对话（JSON数组，如 [{\"user\": \"...\", \"assistant\": \"...\"}]），放在系统提示词之后"
+                }),
+                "prompt_layout": (LAYOUTS, {
+                    "default": "standard",
+                    "tooltip": "prefix_cache：系统提示词和示例对话规范化后作为固定前缀，历史超出预算时一次多压缩一些，"
+                               "尽量命中服务商的上下文缓存"
+                }),
+                "image": ("IMAGE", {
+                    "tooltip": "输入图片（仅 Qwen3-VL 模型，批次中的每一帧作为一张图片）"
+                }),
+                "image_format": (FORMATS, {
+                    "default": "jpeg",
+                    "tooltip": "上传图片的编码格式（webp 体积更小，编码更慢）"
+                }),
+                "image_max_side": ("INT", {
+                    "default": 1024,
+                    "min": 64,
+                    "max": 4096,
+                    "step": 64,
+                    "tooltip": "图片长边的最大像素，超出时等比缩小"
+                }),
+                "image_quality": ("INT", {
+                    "default": 85,
+                    "min": 1,
+                    "max": 100,
+                    "step": 1,
+                    "tooltip": "图片编码质量"
+                }),
+                "seed": ("INT", {
+                    "default": 0,
+                    "min": 0,
+                    "max": 0xffffffffffffffff,
+                    "tooltip": "缓存种子（非0时即使temperature大于0也会复用缓存结果）"
+                }),
+                "use_cache": ("BOOLEAN", {
+                    "default": True,
+                    "tooltip": "相同请求直接返回缓存结果"
+                }),
+                "coalesce": ("BOOLEAN", {
+                    "default": True,
+                    "tooltip": "同时发出的相同请求只调用一次API并共享结果（需要多个不同的采样结果时关闭）"
+                }),
+                "deadline": ("FLOAT", {
+                    "default": 0.0,
+                    "min": 0.0,
+                    "max": 3600.0,
+                    "step": 1.0,
+                    "tooltip": "整次调用的时间预算（秒），包括排队和重试；0表示不限制（仍按max_tokens和实测速度自动设置超时）"
+                }),
+                "reasoning_budget": ("INT", {
+                    "default": 0,
+                    "min": 0,
+                    "max": 32768,
+                    "step": 256,
+                    "tooltip": "推理token预算（0表示不限制）：思考过程超出预算时结束思考，或改用非思考模型回答；设置后以流式请求"
+                }),
+                "thinking_timeout": ("FLOAT", {
+                    "default": 0.0,
+                    "min": 0.0,
+                    "max": 600.0,
+                    "step": 1.0,
+                    "tooltip": "思考阶段（从发出请求到开始输出回答）的最长耗时（秒），0表示不限制"
+                }),
+                "budget_fallback": ("BOOLEAN", {
+                    "default": True,
+                    "tooltip": "超出推理预算时改用对应的非思考模型重新回答；关闭时返回错误"
+                }),
+                "stream": ("BOOLEAN", {
+                    "default": False,
+                    "tooltip": "流式输出（实时显示生成内容）"
                 })
+            },
+            "hidden": {
+                "unique_id": "UNIQUE_ID"
             }
         }
     
-    RETURN_TYPES = ("STRING", "STRING",)
-    RETURN_NAMES = ("reasoning", "answer",)
-    FUNCTION = "execute"
+    RETURN_TYPES = ("STRING", "STRING", "STRING",)
+    RETURN_NAMES = ("reasoning", "answer", "usage",)
+    FUNCTION = EXECUTE_FUNCTION
     CATEGORY = "💎DeepAide"
 
+    @classmethod
+    def IS_CHANGED(s, **kwargs):
+        # 带历史记录的多轮对话每次都需要重新执行
+        return float("nan")
+
     @classmethod
     def get_icon(cls):
         dir_path = os.path.dirname(os.path.realpath(__file__))
@@ -220,60 +681,103 @@ class SiliconDeepseekReasoner:
                 return f.read()
         return None
 
+    def summarize(self, messages):
+        """用非思考模型把较早的对话压缩成摘要"""
+        payload = {
+            "model": "deepseek-ai/DeepSeek-V3.2-Exp",
+            "messages": build_summary_messages(messages),
+            "stream": False,
+            "max_tokens": 1024,
+            "temperature": 0.3
+        }
+        _, summary = chat_completion(self.base_url, self.api_key, payload)
+        return summary
+
     def execute(self, prompt, model, system_prompt="You are a helpful assistant that can reason step by step", 
-                clear_history=False, temperature=0.7, max_tokens=512, top_p=0.7, top_k=50, frequency_penalty=0.5):
+                clear_history=False, temperature=0.7, max_tokens=512, top_p=0.7, top_k=50, frequency_penalty=0.5,
+                context_budget=0, history_strategy="truncate", few_shot="", prompt_layout="standard",
+                image=None, image_format="jpeg", image_max_side=1024, image_quality=85,
+                session_id="", seed=0, use_cache=True, coalesce=True, deadline=0.0, reasoning_budget=0,
+                thinking_timeout=0.0, budget_fallback=True, stream=False, unique_id=None):
         if not self.api_key:
-            return ("错误: 请在config.json中配置silicon_api_key", "错误: API密钥未配置")
-        
-        if clear_history:
-            self.message_history = []
+            return ("错误: 请在config.json中配置silicon_api_key", "错误: API密钥未配置", "{}",)
             
+        # httpx 在首次执行时才导入，避免拖慢 ComfyUI 启动
+        from httpx import HTTPError
+        trace = CallTrace("siliconflow", model)
         try:
-            url = f"{self.base_url}/chat/completions"
-            
-            payload = {
-                "model": model,
-                "messages": [
-                    {"role": "system", "content": system_prompt}
-                ] + self.message_history + [
-                    {"role": "user", "content": prompt}
-                ],
-                "stream": False,
-                "max_tokens": max_tokens,
-                "temperature": temperature,
-                "top_p": top_p,
-                "top_k": top_k,
-                "frequency_penalty": frequency_penalty,
-                "n": 1,
-                "response_format": {"type": "text"}
-            }
-            
-            headers = {
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json"
-            }
-            
-            response = requests.post(url, json=payload, headers=headers)
-            response.raise_for_status()
-            
-            result = response.json()
-            
-            # 解析响应
-            answer = result["choices"][0]["message"]["content"]
-            reasoning = result["choices"][0]["message"].get("reasoning_content", "未提供推理过程")
-            
-            # 将助手的回答添加到历史记录（不包含system_prompt）
-            self.message_history.append({"role": "user", "content": prompt})
-            self.message_history.append({
-                "role": "assistant",
-                "content": answer
-            })
+            with trace, deadline_scope(deadline), open_session(session_id.strip(), self.local_session) as session:
+                if clear_history:
+                    session.clear()
+                
+                # 历史超出预算时压缩，并把 max_tokens 限制在剩余上下文之内；
+                # prefix_cache 布局下一次多压缩一些，让之后几轮的前缀保持不变
+                system_messages = build_prefix(system_prompt, few_shot, prompt_layout)
+                user_message = {"role": "user", "content": prompt}
+                # 图片只随本轮请求发送，会话历史中只保存文字，避免之后每轮都重新上传
+                request_message = user_content(model, prompt, image, image_format, image_max_side, image_quality)
+                summarize = self.summarize if history_strategy == "summarize" else None
+                low_water = PREFIX_CACHE_LOW_WATER if prompt_layout == "prefix_cache" else 1.0
+                history, max_tokens = fit_history(model, system_messages,
+                                                  session.messages + [request_message],
+                                                  max_tokens, context_budget, summarize, low_water)
+                
+                payload = {
+                    "model": model,
+                    "messages": system_messages + history,
+                    "stream": stream,
+                    "max_tokens": max_tokens,
+                    "temperature": temperature,
+                    "top_p": top_p,
+                    "top_k": top_k,
+                    "frequency_penalty": frequency_penalty,
+                    "n": 1,
+                    "response_format": {"type": "text"}
+                }
+                if reasoning_budget:
+                    apply_thinking_budget(payload, reasoning_budget)
+                
+                # 缓存键包含完整的历史记录，只有整段对话相同才会命中
+                cache = get_response_cache()
+                cache_key = None
+                cached = None
+                if use_cache and is_deterministic(temperature, seed):
+                    cache_key = make_cache_key(self.base_url, payload, seed)
+                    cached = cache.get(cache_key)
+                
+                if cached is not None:
+                    trace.cached = True
+                    reasoning, answer = cached
+                else:
+                    fired = False
+                    if reasoning_budget or thinking_timeout:
+                        # 推理预算在流式输出中检查；可能被中途截断的请求不与其他调用合并
+                        reasoning, answer, fired = guarded_completion(
+                            lambda p: chat_completion(self.base_url, self.api_key, p, unique_id, coalesce=False),
+                            payload, reasoning_budget, thinking_timeout, budget_fallback)
+                    else:
+                        reasoning, answer = chat_completion(self.base_url, self.api_key, payload, unique_id,
+                                                            coalesce=coalesce)
+                    if not reasoning:
+                        reasoning = "未提供推理过程"
+                    # 改用非思考模型得到的回答不写入缓存
+                    if cache_key and not fired:
+                        cache.set(cache_key, (reasoning, answer))
+                
+                # 将本轮对话添加到会话（不包含system_prompt），请求成功后才写入
+                session.commit(history[:-1], user_message, {
+                    "role": "assistant",
+                    "content": answer
+                })
             
-            return (reasoning, answer,)
+            return (reasoning, answer, trace.to_json(),)
             
-        except requests.exceptions.RequestException as e:
-            return (f"API请求错误: {str(e)}", "请求失败")
+        except RequestCancelled:
+            # 中断交给 ComfyUI 处理（部分输出已推送到预览）
+            raise
+        except HTTPError as e:
+            return (f"API请求错误: {str(e)}", "请求失败", trace.to_json(),)
         except KeyError as e:
-            return (f"响应格式错误: {str(e)}", "格式错误")
+            return (f"响应格式错误: {str(e)}", "格式错误", trace.to_json(),)
         except Exception as e:
-            return (f"未知错误: {str(e)}", "执行失败")
+            return (f"未知错误: {str(e)}", "执行失败", trace.to_json(),)
@@ -0,0 +1,168 @@
+import re
+import time
+import random
+import threading
+import unicodedata
+from collections import OrderedDict
+from .config import load_config
+from .cache import make_cache_key
+
+# 近似缓存：提示词扩写这类请求的输入常常只差空白、标点或个别词语，精确缓存几乎命中不了。
+# 提示词归一化后切成字符 n-gram，用 MinHash + LSH 分桶快速找出候选，再按 n-gram 集合的
+# Jaccard 相似度确认，不低于阈值时直接返回缓存的回答。只在内存中，按模型、系统提示词和采样参数分开
+
+NGRAM = 3
+NUM_PERM = 64
+BANDS = 16  # 每段 NUM_PERM // BANDS 个哈希值；Jaccard 0.8 时约 99.9% 的概率至少有一段相同
+
+_MASK = (1 << 61) - 1  # 梅森素数，(a * x + b) mod p 作为随机排列
+_rng = random.Random(20240611)
+_PERMUTATIONS = [(_rng.randrange(1, _MASK), _rng.randrange(0, _MASK)) for _ in range(NUM_PERM)]
+
+_PUNCTUATION = re.compile(r"[\W_]+", re.UNICODE)
+
+
+def normalize_text(text):
+    """全角转半角、转小写，标点和连续空白统一成一个空格"""
+    text = unicodedata.normalize("NFKC", text).lower()
+    return _PUNCTUATION.sub(" ", text).strip()
+
+
+def shingles(text):
+    """归一化文本的字符 n-gram 集合（同时适用于中文和英文）"""
+    text = normalize_text(text)
+    if len(text) <= NGRAM:
+        return frozenset([text])
+    return frozenset(text[i:i + NGRAM] for i in range(len(text) - NGRAM + 1))
+
+
+def minhash(grams):
+    """MinHash 签名。索引只在内存中，直接使用进程内的字符串哈希"""
+    hashes = [hash(gram) & _MASK for gram in grams]
+    return tuple(min((a * h + b) % _MASK for h in hashes) for a, b in _PERMUTATIONS)
+
+
+def jaccard(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class _Entry:
+    __slots__ = ("scope", "grams", "bands", "value", "created")
+
+    def __init__(self, scope, grams, bands, value):
+        self.scope = scope
+        self.grams = grams
+        self.bands = bands
+        self.value = value
+        self.created = time.time()
+
+
+class SimilarityCache:
+    def __init__(self, max_entries=1024, ttl=0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # id -> _Entry，按最近使用排序
+        self.buckets = {}             # (scope, 段序号, 段内哈希值) -> {id}
+        self.next_id = 0
+
+    def _bands(self, scope, grams):
+        signature = minhash(grams)
+        rows = NUM_PERM // BANDS
+        return [(scope, band, signature[band * rows:(band + 1) * rows]) for band in range(BANDS)]
+
+    def lookup(self, scope, text, threshold):
+        """返回 (value, similarity)，没有相似度不低于 threshold 的条目时返回 None"""
+        grams = shingles(text)
+        bands = self._bands(scope, grams)
+        now = time.time()
+        with self.lock:
+            candidates = set()
+            for band in bands:
+                candidates.update(self.buckets.get(band, ()))
+            best, best_score = None, threshold
+            for entry_id in candidates:
+                entry = self.entries[entry_id]
+                if self.ttl and now - entry.created > self.ttl:
+                    self._remove(entry_id)
+                    continue
+                score = jaccard(grams, entry.grams)
+                if score >= best_score:
+                    best, best_score = entry_id, score
+            if best is None:
+                return None
+            self.entries.move_to_end(best)
+            return self.entries[best].value, best_score
+
+    def add(self, scope, text, value):
+        grams = shingles(text)
+        bands = self._bands(scope, grams)
+        with self.lock:
+            entry_id = self.next_id
+            self.next_id += 1
+            self.entries[entry_id] = _Entry(scope, grams, bands, value)
+            for band in bands:
+                self.buckets.setdefault(band, set()).add(entry_id)
+            while len(self.entries) > self.max_entries:
+                self._remove(next(iter(self.entries)))
+
+    def _remove(self, entry_id):
+        entry = self.entries.pop(entry_id)
+        for band in entry.bands:
+            bucket = self.buckets.get(band)
+            if bucket is not None:
+                bucket.discard(entry_id)
+                if not bucket:
+                    del self.buckets[band]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.buckets.clear()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_similarity_cache():
+    """获取进程级共享的近似缓存"""
+    global _cache
+    if _cache is not None:
+        return _cache
+    with _cache_lock:
+        if _cache is None:
+            config = load_config()
+            _cache = SimilarityCache(
+                max_entries=int(config.get('similar_cache_max_entries', 1024)),
+                ttl=float(config.get('similar_cache_ttl', 86400)),
+            )
+        return _cache
+
+
+def _split_prompt(base_url, params, seed):
+    """
+    拆出 (scope, 提示词)：scope 是除最后一条用户消息外整个请求的哈希，
+    只有模型、系统提示词和采样参数都相同的请求才互相匹配。多模态消息不参与。
+    """
+    messages = params.get("messages") or []
+    if not messages or messages[-1].get("role") != "user" or not isinstance(messages[-1].get("content"), str):
+        return None, None
+    scope = make_cache_key(base_url, dict(params, messages=messages[:-1]), seed)
+    return scope, messages[-1]["content"]
+
+
+def lookup_similar(base_url, params, seed, threshold):
+    """查找相似提示词的缓存结果，返回 (value, similarity) 或 None"""
+    scope, text = _split_prompt(base_url, params, seed)
+    if scope is None:
+        return None
+    return get_similarity_cache().lookup(scope, text, threshold)
+
+
+def remember_similar(base_url, params, seed, value):
+    scope, text = _split_prompt(base_url, params, seed)
+    if scope is not None:
+        get_similarity_cache().add(scope, text, value)
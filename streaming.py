@@ -0,0 +1,217 @@
+import json
+import time
+from .interrupt import RequestCancelled, interrupt_requested, abort_on_interrupt
+from .deadline import DeadlineExceeded, current_deadline
+from .telemetry import current_trace
+from .tokens import token_weight
+from .reasoning_guard import ReasoningBudgetExceeded, current_guard
+from .json_mode import current_parser
+
+# SSE 流式响应解析，分别累积 reasoning_content 和 content，并把增量文本推送到前端
+
+
+class StreamResult:
+    def __init__(self):
+        self.content = ""
+        self.reasoning = None
+        self.finish_reason = None
+        self.usage = None
+        self.ttft = None
+        self.elapsed = None
+        self.cancelled = None  # 提前停止的原因（"interrupted" / "deadline" / "reasoning_budget"），内容只是部分输出
+        # n > 1 时每个候选的 (reasoning, content, finish_reason)，按 index 排列
+        self.choices = []
+
+
+def iter_sse_events(chunks):
+    """逐块解析 SSE 字节流，依次返回每个 data 事件的 JSON 对象"""
+    pending = b""
+    for chunk in chunks:
+        if pending:
+            chunk = pending + chunk
+        start = 0
+        while True:
+            end = chunk.find(b"\n", start)
+            if end < 0:
+                break
+            line = chunk[start:end]
+            start = end + 1
+            if not line.startswith(b"data:"):
+                continue
+            data = line[5:].strip()
+            if data == b"[DONE]":
+                return
+            if data:
+                yield json.loads(data)
+        pending = chunk[start:]
+
+
+class StreamPreview:
+    """通过 ComfyUI 的 PromptServer 把增量文本推送到节点上显示"""
+
+    EVENT = "deepaide.stream"
+
+    def __init__(self, server, node_id, interval=0.1):
+        self.server = server
+        self.node_id = str(node_id)
+        self.interval = interval
+        self.last_push = 0.0
+        self.pending_reasoning = []
+        self.pending_content = []
+
+    @classmethod
+    def create(cls, node_id):
+        """不在 ComfyUI 中运行或没有节点 id 时返回 None"""
+        if node_id is None:
+            return None
+        try:
+            from server import PromptServer
+        except ImportError:
+            return None
+        if getattr(PromptServer, "instance", None) is None:
+            return None
+        return cls(PromptServer.instance, node_id)
+
+    def _send(self, **data):
+        try:
+            self.server.send_sync(self.EVENT, {"node": self.node_id, **data})
+        except Exception as e:
+            print(f"Error sending stream preview: {e}")
+
+    def start(self):
+        self._send(status="start")
+
+    def update(self, reasoning, content):
+        if reasoning:
+            self.pending_reasoning.append(reasoning)
+        if content:
+            self.pending_content.append(content)
+        now = time.perf_counter()
+        if now - self.last_push >= self.interval:
+            self.flush()
+            self.last_push = now
+
+    def flush(self):
+        if not self.pending_reasoning and not self.pending_content:
+            return
+        self._send(status="delta",
+                   reasoning="".join(self.pending_reasoning),
+                   content="".join(self.pending_content))
+        self.pending_reasoning = []
+        self.pending_content = []
+
+    def finish(self, result):
+        self.flush()
+        if result.cancelled:
+            self._send(status="cancelled", reason=result.cancelled, ttft=result.ttft, elapsed=result.elapsed)
+        else:
+            self._send(status="done", ttft=result.ttft, elapsed=result.elapsed)
+
+    def items(self, items):
+        """JSON 模式下推送刚解析出的数组元素 [(字段名, 值)]"""
+        self.flush()
+        self._send(status="items", items=[{"key": key, "value": value} for key, value in items])
+
+
+def stream_chat_completion(client, url, headers, payload, preview=None, timeout=None, idle=None):
+    """
+    以流式方式请求 chat/completions，返回 StreamResult。
+    timeout 为等待响应头的 httpx 超时，收到响应头后 read 超时换成 idle（两次数据之间的最长间隔）。
+    ComfyUI 中断（包括等待响应头和数据间隔中）或超过 deadline 时关闭连接（服务端随之停止生成），把已收到的部分输出推送到预览，
+    并抛出 RequestCancelled / DeadlineExceeded。
+    """
+    result = StreamResult()
+    # index -> [reasoning_parts, content_parts, finish_reason]
+    parts = {}
+    start = time.perf_counter()
+    expires = current_deadline()
+    # 推理预算只在第一个候选开始输出回答之前检查
+    guard = current_guard()
+    reasoning_tokens = 0.0
+    # JSON 模式下增量解析第一个候选的回答
+    parser = current_parser()
+    if parser is not None:
+        parser.reset()
+    if preview is not None:
+        preview.start()
+
+    kwargs = {} if timeout is None else {"timeout": timeout}
+    # 等待响应头和两次数据之间也要响应中断：由后台线程断开连接，这里把断开导致的读取错误当作中断处理
+    with abort_on_interrupt() as watch:
+        try:
+            with client.stream("POST", url, json=dict(payload, stream=True), headers=headers, **kwargs) as response:
+                if response.is_error:
+                    response.read()
+                    response.raise_for_status()
+                if idle is not None:
+                    # httpcore 在开始读取响应体时才取 read 超时，这里改成空闲超时
+                    response.request.extensions.get("timeout", {})["read"] = idle
+                for event in iter_sse_events(response.iter_bytes()):
+                    if event.get("usage"):
+                        result.usage = event["usage"]
+                    for choice in event.get("choices") or []:
+                        index = choice.get("index") or 0
+                        choice_parts = parts.setdefault(index, [[], [], None])
+                        delta = choice.get("delta") or {}
+                        reasoning = delta.get("reasoning_content")
+                        content = delta.get("content")
+                        if (reasoning or content) and result.ttft is None:
+                            result.ttft = time.perf_counter() - start
+                        if reasoning:
+                            choice_parts[0].append(reasoning)
+                            if guard is not None and index == 0:
+                                reasoning_tokens += token_weight(reasoning)
+                        if content:
+                            choice_parts[1].append(content)
+                            if index == 0:
+                                # 已经开始输出回答，不再限制
+                                guard = None
+                        if choice.get("finish_reason"):
+                            choice_parts[2] = choice["finish_reason"]
+                        # 只预览第一个候选
+                        if preview is not None and index == 0:
+                            preview.update(reasoning, content)
+                        if parser is not None and content and index == 0:
+                            items = parser.feed(content)
+                            if items and preview is not None:
+                                preview.items(items)
+                    if interrupt_requested():
+                        # 退出 with 时关闭响应，未读完的连接不会放回连接池
+                        result.cancelled = "interrupted"
+                        break
+                    if expires is not None and time.monotonic() >= expires:
+                        result.cancelled = "deadline"
+                        break
+                    if guard is not None and guard.check(reasoning_tokens, time.perf_counter() - start):
+                        result.cancelled = "reasoning_budget"
+                        break
+        except Exception:
+            if not watch.aborted:
+                raise
+            result.cancelled = "interrupted"
+
+    result.elapsed = time.perf_counter() - start
+    for index in sorted(parts):
+        reasoning_parts, content_parts, finish_reason = parts[index]
+        result.choices.append(("".join(reasoning_parts) if reasoning_parts else None,
+                               "".join(content_parts), finish_reason))
+    if not result.choices:
+        result.choices.append((None, "", None))
+    result.reasoning, result.content, result.finish_reason = result.choices[0]
+    if preview is not None:
+        preview.finish(result)
+    if result.cancelled == "reasoning_budget":
+        # 由调用方改用非思考模型重新回答
+        raise ReasoningBudgetExceeded(result.reasoning, result.content)
+    if result.cancelled:
+        trace = current_trace()
+        if trace is not None:
+            # 调用统计会写进 usage 输出和指标日志，只记录部分输出的长度，文本只留在异常和预览中
+            trace.extra["partial_chars"] = len(result.content)
+            trace.extra["partial_reasoning_chars"] = len(result.reasoning or "")
+            trace.extra["partial_tokens"] = round(token_weight(result.reasoning or "") + token_weight(result.content))
+        if result.cancelled == "deadline":
+            raise DeadlineExceeded(f"Deadline exceeded after {result.elapsed:.1f}s (partial output kept)",
+                                   result.reasoning, result.content)
+        raise RequestCancelled(result.reasoning, result.content)
+    return result
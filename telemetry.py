@@ -0,0 +1,315 @@
+import json
+import time
+import threading
+from collections import deque
+from .config import load_config
+
+# 单次调用的耗时分解、token 用量，以及进程级的指标汇总（Prometheus 文本 / JSONL）
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+PHASES = ("config", "connect", "server", "first_token", "decode", "total")
+
+_local = threading.local()
+
+
+def current_trace():
+    """当前线程正在进行的调用，没有时返回 None"""
+    return getattr(_local, "trace", None)
+
+
+def run_with_trace(trace, fn):
+    """在其他线程中以 trace 作为当前调用执行 fn()（不计入指标）"""
+    previous = current_trace()
+    _local.trace = trace
+    try:
+        return fn()
+    finally:
+        _local.trace = previous
+
+
+def normalize_usage(usage):
+    """把不同服务商的 usage 统一成扁平的 token 计数"""
+    if not usage:
+        return {}
+    details = usage.get("completion_tokens_details") or {}
+    prompt_details = usage.get("prompt_tokens_details") or {}
+    result = {
+        "prompt_tokens": usage.get("prompt_tokens", 0),
+        "completion_tokens": usage.get("completion_tokens", 0),
+        "reasoning_tokens": details.get("reasoning_tokens", 0),
+        "total_tokens": usage.get("total_tokens", 0),
+    }
+    # DeepSeek 返回 prompt_cache_hit_tokens，其他 OpenAI 兼容服务返回 cached_tokens
+    if "prompt_cache_hit_tokens" in usage:
+        result["prompt_cache_hit_tokens"] = usage.get("prompt_cache_hit_tokens") or 0
+        result["prompt_cache_miss_tokens"] = usage.get("prompt_cache_miss_tokens") or 0
+    elif prompt_details.get("cached_tokens") is not None:
+        result["prompt_cache_hit_tokens"] = prompt_details["cached_tokens"]
+        result["prompt_cache_miss_tokens"] = result["prompt_tokens"] - prompt_details["cached_tokens"]
+    return _with_cache_ratio(result)
+
+
+def _with_cache_ratio(usage):
+    if "prompt_cache_hit_tokens" in usage:
+        cacheable = usage["prompt_cache_hit_tokens"] + usage["prompt_cache_miss_tokens"]
+        usage["prompt_cache_hit_ratio"] = round(usage["prompt_cache_hit_tokens"] / cacheable, 4) if cacheable else 0.0
+    return usage
+
+
+class CallTrace:
+    """一次节点调用的耗时和用量，作为上下文管理器使用时绑定到当前线程"""
+
+    def __init__(self, provider, model, record=True):
+        self.provider = provider
+        self.model = model
+        self.start = time.perf_counter()
+        self.events = {}
+        self.attempts = 0
+        self.usage = {}
+        self.ttft = None
+        self.finished = None
+        self.cached = False
+        self.coalesced = False  # 与其他在途的相同请求合并，没有单独调用上游
+        self.status = "ok"
+        self.extra = {}
+        self.record = record  # 为 False 时不计入指标，由 merge 汇总到上层调用
+
+    def __enter__(self):
+        self._previous = current_trace()
+        _local.trace = self
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _local.trace = self._previous
+        if self.finished is None:
+            self.finished = time.perf_counter()
+        if exc_type is not None:
+            from .interrupt import RequestCancelled
+            self.status = "cancelled" if issubclass(exc_type, RequestCancelled) else "error"
+        if self.record:
+            get_metrics().record(self)
+        return False
+
+    def on_request(self):
+        """每次发出 HTTP 请求（包括重试）时调用，只保留最后一次尝试的事件"""
+        self.attempts += 1
+        self.events = {"send": time.perf_counter()}
+
+    def on_http_event(self, name, info):
+        for suffix in ("connect_tcp.started", "connect_tcp.complete", "start_tls.complete",
+                       "send_request_headers.started", "receive_response_headers.complete"):
+            if name.endswith(suffix):
+                self.events.setdefault(suffix, time.perf_counter())
+
+    def record_response(self, usage=None, ttft=None):
+        self.usage = normalize_usage(usage)
+        if ttft is not None:
+            self.ttft = ttft
+        self.finished = time.perf_counter()
+
+    def merge(self, traces):
+        """一次调用拆成多个并行请求时，把它们的请求次数和 token 用量累加到这次调用上"""
+        usage = {}
+        for trace in traces:
+            self.attempts += trace.attempts
+            for name, value in trace.usage.items():
+                if name.endswith("_tokens"):
+                    usage[name] = usage.get(name, 0) + (value or 0)
+        self.usage = _with_cache_ratio(usage)
+        self.finished = time.perf_counter()
+
+    def phases(self):
+        """各阶段耗时（秒）"""
+        events = self.events
+        end = self.finished or time.perf_counter()
+        send = events.get("send")
+        result = {"total": end - self.start}
+        if send is not None:
+            result["config"] = send - self.start
+        if "connect_tcp.started" in events:
+            connected = events.get("start_tls.complete") or events.get("connect_tcp.complete")
+            if connected:
+                result["connect"] = connected - events["connect_tcp.started"]
+        else:
+            result["connect"] = 0.0  # 复用了连接池中的连接
+        headers_sent = events.get("send_request_headers.started")
+        headers_received = events.get("receive_response_headers.complete")
+        if headers_sent and headers_received:
+            result["server"] = headers_received - headers_sent
+        if headers_received:
+            result["decode"] = end - headers_received
+        if self.ttft is not None:
+            result["first_token"] = self.ttft
+        return result
+
+    def to_dict(self):
+        data = {
+            "provider": self.provider,
+            "model": self.model,
+            "status": self.status,
+            "cached": self.cached,
+            "coalesced": self.coalesced,
+            "attempts": self.attempts,
+            "timings": {k: round(v, 4) for k, v in self.phases().items()},
+            "usage": self.usage,
+        }
+        data.update(self.extra)
+        return data
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), ensure_ascii=False)
+
+
+def on_http_request(request):
+    """httpx 请求钩子：把 httpcore 的 trace 回调挂到当前线程的调用上"""
+    trace = current_trace()
+    if trace is None:
+        return
+    trace.on_request()
+    request.extensions["trace"] = trace.on_http_event
+
+
+class _Histogram:
+    def __init__(self):
+        self.counts = [0] * len(LATENCY_BUCKETS)
+        self.total = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+        self.total += 1
+        self.sum += value
+
+
+def _labels(**labels):
+    return "{" + ",".join(f'{k}="{str(v)}"' for k, v in labels.items()) + "}"
+
+
+class MetricsRegistry:
+    def __init__(self, recent_size=1000, log_path=None):
+        self.lock = threading.Lock()
+        self.requests = {}
+        self.tokens = {}
+        self.coalesced = {}
+        self.histograms = {}
+        self.recent = deque(maxlen=recent_size)
+        self.log_path = log_path
+
+    def record(self, trace):
+        record = trace.to_dict()
+        record["time"] = time.time()
+        key = (trace.provider, trace.model)
+        with self.lock:
+            status_key = key + (trace.status, trace.cached)
+            self.requests[status_key] = self.requests.get(status_key, 0) + 1
+            for name, value in trace.usage.items():
+                if not name.endswith("_tokens"):
+                    continue
+                token_key = key + (name,)
+                self.tokens[token_key] = self.tokens.get(token_key, 0) + (value or 0)
+            if trace.coalesced:
+                self.coalesced[key] = self.coalesced.get(key, 0) + 1
+            elif trace.status == "ok" and not trace.cached:
+                for phase, value in trace.phases().items():
+                    histogram = self.histograms.setdefault(key + (phase,), _Histogram())
+                    histogram.observe(value)
+            self.recent.append(record)
+        if self.log_path:
+            try:
+                with open(self.log_path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            except Exception as e:
+                print(f"Error writing metrics log: {e}")
+
+    def prometheus(self):
+        """Prometheus 文本格式"""
+        lines = [
+            "# HELP deepaide_requests_total Node API calls",
+            "# TYPE deepaide_requests_total counter",
+        ]
+        with self.lock:
+            for (provider, model, status, cached), count in sorted(self.requests.items()):
+                lines.append("deepaide_requests_total" + _labels(
+                    provider=provider, model=model, status=status, cached=str(cached).lower()) + f" {count}")
+            lines += [
+                "# HELP deepaide_tokens_total Tokens reported by the provider",
+                "# TYPE deepaide_tokens_total counter",
+            ]
+            for (provider, model, kind), count in sorted(self.tokens.items()):
+                lines.append("deepaide_tokens_total" + _labels(
+                    provider=provider, model=model, type=kind) + f" {count}")
+            lines += [
+                "# HELP deepaide_prompt_cache_hit_ratio Share of prompt tokens served from the provider prefix cache",
+                "# TYPE deepaide_prompt_cache_hit_ratio gauge",
+            ]
+            for (provider, model, kind), hits in sorted(self.tokens.items()):
+                if kind != "prompt_cache_hit_tokens":
+                    continue
+                cacheable = hits + self.tokens.get((provider, model, "prompt_cache_miss_tokens"), 0)
+                if cacheable:
+                    lines.append("deepaide_prompt_cache_hit_ratio" + _labels(provider=provider, model=model)
+                                 + f" {hits / cacheable:.4f}")
+            lines += [
+                "# HELP deepaide_coalesced_total Calls served by an identical in-flight request",
+                "# TYPE deepaide_coalesced_total counter",
+            ]
+            for (provider, model), count in sorted(self.coalesced.items()):
+                lines.append("deepaide_coalesced_total" + _labels(provider=provider, model=model) + f" {count}")
+            lines += [
+                "# HELP deepaide_latency_seconds Latency per call phase",
+                "# TYPE deepaide_latency_seconds histogram",
+            ]
+            for (provider, model, phase), histogram in sorted(self.histograms.items()):
+                labels = dict(provider=provider, model=model, phase=phase)
+                for bound, count in zip(LATENCY_BUCKETS, histogram.counts):
+                    lines.append("deepaide_latency_seconds_bucket" + _labels(**labels, le=bound) + f" {count}")
+                lines.append("deepaide_latency_seconds_bucket" + _labels(**labels, le="+Inf") + f" {histogram.total}")
+                lines.append("deepaide_latency_seconds_sum" + _labels(**labels) + f" {histogram.sum:.6f}")
+                lines.append("deepaide_latency_seconds_count" + _labels(**labels) + f" {histogram.total}")
+        return "\n".join(lines) + "\n"
+
+    def jsonl(self):
+        """最近的调用记录，每行一个 JSON"""
+        with self.lock:
+            return "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in self.recent)
+
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+
+def get_metrics():
+    """获取进程级共享的指标汇总"""
+    global _metrics
+    if _metrics is not None:
+        return _metrics
+    with _metrics_lock:
+        if _metrics is None:
+            config = load_config()
+            _metrics = MetricsRegistry(log_path=config.get('metrics_log') or None)
+        return _metrics
+
+
+def register_routes():
+    """在 ComfyUI 服务上注册 /deepaide/metrics（Prometheus）和 /deepaide/metrics.jsonl"""
+    try:
+        from server import PromptServer
+        from aiohttp import web
+    except ImportError:
+        return False
+    if getattr(PromptServer, "instance", None) is None:
+        return False
+
+    routes = PromptServer.instance.routes
+
+    @routes.get("/deepaide/metrics")
+    async def prometheus_metrics(request):
+        return web.Response(text=get_metrics().prometheus(), content_type="text/plain")
+
+    @routes.get("/deepaide/metrics.jsonl")
+    async def jsonl_metrics(request):
+        return web.Response(text=get_metrics().jsonl(), content_type="application/x-ndjson")
+
+    return True
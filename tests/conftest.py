@@ -0,0 +1,8 @@
+import os
+import sys
+
+# 节点包的目录名不是合法的模块名，和基准测试一样按路径加载为 deepaide
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+from _loader import load_package  # noqa: E402
+
+load_package()
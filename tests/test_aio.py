@@ -0,0 +1,41 @@
+import sys
+import types
+import asyncio
+import threading
+import deepaide
+from deepaide.aio import AsyncExecuteMixin, async_nodes_supported
+
+
+class _Node(AsyncExecuteMixin):
+    def execute(self, prompt, suffix="!"):
+        return (prompt + suffix, threading.current_thread().name)
+
+
+def test_execute_async_runs_in_io_thread():
+    async def _main():
+        # 两个节点同时等待时，事件循环不被阻塞
+        return await asyncio.gather(_Node().execute_async(prompt="a"), _Node().execute_async(prompt="b", suffix="?"))
+
+    (first, thread), (second, _) = asyncio.run(_main())
+    assert (first, second) == ("a!", "b?")
+    assert thread.startswith("deepaide-io")
+
+
+def test_async_support_detection(monkeypatch):
+    monkeypatch.delitem(sys.modules, "execution", raising=False)
+    assert not async_nodes_supported()
+
+    async def _execute():
+        pass
+
+    monkeypatch.setitem(sys.modules, "execution", types.SimpleNamespace(execute=_execute))
+    assert async_nodes_supported()
+    monkeypatch.setitem(sys.modules, "execution", types.SimpleNamespace(execute=lambda: None))
+    assert not async_nodes_supported()
+
+
+def test_nodes_keep_sync_execute_outside_comfyui():
+    for node_class in deepaide.NODE_CLASS_MAPPINGS.values():
+        assert getattr(node_class, node_class.FUNCTION)
+        if issubclass(node_class, AsyncExecuteMixin):
+            assert node_class.FUNCTION == "execute"
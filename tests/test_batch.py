@@ -0,0 +1,62 @@
+import threading
+import pytest
+from deepaide.batch import parse_prompts, run_batch, parallel_choices, unwrap_list_inputs
+from deepaide.interrupt import RequestCancelled
+from deepaide.telemetry import CallTrace, current_trace
+
+
+def test_parse_prompts():
+    assert parse_prompts("a\n\n  b  \nc\n") == ["a", "b", "c"]
+    assert parse_prompts('["x", {"k": 1}, "y z"]') == ["x", '{"k": 1}', "y z"]
+    # 不是合法 JSON 的方括号开头按行拆分
+    assert parse_prompts("[draft] one\ntwo") == ["[draft] one", "two"]
+    assert parse_prompts(["a", " ", 3]) == ["a", "3"]
+
+
+def test_run_batch_keeps_order_and_collects_errors():
+    active = []
+    peak = []
+    lock = threading.Lock()
+
+    def _fn(item):
+        with lock:
+            active.append(item)
+            peak.append(len(active))
+        try:
+            if item == 2:
+                raise ValueError("bad item")
+            return item * 10
+        finally:
+            with lock:
+                active.remove(item)
+
+    results, errors = run_batch(_fn, [0, 1, 2, 3, 4], concurrency=2)
+    assert results == [0, 10, "", 30, 40]
+    assert errors == ["", "", "Error: bad item", "", ""]
+    assert max(peak) <= 2
+    assert run_batch(_fn, []) == ([], [])
+
+
+def test_run_batch_stops_on_interrupt():
+    def _fn(item):
+        raise RequestCancelled()
+
+    with pytest.raises(RequestCancelled):
+        run_batch(_fn, [1, 2], concurrency=2)
+
+
+def test_parallel_choices_merges_usage():
+    def _fn(index):
+        current_trace().record_response({"prompt_tokens": 10, "completion_tokens": index + 1})
+        return f"answer {index}"
+
+    trace = CallTrace("deepseek", "m")
+    with trace:
+        assert parallel_choices(_fn, 3, "deepseek", "m") == ["answer 0", "answer 1", "answer 2"]
+    usage = trace.to_dict()["usage"]
+    assert usage["prompt_tokens"] == 30 and usage["completion_tokens"] == 6
+
+
+def test_unwrap_list_inputs():
+    kwargs = {"prompts": ["a", "b"], "model": ["m"], "seed": [], "stream": False}
+    assert unwrap_list_inputs(kwargs) == {"prompts": ["a", "b"], "model": "m", "seed": None, "stream": False}
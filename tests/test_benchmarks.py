@@ -0,0 +1,26 @@
+import httpx
+import pytest
+from _loader import load_package
+from mock_server import MockOptions, start_mock_server
+from run_bench import SCENARIOS, run_scenario
+
+
+@pytest.fixture(scope="module")
+def mock_server():
+    server, base_url = start_mock_server(options=MockOptions(latency=0.0, completion_tokens=8, reasoning_tokens=8))
+    yield server, base_url
+    server.shutdown()
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_every_scenario_runs_against_the_mock_server(mock_server, stream):
+    server, base_url = mock_server
+    package = load_package()
+    for node_name in SCENARIOS:
+        server.RequestHandlerClass.stats.reset()
+        result = run_scenario(package, node_name, base_url, requests=4, concurrency=2, stream=stream)
+        assert result["errors"] == 0, node_name
+        assert result["requests"] == 4 and result["p50"] <= result["p99"]
+        # 关闭了缓存和请求合并，预热和正式请求都到达了模拟服务
+        stats = httpx.get(f"{base_url}/stats").json()
+        assert stats["requests"] == 6, node_name
@@ -0,0 +1,123 @@
+import json
+from deepaide.bulk import iter_prompt_file, Checkpoint, BulkJob
+
+
+class FakeRunner:
+    provider = "siliconflow"
+
+    def __init__(self, fail=()):
+        self.fail = set(fail)
+        self.seen = []
+
+    def build(self, row):
+        if not row["prompt"]:
+            raise ValueError("Empty prompt")
+        return {"model": "m", "messages": [{"role": "user", "content": row["prompt"]}]}
+
+    def run(self, row):
+        self.seen.append(row["prompt"])
+        if row["prompt"] in self.fail:
+            raise RuntimeError("upstream error")
+        return {"answer": row["prompt"].upper(), "finish_reason": "stop", "usage": {}, "cached": False}
+
+
+def _read_jsonl(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def test_iter_prompt_file_resumes_from_offset(tmp_path):
+    path = tmp_path / "prompts.csv"
+    path.write_text('id,prompt\n1,a\n2,"multi\nline"\n\n3,c\n4,d\n', encoding="utf-8")
+    rows = list(iter_prompt_file(str(path)))
+    assert [(index, row["id"], row["prompt"]) for index, row, _ in rows] == [
+        (0, "1", "a"), (1, "2", "multi\nline"), (2, "3", "c"), (3, "4", "d")]
+    index, _, offset = rows[1]
+    resumed = list(iter_prompt_file(str(path), offset=offset, start=index))
+    assert [(i, row["prompt"]) for i, row, _ in resumed] == [(i, row["prompt"]) for i, row, _ in rows[1:]]
+
+    path = tmp_path / "prompts.jsonl"
+    path.write_text('{"prompt": "a"}\n\n"b"\n{"prompt": "c", "id": 7}\n', encoding="utf-8")
+    rows = list(iter_prompt_file(str(path)))
+    assert [row["prompt"] for _, row, _ in rows] == ["a", "b", "c"]
+    resumed = list(iter_prompt_file(str(path), offset=rows[2][2], start=2))
+    assert resumed == [(2, {"prompt": "c", "id": 7}, rows[2][2])]
+
+
+def test_checkpoint_settle_and_reload(tmp_path):
+    path = str(tmp_path / "job.checkpoint.json")
+    checkpoint = Checkpoint(path)
+    for index in (0, 2, 3):
+        checkpoint.settle(index)
+    assert checkpoint.next == 1 and checkpoint.done == {2, 3}
+    checkpoint.settle(1)
+    assert checkpoint.next == 4 and checkpoint.done == set()
+    checkpoint.failed.add(2)
+    checkpoint.save()
+
+    loaded = Checkpoint.load(path)
+    assert loaded.next == 4 and loaded.failed == {2}
+    assert loaded.is_pending(2) and not loaded.is_pending(3) and loaded.is_pending(4)
+
+    # 旧版检查点的 batches 只有 index 列表
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"next": 0, "batches": {"batch_1": [0, 1]}}, f)
+    assert Checkpoint.load(path).batches == {"batch_1": {"indices": [0, 1], "offset": 0, "start": 0}}
+
+
+def test_recover_output_truncates_partial_line(tmp_path):
+    output = tmp_path / "out.jsonl"
+    output.write_bytes(b'{"index": 0, "answer": "A"}\n{"index": 2, "answer": "C"}\n{"index": 1, "ans')
+    job = BulkJob(str(tmp_path / "in.txt"), str(output), FakeRunner())
+    job.checkpoint = Checkpoint(job.checkpoint_path)
+    job._recover_output()
+    assert job.checkpoint.next == 1 and job.checkpoint.done == {2}
+    assert output.read_bytes().endswith(b'"C"}\n')
+    assert job.checkpoint.offset == output.stat().st_size
+
+
+def test_direct_resume_skips_done_and_retries_failed(tmp_path):
+    source = tmp_path / "in.txt"
+    source.write_text("a\nb\nc\nd\n", encoding="utf-8")
+    output = str(tmp_path / "out.jsonl")
+
+    runner = FakeRunner(fail={"b"})
+    stats = BulkJob(str(source), output, runner, concurrency=2).run()
+    assert (stats["succeeded"], stats["failed"], stats["skipped"]) == (3, 1, 0)
+    assert [row["prompt"] for row in _read_jsonl(str(tmp_path / "out.errors.jsonl"))] == ["b"]
+
+    runner = FakeRunner()
+    stats = BulkJob(str(source), output, runner, concurrency=2).run()
+    assert runner.seen == ["b"]
+    assert (stats["succeeded"], stats["failed"], stats["skipped"]) == (1, 0, 3)
+    assert sorted(record["answer"] for record in _read_jsonl(output)) == ["A", "B", "C", "D"]
+
+
+def test_collect_batch_rereads_prompts_from_input(tmp_path):
+    source = tmp_path / "in.jsonl"
+    source.write_text("".join(json.dumps({"id": f"r{i}", "prompt": f"p{i}"}) + "\n" for i in range(6)),
+                      encoding="utf-8")
+    output = str(tmp_path / "out.jsonl")
+    job = BulkJob(str(source), output, FakeRunner(), mode="batch_api", batch_size=3)
+    job._open()
+    offset = list(iter_prompt_file(str(source)))[3][2]
+    job.checkpoint.batches["batch_2"] = {"indices": [3, 4, 5], "offset": offset, "start": 3}
+
+    def _response(index):
+        body = {"choices": [{"message": {"content": f"answer {index}"}, "finish_reason": "stop"}]}
+        return json.dumps({"custom_id": str(index), "response": {"status_code": 200, "body": body}})
+
+    class _Content:
+        text = "\n".join([_response(3), _response(5)])
+
+    job._batch_api = lambda method, path, **kwargs: _Content()
+    try:
+        job._collect_batch({"id": "batch_2", "status": "completed", "output_file_id": "file_1"})
+    finally:
+        job._close()
+
+    assert [(r["index"], r["id"], r["prompt"], r["answer"]) for r in _read_jsonl(output)] == [
+        (3, "r3", "p3", "answer 3"), (5, "r5", "p5", "answer 5")]
+    errors = _read_jsonl(str(tmp_path / "out.errors.jsonl"))
+    assert [(r["index"], r["id"], r["prompt"]) for r in errors] == [(4, "r4", "p4")]
+    assert Checkpoint.load(job.checkpoint_path).batches == {}
@@ -0,0 +1,51 @@
+import time
+import deepaide.cache as cache_module
+from deepaide.cache import (ResponseCache, make_cache_key, pack_choices, unpack_choices,
+                            is_deterministic, cache_is_changed)
+
+PARAMS = {"model": "m", "messages": [{"role": "user", "content": "hi"}], "temperature": 0}
+
+
+def test_cache_key_ignores_stream_options_only():
+    key = make_cache_key("https://api", PARAMS)
+    assert make_cache_key("https://api", dict(PARAMS, stream=True, stream_options={"include_usage": True})) == key
+    assert make_cache_key("https://api", dict(PARAMS, temperature=0.5)) != key
+    assert make_cache_key("https://other", PARAMS) != key
+    assert make_cache_key("https://api", PARAMS, seed=1) != key
+
+
+def test_lru_evicts_least_recently_used():
+    cache = ResponseCache(max_entries=2)
+    cache.set("a", ("A",))
+    cache.set("b", ("B",))
+    assert cache.get("a") == ["A"]
+    cache.set("c", ("C",))
+    assert cache.get("b") is None
+    assert cache.get("a") == ["A"] and cache.get("c") == ["C"]
+
+
+def test_disk_tier_survives_restart_and_expires(tmp_path, monkeypatch):
+    path = str(tmp_path / "cache" / "responses.sqlite3")
+    cache = ResponseCache(max_entries=1, disk_path=path, ttl=60)
+    cache.set("a", pack_choices(["A1", "A2"], ["stop", "length"]))
+    cache.set("b", ("B",))
+    # 内存中已被淘汰的条目从磁盘读回
+    assert unpack_choices(cache.get("a")) == (["A1", "A2"], ["stop", "length"])
+
+    reopened = ResponseCache(disk_path=path, ttl=60)
+    assert reopened.get("b") == ["B"]
+    now = time.time()
+    monkeypatch.setattr(cache_module.time, "time", lambda: now + 61)
+    expired = ResponseCache(disk_path=path, ttl=60)
+    assert expired.get("a") is None
+    # 过期的条目从磁盘删除
+    monkeypatch.undo()
+    assert ResponseCache(disk_path=path, ttl=0).get("a") is None
+
+
+def test_choices_and_determinism_helpers():
+    assert unpack_choices(["A"]) == (["A"], ["stop"])
+    assert is_deterministic(0) and is_deterministic(0.7, seed=3) and not is_deterministic(0.7)
+    assert cache_is_changed(0) == ""
+    assert cache_is_changed(0.7) != cache_is_changed(0.7)
+    assert cache_is_changed(0, use_cache=False) != cache_is_changed(0, use_cache=False)
@@ -0,0 +1,60 @@
+import httpx
+import pytest
+import deepaide.silicon_deepseek as silicon_deepseek
+from deepaide.telemetry import CallTrace
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """模拟上游：记录每次请求的 n，no_n 为 "reject" 时以 400 拒绝 n，为 "ignore" 时只返回一个候选"""
+    state = {"no_n": "ignore", "sent": [], "error": '{"message": "n must be 1 for this model"}'}
+
+    def _choices(base_url, api_key, payload, unique_id=None, max_retries=None, coalesce=True):
+        state["sent"].append(payload["n"])
+        if payload["n"] > 1 and state["no_n"] == "reject":
+            request = httpx.Request("POST", base_url)
+            response = httpx.Response(400, request=request, text=state["error"])
+            raise httpx.HTTPStatusError("400 Bad Request", request=request, response=response)
+        count = 1 if state["no_n"] else payload["n"]
+        return [(None, f"answer {len(state['sent'])}.{i}", "stop") for i in range(count)]
+
+    monkeypatch.setattr(silicon_deepseek, "chat_completion_choices", _choices)
+    monkeypatch.setattr(silicon_deepseek, "_NO_N_MODELS", set())
+    return state
+
+
+def _generate(payload):
+    node = silicon_deepseek.SiliconDeepseekChat()
+    node.api_key = "key"
+    trace = CallTrace("siliconflow", payload["model"])
+    with trace:
+        answers, finish_reasons = node.generate_choices(payload, use_cache=False)
+    return answers, finish_reasons, trace
+
+
+@pytest.mark.parametrize("no_n", ["ignore", "reject"])
+def test_missing_candidates_fall_back_to_parallel_requests(upstream, no_n):
+    upstream["no_n"] = no_n
+    node = silicon_deepseek.SiliconDeepseekChat()
+    payload = node.build_payload("hi", "m", num_candidates=3)
+    answers, finish_reasons, trace = _generate(payload)
+    assert len(answers) == 3 and len(set(answers)) == 3 and finish_reasons == ["stop"] * 3
+    assert trace.extra["n_fallback"] is True
+    assert upstream["sent"][0] == 3 and sorted(upstream["sent"][1:]) == [1] * (2 if no_n == "ignore" else 3)
+
+    # 记住不支持 n 的模型，之后直接并行发送
+    upstream["sent"].clear()
+    answers, _, _ = _generate(payload)
+    assert len(answers) == 3 and upstream["sent"] == [1, 1, 1]
+
+
+def test_supported_n_and_unrelated_errors(upstream):
+    upstream["no_n"] = None
+    node = silicon_deepseek.SiliconDeepseekChat()
+    answers, _, trace = _generate(node.build_payload("hi", "m", num_candidates=2))
+    assert len(answers) == 2 and upstream["sent"] == [2] and "n_fallback" not in trace.extra
+
+    # 与 n 无关的 400 照常抛出
+    upstream.update(no_n="reject", error='{"message": "max_tokens is too large"}')
+    with pytest.raises(httpx.HTTPStatusError):
+        _generate(node.build_payload("hi", "m", num_candidates=2))
@@ -0,0 +1,147 @@
+import time
+import threading
+import pytest
+from deepaide.coalesce import SingleFlight, make_flight_key
+from deepaide.interrupt import RequestCancelled, cancel_scope
+from deepaide.deadline import DeadlineExceeded, deadline_scope
+
+
+def _start_leader(flight, key, fn):
+    """在后台线程中以主请求的身份执行 fn，返回 (线程, 结果)"""
+    outcome = {}
+    entered = threading.Event()
+
+    def _run():
+        def _fn(preview):
+            entered.set()
+            return fn(preview)
+        try:
+            outcome["result"] = flight.run(key, _fn)
+        except BaseException as e:
+            outcome["error"] = e
+
+    thread = threading.Thread(target=_run)
+    thread.start()
+    entered.wait(1)
+    return thread, outcome
+
+
+def _join_follower(flight, key, fn):
+    outcome = {}
+
+    def _run():
+        try:
+            outcome["result"] = flight.run(key, fn)
+        except BaseException as e:
+            outcome["error"] = e
+
+    thread = threading.Thread(target=_run)
+    thread.start()
+    time.sleep(0.05)
+    return thread, outcome
+
+
+def test_flight_key_separates_stream():
+    params = {"model": "m", "messages": []}
+    assert make_flight_key("u", "k", params) == make_flight_key("u", "k", dict(params))
+    assert make_flight_key("u", "k", params) != make_flight_key("u", "k", dict(params, stream=True))
+
+
+def test_followers_share_result():
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def _fn(preview):
+        calls.append(1)
+        release.wait(1)
+        return "answer"
+
+    leader, leader_outcome = _start_leader(flight, "k", _fn)
+    follower, follower_outcome = _join_follower(flight, "k", _fn)
+    release.set()
+    leader.join(1)
+    follower.join(1)
+    assert leader_outcome["result"] == ("answer", False)
+    assert follower_outcome["result"] == ("answer", True)
+    assert len(calls) == 1
+    assert not flight.flights
+
+
+def test_upstream_error_is_shared():
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def _fn(preview):
+        calls.append(1)
+        release.wait(1)
+        raise RuntimeError("upstream 500")
+
+    leader, leader_outcome = _start_leader(flight, "k", _fn)
+    follower, follower_outcome = _join_follower(flight, "k", _fn)
+    release.set()
+    leader.join(1)
+    follower.join(1)
+    assert isinstance(leader_outcome["error"], RuntimeError)
+    assert follower_outcome["error"] is leader_outcome["error"]
+    assert len(calls) == 1
+
+
+@pytest.mark.parametrize("error", [RequestCancelled(), DeadlineExceeded()])
+def test_follower_retries_when_leader_is_cancelled(error):
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def _leader_fn(preview):
+        calls.append("leader")
+        release.wait(1)
+        raise error
+
+    def _follower_fn(preview):
+        calls.append("follower")
+        return "answer"
+
+    leader, leader_outcome = _start_leader(flight, "k", _leader_fn)
+    follower, follower_outcome = _join_follower(flight, "k", _follower_fn)
+    release.set()
+    leader.join(1)
+    follower.join(1)
+    assert leader_outcome["error"] is error
+    # 等待者自己成为主请求重新发送
+    assert follower_outcome["result"] == ("answer", False)
+    assert calls == ["leader", "follower"]
+
+
+def test_follower_deadline_while_waiting():
+    flight = SingleFlight()
+    release = threading.Event()
+    leader, _ = _start_leader(flight, "k", lambda preview: release.wait(1))
+    try:
+        with deadline_scope(0.05):
+            with pytest.raises(DeadlineExceeded):
+                flight.run("k", lambda preview: "unused")
+    finally:
+        release.set()
+        leader.join(1)
+
+
+def test_cancelled_follower_stops_waiting():
+    flight = SingleFlight()
+    release = threading.Event()
+    leader, leader_outcome = _start_leader(flight, "k", lambda preview: release.wait(5) and "answer")
+    cancel = threading.Event()
+    preview = object()
+    threading.Timer(0.1, cancel.set).start()
+    start = time.monotonic()
+    try:
+        # 没有 deadline 的等待者也要响应自己的取消事件，不等主请求结束
+        with cancel_scope(cancel), pytest.raises(RequestCancelled):
+            flight.run("k", lambda preview: "unused", preview)
+        assert time.monotonic() - start < 1.0
+        assert preview not in flight.flights["k"].previews
+    finally:
+        release.set()
+        leader.join(1)
+    assert leader_outcome["result"] == ("answer", False)
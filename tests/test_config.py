@@ -0,0 +1,51 @@
+import os
+import json
+import pytest
+import deepaide.config as config
+
+
+@pytest.fixture
+def config_file(monkeypatch, tmp_path):
+    path = tmp_path / "config.json"
+    monkeypatch.setattr(config, "CONFIG_PATH", str(path))
+    for name in ("_file_mtime", "_cached_mtime", "_cached_config"):
+        monkeypatch.setattr(config, name, None)
+    monkeypatch.setattr(config, "_file_config", {})
+    for name in list(os.environ):
+        if name.startswith(config.ENV_PREFIX):
+            monkeypatch.delenv(name)
+
+    def _write(data, mtime):
+        path.write_text(json.dumps(data), encoding="utf-8")
+        os.utime(path, ns=(mtime, mtime))
+
+    return _write
+
+
+def test_config_is_reparsed_only_when_modified(config_file):
+    config_file({"api_key": "a"}, 1_000_000_000)
+    first = config.load_config()
+    assert first == {"api_key": "a"}
+    assert config.load_config() is first
+    config_file({"api_key": "b", "silicon_base_url": "https://proxy"}, 2_000_000_000)
+    assert config.load_config()["api_key"] == "b"
+    assert config.get_credentials("siliconflow") == ("https://proxy", None)
+    assert config.get_credentials("deepseek") == ("https://api.deepseek.com", "b")
+
+
+def test_env_overrides_nested_keys(config_file, monkeypatch):
+    config_file({"api_key": "file", "rate_limits": {"deepseek": {"rpm": 10, "tpm": 5}}}, 1_000_000_000)
+    monkeypatch.setenv("DEEPAIDE_API_KEY", "env")
+    monkeypatch.setenv("DEEPAIDE_RATE_LIMITS__DEEPSEEK__RPM", "60")
+    monkeypatch.setenv("DEEPAIDE_CACHE_DISK", "true")
+    loaded = config.load_config()
+    assert loaded["api_key"] == "env" and loaded["cache_disk"] is True
+    assert loaded["rate_limits"]["deepseek"] == {"rpm": 60, "tpm": 5}
+    # 覆盖不会修改文件中读到的配置
+    assert config._file_config["api_key"] == "file"
+
+
+def test_missing_or_broken_file(config_file, tmp_path):
+    assert config.load_config() == {}
+    (tmp_path / "config.json").write_text("{broken", encoding="utf-8")
+    assert config.load_config() == {}
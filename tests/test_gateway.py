@@ -0,0 +1,144 @@
+import json
+import time
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import pytest
+import deepaide.gateway as gateway
+import deepaide.deepseek as deepseek
+from deepaide.cache import get_response_cache
+from deepaide.scheduler import NO_RETRY_HEADER, retry_info
+
+
+class _ThrottledUpstream(BaseHTTPRequestHandler):
+    """总是返回 429 的上游，记录收到的请求数"""
+    protocol_version = "HTTP/1.1"
+    hits = 0
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        type(self).hits += 1
+        body = json.dumps({"error": {"message": "rate limited", "type": "rate_limit"}}).encode()
+        self.send_response(429)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Retry-After", "0")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class _StreamingUpstream(BaseHTTPRequestHandler):
+    """逐块输出回答的 SSE 上游，记录收到的请求数"""
+    protocol_version = "HTTP/1.1"
+    hits = 0
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        type(self).hits += 1
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        events = [{"id": "c1", "model": "deepseek-chat", "choices": [{"index": 0, "delta": {"content": word}}]}
+                  for word in ("流式", " answer", " 完成")]
+        events.append({"id": "c1", "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+                       "usage": {"prompt_tokens": 3, "completion_tokens": 3, "total_tokens": 6}})
+        lines = [("data: " + json.dumps(event, ensure_ascii=False) + "\n\n").encode() for event in events]
+        for data in lines + [b"data: [DONE]\n\n"]:
+            # 故意把一行拆成两块发送
+            for part in (data[:7], data[7:]):
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(part), part))
+                self.wfile.flush()
+            time.sleep(0.1)
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+
+def _start(monkeypatch, handler):
+    handler.hits = 0
+    upstream = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=upstream.serve_forever, daemon=True).start()
+    options = dict(gateway._DEFAULT_OPTIONS, upstreams={
+        "deepseek": {"base_url": f"http://127.0.0.1:{upstream.server_port}", "api_key": "upstream-key"},
+    })
+    monkeypatch.setattr(gateway, "load_gateway_options", lambda: options)
+    server, base_url = gateway.start_gateway("127.0.0.1", 0)
+    return upstream, server, base_url
+
+
+@pytest.fixture
+def throttled_gateway(monkeypatch):
+    upstream, server, base_url = _start(monkeypatch, _ThrottledUpstream)
+    yield base_url
+    server.shutdown()
+    upstream.shutdown()
+
+
+@pytest.fixture
+def streaming_gateway(monkeypatch):
+    upstream, server, base_url = _start(monkeypatch, _StreamingUpstream)
+    yield base_url
+    server.shutdown()
+    upstream.shutdown()
+
+
+def test_gateway_retries_are_not_multiplied_by_workers(throttled_gateway):
+    params = {"model": "deepseek-chat", "messages": [{"role": "user", "content": "hi"}],
+              "max_tokens": 16, "temperature": 1.0}
+    # 工作进程和网关在同一个进程中，工作进程用单独的 key 调度器，不与网关共用并发名额
+    worker_key = [{"key": "worker-key", "max_concurrency": 4}]
+    with pytest.raises(Exception) as info:
+        deepseek.chat_completion(f"{throttled_gateway}/deepseek", worker_key, params,
+                                 max_retries=3, coalesce=False)
+    retryable, status, _ = retry_info(info.value)
+    assert status == 429 and not retryable
+    # 只有网关自己的 1 + 3 次，工作进程没有再重试
+    assert _ThrottledUpstream.hits == 4
+
+
+def test_marker_header_disables_retry():
+    class _Response:
+        status_code = 503
+        headers = {NO_RETRY_HEADER: "1"}
+
+    class _Error(Exception):
+        response = _Response()
+
+    assert retry_info(_Error()) == (False, 503, None)
+    _Response.headers = {}
+    assert retry_info(_Error())[0]
+
+
+def test_streamed_requests_are_coalesced_and_cached(streaming_gateway):
+    get_response_cache().clear()
+    params = {"model": "deepseek-chat", "messages": [{"role": "user", "content": "stream me"}],
+              "max_tokens": 16, "temperature": 0, "stream": True}
+    worker_key = [{"key": "stream-worker-key", "max_concurrency": 8}]
+    results = []
+
+    def _worker():
+        # 关闭工作进程自己的请求合并，相同的请求都到达网关
+        results.append(deepseek.chat_completion_choices(f"{streaming_gateway}/deepseek", worker_key,
+                                                        params, coalesce=False))
+
+    threads = []
+    for _ in range(3):
+        threads.append(threading.Thread(target=_worker))
+        threads[-1].start()
+        time.sleep(0.05)  # 后加入的请求要补发已经转发过的部分
+    for thread in threads:
+        thread.join(10)
+    assert results == [[(None, "流式 answer 完成", "stop")]] * 3
+    assert _StreamingUpstream.hits == 1
+
+    # 拼好的回答写入缓存，之后的流式和非流式请求都直接命中
+    assert deepseek.chat_completion_choices(f"{streaming_gateway}/deepseek", worker_key, params,
+                                            coalesce=False) == [(None, "流式 answer 完成", "stop")]
+    assert deepseek.chat_completion(f"{streaming_gateway}/deepseek", worker_key, dict(params, stream=False),
+                                    coalesce=False) == (None, "流式 answer 完成")
+    assert _StreamingUpstream.hits == 1
@@ -0,0 +1,68 @@
+import pytest
+from deepaide.history import SUMMARY_PREFIX, compact_history, fit_history, split_turns
+from deepaide.tokens import token_weight, estimate_tokens, estimate_messages_tokens, clamp_max_tokens, IMAGE_TOKENS
+
+
+def _turn(index, size=100):
+    return [{"role": "user", "content": f"q{index} " + "x" * size},
+            {"role": "assistant", "content": f"a{index} " + "y" * size}]
+
+
+def _history(count, size=100):
+    return [m for index in range(count) for m in _turn(index, size)]
+
+
+def test_token_estimates():
+    assert token_weight("abcdefghij") == pytest.approx(3.0)
+    assert token_weight("中文") == pytest.approx(1.2)
+    assert token_weight("ab" + "中") == pytest.approx(0.6 + 0.6)
+    assert estimate_tokens("") == 0 and estimate_tokens("abc") == 1
+    # 图片按固定数量计，不按 base64 长度估算
+    image = [{"type": "text", "text": "abc"}, {"type": "image_url", "image_url": {"url": "data:" + "A" * 100000}}]
+    assert estimate_messages_tokens([{"role": "user", "content": image}]) == 1 + IMAGE_TOKENS + 4
+
+
+def test_compact_history_drops_oldest_turns():
+    history = _history(5) + [{"role": "user", "content": "now"}]
+    assert compact_history(history, 10 ** 6) is history
+    budget = estimate_messages_tokens(history) - 1
+    compacted = compact_history(history, budget)
+    assert compacted == history[2:]
+    # low_water 一次压缩得更多
+    assert len(compact_history(history, budget, low_water=0.5)) < len(compacted)
+    # 当前提问始终保留
+    assert compact_history(history, 1) == history[-1:]
+    assert len(split_turns(history)) == 6
+
+
+def test_compact_history_rolls_summary():
+    history = _history(4) + [{"role": "user", "content": "now"}]
+    summarized = []
+
+    def _summarize(messages):
+        summarized.append(messages)
+        return f"summary of {len(messages)}"
+
+    budget = estimate_messages_tokens(history[4:]) + 30
+    compacted = compact_history(history, budget, _summarize)
+    assert compacted[0]["content"].startswith(SUMMARY_PREFIX) and compacted[1]["content"] == "OK"
+    assert summarized[0] == history[:len(summarized[0])]
+
+    # 旧摘要和新丢弃的轮次合并成新摘要
+    compacted = compact_history(compacted + _turn(9) + [{"role": "user", "content": "later"}],
+                                budget, _summarize)
+    assert summarized[1][0]["content"].startswith(SUMMARY_PREFIX)
+    assert sum(1 for m in compacted if m["content"].startswith(SUMMARY_PREFIX)) == 1
+
+
+def test_fit_history_clamps_max_tokens():
+    system = [{"role": "system", "content": "sys"}]
+    history = _history(3) + [{"role": "user", "content": "now"}]
+    fitted, max_tokens = fit_history("unknown-model", system, history, 100000)
+    # 上下文窗口（64000）减去 max_tokens 后预算不足，只保留当前提问
+    assert fitted == history[-1:]
+    assert max_tokens == 64000 - estimate_messages_tokens(system + fitted)
+    fitted, max_tokens = fit_history("deepseek-chat", system, history, 1000)
+    assert fitted == history and max_tokens == 1000
+    with pytest.raises(ValueError):
+        clamp_max_tokens("unknown-model", [{"role": "user", "content": "x" * 300000}], 10)
@@ -0,0 +1,120 @@
+import sys
+import json
+import time
+import types
+import select
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import pytest
+import deepaide.deepseek as deepseek
+import deepaide.silicon_deepseek as silicon_deepseek
+from deepaide.interrupt import RequestCancelled, cancel_scope
+from deepaide.telemetry import CallTrace
+
+
+class _SlowHandler(BaseHTTPRequestHandler):
+    """
+    流式请求：先输出一个数据块，然后长时间不再输出；非流式请求：长时间不返回响应头。
+    等待期间检查客户端是否断开
+    """
+    protocol_version = "HTTP/1.1"
+    outcome = {}
+
+    def log_message(self, *args):
+        pass
+
+    def _wait_for_disconnect(self, seconds):
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            readable, _, _ = select.select([self.connection], [], [], 0.05)
+            if readable and not self.connection.recv(1):
+                type(self).outcome["disconnected"] = True
+                return True
+        return False
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        type(self).outcome["stream"] = body.get("stream")
+        if not body.get("stream"):
+            if self._wait_for_disconnect(5.0):
+                return
+            self.send_error(500)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        data = ("data: " + json.dumps({"choices": [{"index": 0, "delta": {"content": "partial"}}]})
+                + "\n\n").encode()
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+        if not self._wait_for_disconnect(5.0):
+            self.wfile.write(b"0\r\n\r\n")
+
+
+@pytest.fixture
+def slow_server():
+    _SlowHandler.outcome = {}
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _SlowHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}", _SlowHandler.outcome
+    server.shutdown()
+
+
+@pytest.fixture
+def comfy(monkeypatch):
+    """模拟 ComfyUI 的 comfy.model_management 中断标志"""
+    state = {"interrupted": False}
+    module = types.SimpleNamespace(processing_interrupted=lambda: state["interrupted"])
+    monkeypatch.setitem(sys.modules, "comfy.model_management", module)
+    return state
+
+
+def _wait_for(outcome, key, timeout=3.0):
+    deadline = time.monotonic() + timeout
+    while key not in outcome and time.monotonic() < deadline:
+        time.sleep(0.02)
+    return outcome.get(key)
+
+
+def _params(stream):
+    return {"model": "deepseek-chat", "messages": [{"role": "user", "content": "hi"}],
+            "max_tokens": 100, "stream": stream}
+
+
+def test_non_stream_request_is_aborted_while_waiting_for_headers(slow_server, comfy):
+    base_url, outcome = slow_server
+    threading.Timer(0.2, lambda: comfy.update(interrupted=True)).start()
+    start = time.monotonic()
+    with pytest.raises(RequestCancelled):
+        deepseek._send_chat_completion(base_url, "key", _params(False))
+    assert time.monotonic() - start < 1.0
+    # 请求方式保持不变，中断后连接被断开
+    assert outcome["stream"] is False
+    assert _wait_for(outcome, "disconnected")
+
+
+def test_stream_request_is_aborted_during_idle_gap(slow_server, comfy):
+    base_url, outcome = slow_server
+    threading.Timer(0.3, lambda: comfy.update(interrupted=True)).start()
+    start = time.monotonic()
+    trace = CallTrace("siliconflow", "deepseek-chat")
+    with pytest.raises(RequestCancelled) as info, trace:
+        silicon_deepseek._send_chat_completion(base_url, "key", _params(True))
+    assert time.monotonic() - start < 1.0
+    assert info.value.content == "partial"
+    # 指标记录只有部分输出的长度，没有文本
+    record = trace.to_dict()
+    assert record["status"] == "cancelled" and record["partial_chars"] == len("partial")
+    assert "partial" not in json.dumps(record).replace("partial_", "")
+    assert _wait_for(outcome, "disconnected")
+
+
+def test_cancel_scope_aborts_without_comfy(slow_server):
+    base_url, outcome = slow_server
+    cancel = threading.Event()
+    threading.Timer(0.2, cancel.set).start()
+    with cancel_scope(cancel), pytest.raises(RequestCancelled):
+        silicon_deepseek._send_chat_completion(base_url, "key", _params(False))
+    assert _wait_for(outcome, "disconnected")
@@ -0,0 +1,121 @@
+import json
+import random
+import pytest
+from deepaide.json_mode import JSONStreamParser, parse_json, validate, complete_json
+from deepaide.telemetry import CallTrace
+
+DOCUMENT = ('Here you go:\n```json\n{"title": "a \\"quoted\\" {title}", "tags": ["x", "y\\\\", "[z]"], '
+            '"scenes": [{"id": 1, "text": "one, two"}, {"id": 2, "text": "\\u4e8c"}, {"id": 3, "text": "3"}]}\n```')
+SCHEMA = {
+    "type": "object",
+    "required": ["scenes"],
+    "properties": {
+        "scenes": {
+            "type": "array",
+            "items": {"type": "object", "required": ["id", "text"],
+                      "properties": {"id": {"type": "integer"}, "text": {"type": "string"}}},
+        },
+    },
+}
+
+
+def _split(text, rng):
+    cuts = sorted(rng.sample(range(1, len(text)), rng.randint(1, 40)))
+    return [text[start:end] for start, end in zip([0] + cuts, cuts + [len(text)])]
+
+
+def test_stream_parser_is_independent_of_chunking():
+    expected = json.loads(DOCUMENT[DOCUMENT.index("{"):DOCUMENT.rindex("}") + 1])
+    rng = random.Random(0)
+    for _ in range(200):
+        parser = JSONStreamParser()
+        completed = []
+        for chunk in _split(DOCUMENT, rng):
+            completed.extend(parser.feed(chunk))
+        assert completed == [("tags", tag) for tag in expected["tags"]] + \
+            [("scenes", scene) for scene in expected["scenes"]]
+        assert json.loads(parser.document()) == expected
+
+
+def test_stream_parser_root_array_and_bad_items():
+    parser = JSONStreamParser()
+    completed = parser.feed('[1, {"a": [2]}, nope, "s"]')
+    assert completed == [(None, 1), (None, {"a": [2]}), (None, "s")]
+    assert parser.errors == [(None, 2, "nope")]
+
+
+def test_parse_json_repairs():
+    assert parse_json('{"a": 1}') == ({"a": 1}, False)
+    assert parse_json('```json\n{"a": [1, 2,],}\n```') == ({"a": [1, 2]}, True)
+    # 截断时丢掉没写完的元素，补全括号
+    assert parse_json('{"items": [{"x": 1}, {"x": 2}, {"x": "tr') == ({"items": [{"x": 1}, {"x": 2}]}, True)
+    with pytest.raises(ValueError):
+        parse_json("no json here")
+
+
+def test_validate_reports_paths():
+    value = {"scenes": [{"id": 1, "text": "a"}, {"id": True, "text": 2}], "extra": 1}
+    schema = dict(SCHEMA, additionalProperties=False)
+    assert validate(value, schema) == [
+        (("scenes", 1, "id"), "expected integer, got bool"),
+        (("scenes", 1, "text"), "expected string, got int"),
+        ((), "unexpected property 'extra'"),
+    ]
+
+
+def test_item_rerequest_includes_previous_answer():
+    sent = []
+    original = {"scenes": [{"id": 1, "text": "a"}, {"id": "2", "text": "b"}, {"id": 3}]}
+
+    def _send(params):
+        sent.append(params)
+        return json.dumps({"items": [{"id": 2, "text": "b"}, {"id": 3, "text": "c"}]})
+
+    params = {"model": "m", "messages": [{"role": "user", "content": "scenes"}], "n": 2}
+    trace = CallTrace("deepseek", "m")
+    with trace:
+        value, items = complete_json(_send, params, json.dumps(original), SCHEMA, retries=1)
+    assert [item["text"] for item in items] == ["a", "b", "c"]
+    assert value["scenes"][1]["id"] == 2
+    assert trace.extra["json"]["fixed_items"] == 2 and trace.extra["json"]["rerequests"] == 1
+
+    (followup,) = sent
+    assert followup["n"] == 1
+    assert followup["messages"][0] == params["messages"][0]
+    assistant, request = followup["messages"][1:]
+    assert assistant["role"] == "assistant" and json.loads(assistant["content"]) == original
+    assert request["role"] == "user" and "These 2 items of the array $.scenes" in request["content"]
+
+
+def test_document_rerequest():
+    answers = iter(['{"scenes": [{"id": 1, "text": "a"}]}'])
+
+    def _send(params):
+        assert params["messages"][-2]["role"] == "assistant"
+        return next(answers)
+
+    # 根对象缺少必填字段时重新请求整个回答
+    value, items = complete_json(_send, {"messages": []}, '{"title": "x"}', SCHEMA, retries=1)
+    assert value == {"scenes": [{"id": 1, "text": "a"}]} and items == [{"id": 1, "text": "a"}]
+    # 无法解析的回答先重新请求，次数用完时抛出错误
+    with pytest.raises(ValueError):
+        complete_json(lambda params: "still not json", {"messages": []}, "not json", retries=1)
+
+
+def test_exhausted_rerequests_raise_remaining_errors():
+    sent = []
+
+    def _send(params):
+        sent.append(params)
+        return '{"items": [{"id": "still wrong", "text": "b"}]}'
+
+    answer = json.dumps({"scenes": [{"id": 1, "text": "a"}, {"id": "2", "text": "b"}]})
+    trace = CallTrace("deepseek", "m")
+    with pytest.raises(ValueError) as info, trace:
+        complete_json(_send, {"messages": []}, answer, SCHEMA, retries=1)
+    assert len(sent) == 1
+    assert "$.scenes[1].id: expected integer, got str" in str(info.value)
+    assert trace.extra["json"]["errors"] == ["$.scenes[1].id: expected integer, got str"]
+    # strict=False 时原样返回未通过校验的结果
+    value, items = complete_json(_send, {"messages": []}, answer, SCHEMA, retries=0, strict=False)
+    assert value["scenes"][1]["id"] == "2" and len(items) == 2
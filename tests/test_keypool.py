@@ -0,0 +1,66 @@
+import types
+import itertools
+import pytest
+import deepaide.keypool as keypool
+from deepaide.keypool import KeyPool, parse_keys, mask_key, run_with_keys
+
+_providers = itertools.count()
+
+
+def _pool(keys):
+    # 调度器按 (服务商, key) 共享，每个测试用单独的服务商名
+    return KeyPool(f"test-{next(_providers)}", parse_keys(keys))
+
+
+class _StatusError(Exception):
+    def __init__(self, status, headers=None):
+        super().__init__(f"HTTP {status}")
+        self.response = types.SimpleNamespace(status_code=status, headers=headers or {})
+
+
+def test_parse_and_mask_keys():
+    assert parse_keys("") == [] and parse_keys("k") == [("k", {})]
+    assert parse_keys(["a", "", {"key": "b", "rpm": 5}, {"rpm": 1}]) == [("a", {}), ("b", {"rpm": 5})]
+    assert mask_key("sk-1234567890abcd") == "sk-...abcd" and mask_key("short") == "***"
+
+
+def test_idle_keys_are_used_in_turn():
+    pool = _pool(["a", "b", "c"])
+    assert [pool.pick()[0][0] for _ in range(4)] == ["a", "b", "c", "a"]
+    # 并发占用多的 key 排在后面
+    pool._scheduler("b", {}).limiter.in_flight = 3
+    assert [pool.pick()[0][0] for _ in range(2)] == ["c", "a"]
+
+
+def test_throttled_key_is_suspended_and_skipped(monkeypatch):
+    pool = _pool(["a", "b"])
+    used = []
+
+    def _send(key):
+        used.append(key)
+        if key == "a":
+            raise _StatusError(429, {"retry-after": "30"})
+        return f"answer from {key}"
+
+    # 429 的 key 暂停后立即换下一个 key，不等待
+    monkeypatch.setattr(keypool, "sleep_within_deadline", lambda seconds: pytest.fail("should not sleep"))
+    assert pool.run(_send) == "answer from b"
+    assert used == ["a", "b"] and pool.suspended["a"] > pool.suspended.get("b", 0)
+    used.clear()
+    assert pool.run(_send) == "answer from b" and used == ["b"]
+
+
+def test_all_keys_rejected_raises_last_error(monkeypatch):
+    pool = _pool(["a", "b"])
+    monkeypatch.setattr(keypool, "sleep_within_deadline", lambda seconds: pytest.fail("should not sleep"))
+
+    def _send(key):
+        raise _StatusError(401)
+
+    with pytest.raises(_StatusError):
+        pool.run(_send)
+    assert set(pool.suspended) == {"a", "b"}
+
+
+def test_single_key_uses_shared_scheduler():
+    assert run_with_keys(f"test-{next(_providers)}", "k", lambda key: key.upper()) == "K"
@@ -0,0 +1,45 @@
+import json
+import deepaide.deepseek as deepseek
+from deepaide.prompt_layout import build_prefix, strip_prefix
+
+FEW_SHOT = json.dumps([{"user": "1+1", "assistant": "2"}])
+
+
+def test_prefix_cache_layout_is_canonical():
+    standard = build_prefix("  Be brief.  \r\n", FEW_SHOT)
+    canonical = build_prefix("  Be brief.  \r\n", FEW_SHOT, "prefix_cache")
+    assert [m["role"] for m in canonical] == ["system", "user", "assistant"]
+    assert canonical[0]["content"] == "Be brief."
+    assert standard[0]["content"] != canonical[0]["content"]
+
+
+def test_strip_prefix_drops_stored_examples():
+    prefix = build_prefix("sys", FEW_SHOT)
+    turn = [{"role": "user", "content": "hi"}, {"role": "assistant", "content": "hello"}]
+    # 旧版 standard 布局的会话：前缀和示例对话都存在会话里
+    assert strip_prefix(prefix + turn, prefix) == turn
+    # 只保存了对话历史的会话不受影响，即使第一轮恰好和示例相同
+    assert strip_prefix(prefix[1:] + turn, prefix) == prefix[1:] + turn
+    assert strip_prefix([prefix[0]] + turn) == turn
+
+
+def test_standard_layout_keeps_few_shot_in_prefix(monkeypatch):
+    sent = []
+
+    def _chat_completion(base_url, api_key, params, unique_id=None, coalesce=True):
+        sent.append(params["messages"])
+        return "thinking", f"answer {len(sent)}"
+
+    monkeypatch.setattr(deepseek, "chat_completion", _chat_completion)
+    node = deepseek.DeepseekReasonerNode()
+    node.api_key = "key"
+    for prompt in ("first", "second"):
+        node.execute(prompt, "sys", few_shot=FEW_SHOT, use_cache=False)
+
+    prefix = build_prefix("sys", FEW_SHOT)
+    assert sent[0] == prefix + [{"role": "user", "content": "first"}]
+    assert sent[1] == prefix + [{"role": "user", "content": "first"},
+                                {"role": "assistant", "content": "answer 1"},
+                                {"role": "user", "content": "second"}]
+    # 会话中只有对话历史，示例对话不会被当作历史压缩掉
+    assert node.local_session.messages[0] == {"role": "user", "content": "first"}
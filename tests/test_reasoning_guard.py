@@ -0,0 +1,39 @@
+import pytest
+from deepaide.reasoning_guard import (ReasoningBudgetExceeded, ReasoningGuard, guarded_completion,
+                                      FALLBACK_MAX_TOKENS)
+
+
+def test_guard_checks_tokens_then_time():
+    guard = ReasoningGuard(max_tokens=100, max_seconds=5.0)
+    assert not guard.check(50, 1.0)
+    assert guard.check(150, 1.0) and guard.reason == "tokens"
+    guard = ReasoningGuard(max_tokens=0, max_seconds=5.0)
+    assert guard.check(10_000, 6.0) and guard.reason == "time"
+
+
+def test_fallback_clamps_max_tokens():
+    sent = []
+
+    def _send(params):
+        sent.append(params)
+        if params["model"] == "deepseek-reasoner":
+            raise ReasoningBudgetExceeded("partial reasoning", "")
+        return None, "answer"
+
+    params = {"model": "deepseek-reasoner", "messages": [], "max_tokens": 32768, "stream": False}
+    reasoning, answer, fired = guarded_completion(_send, params, max_tokens=1024)
+    assert (reasoning, answer, fired) == ("partial reasoning", "answer", True)
+    assert sent[0]["stream"] is True
+    fallback = sent[1]
+    assert fallback["model"] == "deepseek-chat"
+    assert fallback["max_tokens"] == FALLBACK_MAX_TOKENS["deepseek-chat"]
+    assert fallback["stream"] is False
+
+
+def test_no_fallback_raises():
+    def _send(params):
+        raise ReasoningBudgetExceeded("partial", "")
+
+    with pytest.raises(ReasoningBudgetExceeded):
+        guarded_completion(_send, {"model": "deepseek-reasoner", "messages": []}, max_tokens=10,
+                           fallback=False)
@@ -0,0 +1,166 @@
+import json
+import time
+import select
+import itertools
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import pytest
+import deepaide.router as router
+from deepaide.interrupt import RequestCancelled, check_interrupt
+from deepaide.deadline import DeadlineExceeded
+
+_names = itertools.count()
+
+
+def _endpoint():
+    # 熔断器按 (provider, model) 全局共享，每个用例用不同的模型名
+    return {"provider": "deepseek", "model": f"test-model-{next(_names)}"}
+
+
+def _half_open(endpoint):
+    stats = router.get_endpoint_stats(endpoint)
+    for _ in range(stats.failure_threshold):
+        stats.record_failure()
+    stats.opened_at = time.monotonic() - stats.cooldown - 1
+    return stats
+
+
+@pytest.fixture
+def credentials(monkeypatch):
+    monkeypatch.setattr(router, "get_credentials", lambda provider: ("http://upstream", "key"))
+
+
+def _provider(monkeypatch, fn):
+    monkeypatch.setitem(router.PROVIDERS, "deepseek",
+                        lambda base_url, api_key, params, max_retries=None, coalesce=True: fn(params))
+
+
+def test_breaker_opens_after_threshold():
+    stats = router.EndpointStats(failure_threshold=2, cooldown=60)
+    stats.record_failure()
+    assert stats.admit() == (True, False)
+    stats.record_failure()
+    assert stats.state == "open"
+    assert stats.admit() == (False, False)
+
+
+def test_half_open_admits_single_probe():
+    stats = _half_open(_endpoint())
+    assert stats.admit() == (True, True)
+    assert stats.state == "half-open"
+    assert stats.admit() == (False, False)
+    stats.record_success(0.1)
+    assert stats.state == "closed"
+    assert stats.admit() == (True, False)
+
+
+def test_failed_probe_reopens():
+    stats = _half_open(_endpoint())
+    assert stats.admit() == (True, True)
+    stats.record_failure()
+    assert stats.state == "open"
+    assert stats.admit() == (False, False)
+
+
+@pytest.mark.parametrize("error", [RequestCancelled(), DeadlineExceeded()])
+def test_cancelled_probe_is_released(monkeypatch, credentials, error):
+    endpoint = _endpoint()
+    stats = _half_open(endpoint)
+
+    def _raise(params):
+        raise error
+
+    _provider(monkeypatch, _raise)
+    allowed, probe = stats.admit()
+    with pytest.raises(type(error)):
+        router._call_endpoint(endpoint, {"messages": []}, probe=probe)
+    # 取消不算失败，熔断器仍然是打开的，但下一个探测请求可以放行
+    assert stats.failures == stats.failure_threshold
+    assert stats.admit() == (True, True)
+
+
+def test_missing_key_does_not_take_probe(monkeypatch):
+    monkeypatch.setattr(router, "get_credentials", lambda provider: ("http://upstream", None))
+    endpoint = _endpoint()
+    stats = _half_open(endpoint)
+    results = router.fanout_chat_completion([endpoint], {"messages": []})
+    assert results[0]["status"] == "error"
+    assert "not configured" in results[0]["error"]
+    assert not stats.probing
+
+
+def test_fanout_first_n_releases_cancelled_probe(monkeypatch, credentials):
+    fast, slow = _endpoint(), _endpoint()
+    stats = _half_open(slow)
+
+    def _send(params):
+        if params["model"] == slow["model"]:
+            # 模拟流式请求：直到被取消
+            while True:
+                check_interrupt()
+                time.sleep(0.01)
+        return None, "fast answer"
+
+    _provider(monkeypatch, _send)
+    results = router.fanout_chat_completion([fast, slow], {"messages": []}, first_n=1)
+    assert [r["status"] for r in results] == ["ok", "cancelled"]
+    deadline = time.monotonic() + 2
+    while stats.probing and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert not stats.probing
+    assert stats.admit() == (True, True)
+
+
+class _HedgeUpstream(BaseHTTPRequestHandler):
+    """/slow 一直不返回（记录客户端是否断开），/fast 立即返回"""
+    protocol_version = "HTTP/1.1"
+    outcome = {}
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        if self.path.startswith("/slow"):
+            deadline = time.monotonic() + 5
+            while time.monotonic() < deadline:
+                readable, _, _ = select.select([self.connection], [], [], 0.05)
+                if readable and not self.connection.recv(1):
+                    type(self).outcome["disconnected"] = True
+                    return
+            type(self).outcome["finished"] = True
+            self.send_error(500)
+            return
+        body = json.dumps({"choices": [{"index": 0, "message": {"role": "assistant", "content": "hedged"},
+                                        "finish_reason": "stop"}]}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def test_hedge_loser_connection_is_dropped(monkeypatch):
+    _HedgeUpstream.outcome = {}
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _HedgeUpstream)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+    urls = {"deepseek": f"{base_url}/slow", "siliconflow": f"{base_url}/fast"}
+    monkeypatch.setattr(router, "get_credentials", lambda provider: (urls[provider], "key"))
+    primary = {"provider": "deepseek", "model": f"hedge-primary-{next(_names)}"}
+    hedge = {"provider": "siliconflow", "model": f"hedge-secondary-{next(_names)}"}
+    monkeypatch.setattr(router, "load_routes", lambda: {"hedged": [primary, hedge]})
+    try:
+        reasoning, answer, endpoint, _ = router.route_chat_completion(
+            "hedged", {"messages": [{"role": "user", "content": "hi"}], "max_tokens": 16},
+            hedge_delay=0.1, coalesce=False)
+        assert (answer, endpoint) == ("hedged", router.endpoint_name(hedge))
+        # 主请求输掉后被取消，连接断开，不会继续生成
+        deadline = time.monotonic() + 3
+        while not _HedgeUpstream.outcome and time.monotonic() < deadline:
+            time.sleep(0.02)
+        assert _HedgeUpstream.outcome == {"disconnected": True}
+        # 被取消不算端点故障
+        assert router.get_endpoint_stats(primary).failures == 0
+    finally:
+        server.shutdown()
@@ -0,0 +1,104 @@
+import types
+import pytest
+import deepaide.scheduler as scheduler
+from deepaide.scheduler import (TokenBucket, AdaptiveLimiter, ProviderScheduler, retry_info,
+                                NO_RETRY_HEADER, _DEFAULT_LIMITS)
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 100.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(round(seconds, 3))
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(scheduler, "time", types.SimpleNamespace(monotonic=clock.monotonic, time=lambda: 0.0))
+    monkeypatch.setattr(scheduler, "sleep_within_deadline", clock.sleep)
+    return clock
+
+
+class _StatusError(Exception):
+    def __init__(self, status, headers=None):
+        super().__init__(f"HTTP {status}")
+        self.response = types.SimpleNamespace(status_code=status, headers=headers or {})
+
+
+def test_token_bucket_refills_at_rate(clock):
+    bucket = TokenBucket(60)
+    bucket.acquire(60)
+    assert clock.sleeps == []
+    # 每秒补充 1 个令牌
+    bucket.acquire(2)
+    assert clock.sleeps == [2.0]
+    bucket.drain()
+    bucket.acquire(1)
+    assert clock.sleeps == [2.0, 1.0]
+    # 超过容量的请求按容量计算，不会永远等待
+    TokenBucket(10).acquire(1000)
+    TokenBucket(0).acquire(1000)
+
+
+def test_aimd_limits():
+    limiter = AdaptiveLimiter(8, min_concurrency=2, latency_target=5)
+    limiter.on_throttle()
+    assert limiter.limit == 4
+    limiter.on_success(1.0)
+    assert limiter.limit == 4.25
+    limiter.on_success(10.0)
+    assert limiter.limit == pytest.approx(3.825)
+    for _ in range(5):
+        limiter.on_throttle()
+    assert limiter.limit == 2
+    for _ in range(200):
+        limiter.on_success(1.0)
+    assert limiter.limit == 8
+
+
+def test_retry_info():
+    assert retry_info(_StatusError(429, {"retry-after": "3"})) == (True, 429, 3.0)
+    assert retry_info(_StatusError(503)) == (True, 503, None)
+    assert retry_info(_StatusError(400)) == (False, 400, None)
+    # 共享网关已经重试过的错误不再重试
+    assert retry_info(_StatusError(503, {NO_RETRY_HEADER: "1"}))[0] is False
+    transport_error = type("TransportError", (Exception,), {})
+    assert retry_info(transport_error()) == (True, None, None)
+    assert retry_info(ValueError()) == (False, None, None)
+
+
+def test_scheduler_retries_and_backs_off(clock):
+    provider = ProviderScheduler("test", dict(_DEFAULT_LIMITS, max_concurrency=4, max_retries=2))
+    attempts = []
+
+    def _flaky():
+        attempts.append(clock.now)
+        if len(attempts) == 1:
+            raise _StatusError(429, {"retry-after": "5"})
+        return "ok"
+
+    assert provider.run(_flaky) == "ok"
+    assert clock.sleeps == [5.0] and provider.limiter.limit == 2.5
+
+    def _always_failing():
+        raise _StatusError(500)
+
+    with pytest.raises(_StatusError):
+        provider.run(_always_failing)
+    assert len(clock.sleeps) == 3
+
+    def _bad_request():
+        attempts.append(clock.now)
+        raise _StatusError(400)
+
+    count = len(attempts)
+    with pytest.raises(_StatusError):
+        provider.run(_bad_request)
+    assert len(attempts) == count + 1
@@ -0,0 +1,56 @@
+from deepaide.session_store import Session, SessionStore
+
+USER = {"role": "user", "content": "你好"}
+ASSISTANT = {"role": "assistant", "content": "hi"}
+
+
+def _lines(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read().splitlines()
+
+
+def test_commit_appends_or_rewrites_log(tmp_path):
+    path = str(tmp_path / "s.jsonl")
+    session = Session("s", path)
+    session.commit([], USER, ASSISTANT)
+    first = _lines(path)
+    assert first == ['{"role":"user","content":"你好"}', '{"role":"assistant","content":"hi"}']
+
+    # 历史未变时只追加
+    session.commit(session.messages, USER, ASSISTANT)
+    assert _lines(path)[:2] == first and len(_lines(path)) == 4
+
+    # 历史被压缩时原子地重写整个日志
+    summary = [{"role": "user", "content": "summary"}, {"role": "assistant", "content": "OK"}]
+    session.commit(summary, USER, ASSISTANT)
+    assert len(_lines(path)) == 4 and _lines(path)[0] == '{"role":"user","content":"summary"}'
+    assert not (tmp_path / "s.jsonl.tmp").exists()
+    assert Session("s", path).messages == session.messages
+
+    session.clear()
+    assert _lines(path) == [] and session.messages == []
+
+
+def test_load_skips_truncated_last_line(tmp_path):
+    path = tmp_path / "s.jsonl"
+    path.write_text('{"role":"user","content":"a"}\n{"role":"assis', encoding="utf-8")
+    session = Session("s", str(path))
+    assert session.messages == [{"role": "user", "content": "a"}]
+    assert session.encoded == ['{"role":"user","content":"a"}']
+
+
+def test_store_shares_sessions_and_evicts_idle_ones(tmp_path):
+    store = SessionStore(str(tmp_path / "sessions"), max_hot_sessions=1)
+    with store.open("a/b c") as session:
+        session.append(USER)
+        # 使用中的会话不会被淘汰
+        with store.open("other") as other:
+            assert set(store.sessions) == {"a/b c", "other"}
+            other.append(ASSISTANT)
+    with store.open("third"):
+        pass
+    assert list(store.sessions) == ["third"]
+    # 淘汰后重新打开时从日志加载
+    with store.open("a/b c") as session:
+        assert session.messages == [USER]
+    assert all("/" not in name for name in (p.name for p in (tmp_path / "sessions").iterdir()))
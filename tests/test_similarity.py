@@ -0,0 +1,58 @@
+import pytest
+import deepaide.similarity as similarity
+from deepaide.similarity import SimilarityCache, normalize_text, shingles, jaccard, lookup_similar, remember_similar
+
+PROMPT = "A cozy cabin in the snowy mountains at dusk, warm light glowing from the windows"
+
+
+def _params(prompt, system="Expand the prompt", temperature=0):
+    return {"model": "m", "temperature": temperature,
+            "messages": [{"role": "system", "content": system}, {"role": "user", "content": prompt}]}
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = SimilarityCache(max_entries=3)
+    monkeypatch.setattr(similarity, "_cache", cache)
+    return cache
+
+
+def test_normalization_ignores_width_case_and_punctuation():
+    assert normalize_text("  Ｈｅｌｌｏ，  World!! ") == "hello world"
+    assert shingles("Hello, world") == shingles("hello world")
+    assert shingles("ab") == frozenset(["ab"])
+    assert jaccard(shingles("雪山小屋"), shingles("雪山小屋")) == 1.0 and jaccard(frozenset(), shingles("a")) == 0.0
+
+
+def test_near_duplicates_match_and_others_do_not(cache):
+    remember_similar("https://api", _params(PROMPT), 0, ["answer"])
+    hit = lookup_similar("https://api", _params(PROMPT.upper() + "!!"), 0, 0.9)
+    assert hit == (["answer"], 1.0)
+    value, score = lookup_similar("https://api", _params(PROMPT.replace("dusk", "dawn")), 0, 0.8)
+    assert value == ["answer"] and 0.8 <= score < 1.0
+    assert lookup_similar("https://api", _params("A robot walking on the beach"), 0, 0.5) is None
+    # 系统提示词、采样参数或服务商不同时不匹配
+    assert lookup_similar("https://api", _params(PROMPT, system="Translate"), 0, 0.9) is None
+    assert lookup_similar("https://api", _params(PROMPT, temperature=0.5), 0, 0.9) is None
+    assert lookup_similar("https://other", _params(PROMPT), 0, 0.9) is None
+    # 多模态消息不参与
+    assert lookup_similar("https://api", _params([{"type": "text", "text": PROMPT}]), 0, 0.5) is None
+
+
+def test_lru_eviction_clears_buckets(cache):
+    for index in range(5):
+        cache.add("scope", f"prompt number {index} " + "x" * index, index)
+    assert len(cache.entries) == 3
+    assert cache.lookup("scope", "prompt number 0 ", 0.99) is None
+    assert cache.lookup("scope", "prompt number 4 xxxx", 0.99) == (4, 1.0)
+    live = set(cache.entries)
+    assert all(ids <= live for ids in cache.buckets.values())
+
+
+def test_expired_entries_are_dropped(monkeypatch):
+    cache = SimilarityCache(ttl=60)
+    cache.add("scope", PROMPT, "old")
+    now = similarity.time.time()
+    monkeypatch.setattr(similarity.time, "time", lambda: now + 61)
+    assert cache.lookup("scope", PROMPT, 0.5) is None
+    assert not cache.entries and not cache.buckets
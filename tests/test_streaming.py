@@ -0,0 +1,85 @@
+import json
+import httpx
+import pytest
+from deepaide.streaming import iter_sse_events, stream_chat_completion, StreamPreview
+
+
+def _event(choices=None, usage=None):
+    data = {"choices": choices or []}
+    if usage:
+        data["usage"] = usage
+    return b"data: " + json.dumps(data).encode() + b"\n\n"
+
+
+def _delta(index, reasoning=None, content=None, finish_reason=None):
+    delta = {}
+    if reasoning:
+        delta["reasoning_content"] = reasoning
+    if content:
+        delta["content"] = content
+    return {"index": index, "delta": delta, "finish_reason": finish_reason}
+
+
+def _split(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+BODY = b"".join([
+    b": keep-alive\n\n",
+    _event([_delta(0, reasoning="think ")]),
+    _event([_delta(0, reasoning="more"), _delta(1, content="B")]),
+    _event([_delta(0, content="A1 ")]),
+    _event([_delta(0, content="A2", finish_reason="stop"), _delta(1, content="b", finish_reason="length")]),
+    _event(usage={"prompt_tokens": 3, "completion_tokens": 5}),
+    b"data: [DONE]\n\n",
+    _event([_delta(0, content="ignored")]),
+])
+
+
+def test_sse_parser_handles_any_chunking():
+    expected = list(iter_sse_events([BODY]))
+    assert len(expected) == 5
+    for size in (1, 2, 7, 64):
+        assert list(iter_sse_events(_split(BODY, size))) == expected
+
+
+class _Server:
+    def __init__(self):
+        self.events = []
+
+    def send_sync(self, event, data):
+        self.events.append(data)
+
+
+def test_stream_chat_completion_accumulates_choices():
+    sent = []
+
+    def _handler(request):
+        sent.append(json.loads(request.content))
+        return httpx.Response(200, content=iter(_split(BODY, 5)))
+
+    server = _Server()
+    preview = StreamPreview(server, 7, interval=0)
+    with httpx.Client(transport=httpx.MockTransport(_handler)) as client:
+        result = stream_chat_completion(client, "https://api/chat/completions", {}, {"model": "m"}, preview)
+
+    assert sent[0]["stream"] is True
+    assert result.choices == [("think more", "A1 A2", "stop"), (None, "Bb", "length")]
+    assert (result.reasoning, result.content, result.finish_reason) == ("think more", "A1 A2", "stop")
+    assert result.usage == {"prompt_tokens": 3, "completion_tokens": 5}
+    assert result.ttft is not None and result.elapsed >= result.ttft
+    # 只预览第一个候选
+    statuses = [event["status"] for event in server.events]
+    assert statuses[0] == "start" and statuses[-1] == "done"
+    previewed = "".join(event.get("content", "") for event in server.events)
+    assert previewed == "A1 A2" and all(event["node"] == "7" for event in server.events)
+
+
+def test_stream_error_status_raises():
+    def _handler(request):
+        return httpx.Response(429, json={"error": "slow down"})
+
+    with httpx.Client(transport=httpx.MockTransport(_handler)) as client:
+        with pytest.raises(httpx.HTTPStatusError) as info:
+            stream_chat_completion(client, "https://api/chat/completions", {}, {"model": "m"})
+    assert "slow down" in info.value.response.text
@@ -0,0 +1,67 @@
+import json
+import threading
+import httpx
+import pytest
+import deepaide.telemetry as telemetry
+from deepaide.telemetry import CallTrace, MetricsRegistry, normalize_usage, current_trace, run_with_trace
+
+
+@pytest.fixture
+def metrics(monkeypatch, tmp_path):
+    registry = MetricsRegistry(recent_size=2, log_path=str(tmp_path / "metrics.jsonl"))
+    monkeypatch.setattr(telemetry, "_metrics", registry)
+    return registry
+
+
+def test_normalize_usage_flattens_provider_details():
+    usage = normalize_usage({"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15,
+                             "completion_tokens_details": {"reasoning_tokens": 3},
+                             "prompt_cache_hit_tokens": 6, "prompt_cache_miss_tokens": 4})
+    assert usage["reasoning_tokens"] == 3
+    assert usage["prompt_cache_hit_ratio"] == 0.6
+    assert normalize_usage(None) == {}
+
+
+def test_trace_binds_to_thread_and_records_metrics(metrics):
+    with CallTrace("deepseek", "m") as trace:
+        assert current_trace() is trace
+        # 其他线程中看不到这次调用，除非显式传过去
+        seen = []
+        thread = threading.Thread(target=lambda: seen.append(current_trace()))
+        thread.start()
+        thread.join()
+        assert seen == [None]
+        assert run_with_trace("other", current_trace) == "other"
+        trace.record_response({"prompt_tokens": 10, "completion_tokens": 5}, ttft=0.1)
+    assert current_trace() is None
+
+    with pytest.raises(RuntimeError), CallTrace("deepseek", "m"):
+        raise RuntimeError("boom")
+    with CallTrace("deepseek", "m") as cached:
+        cached.cached = True
+
+    text = metrics.prometheus()
+    assert 'deepaide_requests_total{provider="deepseek",model="m",status="ok",cached="false"} 1' in text
+    assert 'deepaide_requests_total{provider="deepseek",model="m",status="error",cached="false"} 1' in text
+    assert 'deepaide_tokens_total{provider="deepseek",model="m",type="prompt_tokens"} 10' in text
+    # 只有成功且未命中缓存的调用计入延迟直方图
+    assert 'deepaide_latency_seconds_count{provider="deepseek",model="m",phase="total"} 1' in text
+    # 最近的记录只保留 recent_size 条，日志文件保存全部
+    assert [json.loads(line)["status"] for line in metrics.jsonl().splitlines()] == ["error", "ok"]
+    with open(metrics.log_path, encoding="utf-8") as f:
+        assert len(f.readlines()) == 3
+
+
+def test_http_hooks_fill_phases(metrics):
+    def _handler(request):
+        return httpx.Response(200, json={})
+
+    client = httpx.Client(transport=httpx.MockTransport(_handler),
+                          event_hooks={"request": [telemetry.on_http_request]})
+    with CallTrace("siliconflow", "m") as trace:
+        client.get("https://api/test")
+        client.get("https://api/test")
+    assert trace.attempts == 2
+    record = trace.to_dict()
+    assert set(record["timings"]) >= {"config", "total"}
+    assert record["timings"]["config"] <= record["timings"]["total"]
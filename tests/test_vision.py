@@ -0,0 +1,62 @@
+import io
+import base64
+import pytest
+import deepaide.vision as vision
+from deepaide.vision import EncodedImageCache, encode_images, image_content, supports_images
+from deepaide.telemetry import CallTrace
+
+# torch / numpy / PIL 由 ComfyUI 提供
+torch = pytest.importorskip("torch")
+Image = pytest.importorskip("PIL.Image")
+
+
+@pytest.fixture
+def image_cache(monkeypatch):
+    cache = EncodedImageCache(10 ** 7)
+    monkeypatch.setattr(vision, "_cache", cache)
+    return cache
+
+
+def _decode(url):
+    assert url.startswith("data:image/jpeg;base64,")
+    return Image.open(io.BytesIO(base64.b64decode(url.split(",", 1)[1])))
+
+
+def test_frames_are_resized_and_cached_by_content(image_cache):
+    frame = torch.rand(300, 600, 4)
+    batch = torch.stack([frame, frame.clone(), torch.zeros(300, 600, 4)])
+    trace = CallTrace("siliconflow", "Qwen/Qwen3-VL-235B-A22B-Instruct", record=False)
+    with trace:
+        urls = encode_images(batch, max_side=120)
+    assert _decode(urls[0]).size == (120, 60)
+    # 内容相同的帧只编码一次
+    assert urls[0] == urls[1] != urls[2]
+    assert trace.extra["images"]["count"] == 3 and trace.extra["images"]["cache_hits"] == 1
+    assert len(image_cache.entries) == 2
+
+    # 编码参数不同时分别缓存；单帧张量也可以直接传入
+    with trace:
+        webp = encode_images(frame, image_format="webp", max_side=120)
+    assert webp[0].startswith("data:image/webp;base64,") and trace.extra["images"]["cache_hits"] == 0
+    with trace:
+        assert encode_images(batch[:1], max_side=120) == urls[:1]
+    assert trace.extra["images"]["cache_hits"] == 1
+    with pytest.raises(ValueError):
+        encode_images(frame, image_format="png")
+
+
+def test_cache_evicts_by_total_size():
+    cache = EncodedImageCache(12)
+    cache.set("a", ("x" * 6, 4))
+    cache.set("b", ("y" * 4, 3))
+    assert cache.get("a") is not None
+    cache.set("c", ("z" * 5, 4))
+    # 超出容量时淘汰最久未用的条目
+    assert cache.get("b") is None and cache.size == 11
+    assert cache.get("a") is not None and cache.get("c") is not None
+
+
+def test_content_layout():
+    assert supports_images("Qwen/Qwen3-VL-235B-A22B-Instruct") and not supports_images("deepseek-chat")
+    assert image_content("hi", ["data:1"]) == [
+        {"type": "image_url", "image_url": {"url": "data:1"}}, {"type": "text", "text": "hi"}]
@@ -0,0 +1,65 @@
+# 本地快速 token 估算，用于上下文预算和限速
+# DeepSeek 官方给出的经验值：1 个英文字符约 0.3 个 token，1 个中文字符约 0.6 个 token
+
+# 各模型的上下文窗口（token），未列出的模型使用 DEFAULT_CONTEXT_WINDOW
+CONTEXT_WINDOWS = {
+    "deepseek-chat": 128000,
+    "deepseek-reasoner": 128000,
+    "deepseek-ai/DeepSeek-R1": 160000,
+    "deepseek-ai/DeepSeek-V3.2-Exp": 160000,
+    "moonshotai/Kimi-K2-Thinking": 256000,
+    "moonshotai/Kimi-K2-Instruct-0905": 256000,
+    "zai-org/GLM-4.6": 200000,
+    "Qwen/Qwen3-VL-235B-A22B-Instruct": 256000,
+    "Qwen/Qwen3-VL-235B-A22B-Thinking": 256000,
+}
+DEFAULT_CONTEXT_WINDOW = 64000
+
+# 每条消息的角色、分隔符等额外开销
+_MESSAGE_OVERHEAD = 4
+
+# 每张图片的 token 估算（Qwen VL 约每 32x32 像素 1 个 token，按 1024x1024 的图片计）
+IMAGE_TOKENS = 1024
+
+
+def token_weight(text):
+    """文本的 token 数估计值（浮点数，可以逐段累加，用于流式输出中的增量计数）"""
+    # 非 ASCII 字符（中文等）在 UTF-8 中多为 3 字节，用字节数差推算其数量，避免逐字符遍历
+    non_ascii = (len(text.encode("utf-8")) - len(text)) // 2
+    ascii_chars = max(0, len(text) - non_ascii)
+    return ascii_chars * 0.3 + non_ascii * 0.6
+
+
+def estimate_tokens(text):
+    """估算文本的 token 数"""
+    if not text:
+        return 0
+    if not isinstance(text, str):
+        text = str(text)
+    return int(token_weight(text)) + 1
+
+
+def estimate_content_tokens(content):
+    """估算消息内容的 token 数；多模态内容（列表）中的图片按固定数量计，不按 base64 长度估算"""
+    if isinstance(content, list):
+        return sum(IMAGE_TOKENS if part.get("type") == "image_url" else estimate_tokens(part.get("text"))
+                   for part in content)
+    return estimate_tokens(content)
+
+
+def estimate_messages_tokens(messages):
+    """估算 messages 列表的 token 数"""
+    return sum(estimate_content_tokens(m.get("content")) + _MESSAGE_OVERHEAD for m in messages)
+
+
+def context_window(model):
+    return CONTEXT_WINDOWS.get(model, DEFAULT_CONTEXT_WINDOW)
+
+
+def clamp_max_tokens(model, messages, max_tokens):
+    """预检：把 max_tokens 限制在剩余上下文之内，放不下时直接报错而不是发送必然失败的请求"""
+    remaining = context_window(model) - estimate_messages_tokens(messages)
+    if remaining <= 0:
+        raise ValueError(f"Prompt (~{estimate_messages_tokens(messages)} tokens) exceeds "
+                         f"the context window of {model} ({context_window(model)} tokens)")
+    return min(int(max_tokens), remaining)
@@ -0,0 +1,31 @@
+"""
+批量任务命令行入口：在 ComfyUI 之外用聊天节点相同的请求逻辑处理提示词文件，结果逐行追加到 JSONL。
+
+    python tools/bulk_run.py prompts.jsonl results.jsonl --provider siliconflow --concurrency 16
+    python tools/bulk_run.py prompts.csv results.jsonl --prompt-field caption --mode batch_api
+
+任务中断后用同样的参数再次运行，会从检查点继续，跳过已完成的行并重试失败的行。
+"""
+import os
+import sys
+import importlib.util
+
+PACKAGE_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_package(name="deepaide"):
+    """按路径加载节点包（目录名不是合法的模块名）"""
+    spec = importlib.util.spec_from_file_location(
+        name, os.path.join(PACKAGE_ROOT, "__init__.py"),
+        submodule_search_locations=[PACKAGE_ROOT]
+    )
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+if __name__ == "__main__":
+    load_package()
+    from deepaide.bulk import main
+    main()
@@ -0,0 +1,31 @@
+"""
+共享网关命令行入口：启动 OpenAI 兼容的代理，多个 ComfyUI 工作进程共用连接池、限速、请求合并和响应缓存。
+
+    python tools/gateway.py --host 0.0.0.0 --port 8900
+
+工作进程的 config.json 中把 base_url 设为 http://网关地址:8900/deepseek，
+silicon_base_url 设为 http://网关地址:8900/siliconflow。
+"""
+import os
+import sys
+import importlib.util
+
+PACKAGE_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_package(name="deepaide"):
+    """按路径加载节点包（目录名不是合法的模块名）"""
+    spec = importlib.util.spec_from_file_location(
+        name, os.path.join(PACKAGE_ROOT, "__init__.py"),
+        submodule_search_locations=[PACKAGE_ROOT]
+    )
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+if __name__ == "__main__":
+    load_package()
+    from deepaide.gateway import main
+    main()
@@ -0,0 +1,170 @@
+import threading
+from .config import load_config, get_credentials
+from .telemetry import on_http_request
+from .keypool import parse_keys
+from .interrupt import watch_connection
+
+# 进程级共享的HTTP连接池，按 (base_url, api_key) 复用，
+# 避免每次执行节点都重新做 DNS / TCP / TLS 握手
+_lock = threading.Lock()
+_http_clients = {}
+_openai_clients = {}
+
+
+def load_transport_options():
+    """从配置文件加载连接池参数"""
+    config = load_config()
+    return {
+        "pool_size": int(config.get('pool_size', 16)),
+        "keepalive_expiry": float(config.get('keepalive_expiry', 60.0)),
+        "http2": bool(config.get('http2', True)),
+        "prewarm": bool(config.get('prewarm', False)),
+    }
+
+
+def http2_available():
+    """HTTP/2 需要可选依赖 h2（pip install httpx[http2]）"""
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+class _WatchedStream:
+    """包装 httpcore 的网络连接，每次读写前登记到当前线程的中断监视（见 interrupt.abort_on_interrupt）"""
+
+    def __init__(self, stream):
+        self._stream = stream
+
+    def read(self, max_bytes, timeout=None):
+        watch_connection(self._stream)
+        return self._stream.read(max_bytes, timeout)
+
+    def write(self, buffer, timeout=None):
+        watch_connection(self._stream)
+        self._stream.write(buffer, timeout)
+
+    def close(self):
+        self._stream.close()
+
+    def start_tls(self, ssl_context, server_hostname=None, timeout=None):
+        return _WatchedStream(self._stream.start_tls(ssl_context, server_hostname, timeout))
+
+    def get_extra_info(self, info):
+        return self._stream.get_extra_info(info)
+
+
+class _WatchedBackend:
+    def __init__(self, backend):
+        self._backend = backend
+
+    def connect_tcp(self, *args, **kwargs):
+        return _WatchedStream(self._backend.connect_tcp(*args, **kwargs))
+
+    def connect_unix_socket(self, *args, **kwargs):
+        return _WatchedStream(self._backend.connect_unix_socket(*args, **kwargs))
+
+    def sleep(self, seconds):
+        self._backend.sleep(seconds)
+
+
+def _create_http_client(options):
+    import httpx
+    limits = httpx.Limits(
+        max_connections=options["pool_size"],
+        max_keepalive_connections=options["pool_size"],
+        keepalive_expiry=options["keepalive_expiry"],
+    )
+    http2 = options["http2"] and http2_available()
+    transport = httpx.HTTPTransport(http2=http2, limits=limits)
+    # httpx 没有提供设置 network_backend 的参数，直接替换连接池的；连接池结构不同时退回到不包装
+    pool = getattr(transport, "_pool", None)
+    if pool is not None and hasattr(pool, "_network_backend"):
+        pool._network_backend = _WatchedBackend(pool._network_backend)
+    # 不设置整体超时，保持与原先 requests.post 一致的行为
+    return httpx.Client(
+        http2=http2,
+        transport=transport,
+        timeout=httpx.Timeout(None),
+        # 为每次请求挂上耗时追踪（见 telemetry.py）
+        event_hooks={"request": [on_http_request]},
+    )
+
+
+def get_http_client(base_url, api_key):
+    """获取 (base_url, api_key) 对应的共享 httpx.Client"""
+    key = (base_url, api_key)
+    client = _http_clients.get(key)
+    if client is not None:
+        return client
+    with _lock:
+        client = _http_clients.get(key)
+        if client is None:
+            client = _create_http_client(load_transport_options())
+            _http_clients[key] = client
+        return client
+
+
+def get_openai_client(base_url, api_key):
+    """获取共享连接池的 OpenAI 客户端"""
+    key = (base_url, api_key)
+    client = _openai_clients.get(key)
+    if client is not None:
+        return client
+    http_client = get_http_client(base_url, api_key)
+    with _lock:
+        client = _openai_clients.get(key)
+        if client is None:
+            from openai import OpenAI
+            # 重试由 scheduler 统一负责，关闭 SDK 自带的重试
+            client = OpenAI(
+                api_key=api_key,
+                base_url=base_url,
+                http_client=http_client,
+                max_retries=0
+            )
+            _openai_clients[key] = client
+        return client
+
+
+def prewarm(endpoints):
+    """在后台线程中预先建立连接，endpoints 为 (base_url, api_key) 列表"""
+    def _warm():
+        for base_url, api_key in endpoints:
+            try:
+                client = get_http_client(base_url, api_key)
+                client.get(f"{base_url}/models",
+                           headers={"Authorization": f"Bearer {api_key}"},
+                           timeout=10.0)
+            except Exception as e:
+                print(f"Connection prewarm failed for {base_url}: {e}")
+
+    thread = threading.Thread(target=_warm, name="deepaide-prewarm", daemon=True)
+    thread.start()
+    return thread
+
+
+def prewarm_from_config():
+    """如果 config.json 中开启了 prewarm，则在导入时预热连接"""
+    if not load_transport_options()["prewarm"]:
+        return None
+    endpoints = []
+    for provider in ("deepseek", "siliconflow"):
+        base_url, api_key = get_credentials(provider)
+        endpoints.extend((base_url, key) for key, _ in parse_keys(api_key))
+    if not endpoints:
+        return None
+    return prewarm(endpoints)
+
+
+def close_all():
+    """关闭所有共享连接"""
+    with _lock:
+        for client in _http_clients.values():
+            try:
+                client.close()
+            except Exception:
+                pass
+        _http_clients.clear()
+        _openai_clients.clear()
@@ -0,0 +1,158 @@
+import io
+import time
+import base64
+import hashlib
+import threading
+from collections import OrderedDict
+from .config import load_config
+from .telemetry import current_trace
+
+# 图片输入：把 ComfyUI 的 IMAGE 张量（[B, H, W, C]，0~1 的浮点数）编码成限制尺寸的 JPEG/WebP，
+# 以 data URL 的形式放进用户消息发给视觉模型。编码结果按张量内容哈希缓存，同一帧重复调用时不再缩放和编码。
+# torch/numpy/PIL 都由 ComfyUI 提供，只在实际传入图片时才导入
+
+FORMATS = ["jpeg", "webp"]
+_MIME_TYPES = {"jpeg": "image/jpeg", "webp": "image/webp"}
+_PIL_FORMATS = {"jpeg": "JPEG", "webp": "WEBP"}
+
+# 编码缓存的默认容量（MB，按 data URL 的长度计）
+_DEFAULT_CACHE_MB = 64
+
+
+def supports_images(model):
+    """模型是否接受图片输入（SiliconFlow 上的 Qwen VL 系列）"""
+    return "-VL-" in model
+
+
+class EncodedImageCache:
+    """按总字节数限制容量的 LRU：键为 (内容哈希, 尺寸, 编码参数)，值为 (data_url, 编码后字节数)"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.size = 0
+
+    def get(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key]
+        return None
+
+    def set(self, key, value):
+        with self.lock:
+            if key in self.entries:
+                return
+            self.entries[key] = value
+            self.size += len(value[0])
+            while self.size > self.max_bytes and len(self.entries) > 1:
+                _, (url, _) = self.entries.popitem(last=False)
+                self.size -= len(url)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_image_cache():
+    """获取进程级共享的图片编码缓存"""
+    global _cache
+    if _cache is not None:
+        return _cache
+    with _cache_lock:
+        if _cache is None:
+            megabytes = float(load_config().get('image_cache_mb', _DEFAULT_CACHE_MB))
+            _cache = EncodedImageCache(int(megabytes * 1024 * 1024))
+        return _cache
+
+
+def _frame_array(frame):
+    """单帧张量转成 float32 的 HWC numpy 数组；已在 CPU 上且连续时不复制"""
+    import numpy as np
+    array = frame.detach().cpu().numpy()
+    if array.dtype != np.float32:
+        array = array.astype(np.float32)
+    return np.ascontiguousarray(array)
+
+
+def _frame_hash(array):
+    # 直接对数组的内存做哈希，不生成中间的 bytes 副本
+    return hashlib.sha256(array.data).hexdigest()
+
+
+def _to_uint8(array):
+    """0~1 浮点转 0~255 的 uint8：只分配一个浮点缓冲区，乘法和截断都原地完成"""
+    import numpy as np
+    buffer = np.multiply(array, 255.0)
+    np.clip(buffer, 0.0, 255.0, out=buffer)
+    return buffer.astype(np.uint8)
+
+
+def encode_frame(array, image_format="jpeg", max_side=1024, quality=85):
+    """编码单帧，返回编码后的 bytes"""
+    from PIL import Image
+    # 丢掉 alpha 通道；单通道图片按灰度编码
+    pixels = _to_uint8(array[..., :3])
+    if pixels.shape[-1] == 1:
+        pixels = pixels[..., 0]
+    image = Image.fromarray(pixels)
+    if max_side and max(image.size) > max_side:
+        # thumbnail 保持宽高比，并先用 reduce 做整数倍缩小，比直接重采样快
+        image.thumbnail((max_side, max_side), Image.Resampling.BICUBIC)
+    output = io.BytesIO()
+    image.save(output, format=_PIL_FORMATS[image_format], quality=int(quality))
+    return output.getvalue()
+
+
+def encode_images(image, image_format="jpeg", max_side=1024, quality=85, use_cache=True):
+    """
+    把 IMAGE 张量（整个批次）编码成 data URL 列表。
+    上传字节数、编码耗时和缓存命中数记录在当前调用的 trace.extra["images"] 中。
+    """
+    if image_format not in _MIME_TYPES:
+        raise ValueError(f"Unsupported image format: {image_format}")
+    frames = image if image.dim() == 4 else image.unsqueeze(0)
+    cache = get_image_cache() if use_cache else None
+    prefix = f"data:{_MIME_TYPES[image_format]};base64,"
+    urls = []
+    encoded_bytes = 0
+    cache_hits = 0
+    started = time.perf_counter()
+    for frame in frames:
+        array = _frame_array(frame)
+        key = (_frame_hash(array), array.shape, image_format, int(max_side), int(quality))
+        cached = cache.get(key) if cache is not None else None
+        if cached is not None:
+            cache_hits += 1
+            url, size = cached
+        else:
+            data = encode_frame(array, image_format, max_side, quality)
+            url, size = prefix + base64.b64encode(data).decode("ascii"), len(data)
+            if cache is not None:
+                cache.set(key, (url, size))
+        urls.append(url)
+        encoded_bytes += size
+
+    trace = current_trace()
+    if trace is not None:
+        trace.extra["images"] = {
+            "count": len(urls),
+            "upload_bytes": sum(len(url) for url in urls),
+            "encoded_bytes": encoded_bytes,
+            "encode_ms": round((time.perf_counter() - started) * 1000, 1),
+            "cache_hits": cache_hits,
+        }
+    return urls
+
+
+def image_content(text, urls):
+    """OpenAI 格式的多模态消息内容：图片在前，文字在后"""
+    parts = [{"type": "image_url", "image_url": {"url": url}} for url in urls]
+    parts.append({"type": "text", "text": text})
+    return parts
@@ -0,0 +1,56 @@
+import { app } from "../../scripts/app.js";
+import { api } from "../../scripts/api.js";
+import { ComfyWidgets } from "../../scripts/widgets.js";
+
+// 在节点上实时显示流式输出的内容
+function getPreviewWidget(node) {
+    let widget = node.widgets?.find((w) => w.name === "stream_preview");
+    if (!widget) {
+        widget = ComfyWidgets["STRING"](node, "stream_preview", ["STRING", { multiline: true }], app).widget;
+        widget.inputEl.readOnly = true;
+        widget.inputEl.style.opacity = 0.7;
+        widget.serialize = false;
+    }
+    return widget;
+}
+
+app.registerExtension({
+    name: "DeepAide.StreamPreview",
+    setup() {
+        api.addEventListener("deepaide.stream", ({ detail }) => {
+            const node = app.graph.getNodeById(Number(detail.node));
+            if (!node) {
+                return;
+            }
+            const widget = getPreviewWidget(node);
+            if (detail.status === "start") {
+                node._deepaideReasoning = "";
+                node._deepaideContent = "";
+                node._deepaideItems = 0;
+            } else if (detail.status === "items") {
+                node._deepaideItems = (node._deepaideItems || 0) + detail.items.length;
+            } else if (detail.status === "delta") {
+                node._deepaideReasoning = (node._deepaideReasoning || "") + (detail.reasoning || "");
+                node._deepaideContent = (node._deepaideContent || "") + (detail.content || "");
+            }
+            let text = node._deepaideReasoning
+                ? `[reasoning]\n${node._deepaideReasoning}\n\n[answer]\n${node._deepaideContent}`
+                : node._deepaideContent || "";
+            if (node._deepaideItems) {
+                text += `\n\n(${node._deepaideItems} JSON items parsed)`;
+            }
+            if (detail.status === "done" && detail.ttft != null) {
+                text += `\n\n(TTFT ${detail.ttft.toFixed(2)}s, total ${detail.elapsed.toFixed(2)}s)`;
+            }
+            if (detail.status === "cancelled") {
+                const reason = {
+                    deadline: "deadline exceeded",
+                    reasoning_budget: "reasoning budget exceeded",
+                }[detail.reason] || "interrupted";
+                text += `\n\n(${reason} after ${detail.elapsed.toFixed(2)}s, partial output)`;
+            }
+            widget.value = text;
+            app.graph.setDirtyCanvas(true, false);
+        });
+    },
+});